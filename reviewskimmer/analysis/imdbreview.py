@@ -4,15 +4,18 @@ import random
 from itertools import chain
 from collections import Counter
 from nltk.corpus import stopwords
+from pandas import DataFrame
 
 def analyze_reviews(reviews):
-    """ Assume reviews is a pandas dataframe. """
+    """ reviews is a pandas DataFrame with (at least) the columns
+        rs_review_movie_score and rs_review_text, or an iterable of
+        them, e.g. from
 
-    good_reviews=reviews[reviews['rs_review_movie_score']>=9]
-    bad_reviews=reviews[reviews['rs_review_movie_score']<=2]
+            connector.iter_reviews(columns=['rs_review_movie_score','rs_review_text'])
 
-    print 'len(good_reviews)=%s' % len(good_reviews)
-    print 'len(bad_reviews)=%s' % len(bad_reviews)
+        so that the reviews don't have to all fit in memory. """
+    if isinstance(reviews, DataFrame):
+        reviews=[reviews]
 
     m = re.compile('\d')
 
@@ -38,14 +41,19 @@ def analyze_reviews(reviews):
         return tokens
 
     good_tokens_list = []
-    for i,review in good_reviews.iterrows():
-        text=review['rs_review_text']
-        good_tokens_list.append(tokenize(text))
-
     bad_tokens_list = []
-    for i,review in bad_reviews.iterrows():
-        text=review['rs_review_text']
-        bad_tokens_list.append(tokenize(text))
+    for chunk in reviews:
+        good_reviews=chunk[chunk['rs_review_movie_score']>=9]
+        bad_reviews=chunk[chunk['rs_review_movie_score']<=2]
+
+        for text in good_reviews['rs_review_text']:
+            good_tokens_list.append(tokenize(text))
+
+        for text in bad_reviews['rs_review_text']:
+            bad_tokens_list.append(tokenize(text))
+
+    print 'len(good_reviews)=%s' % len(good_tokens_list)
+    print 'len(bad_reviews)=%s' % len(bad_tokens_list)
 
     all_words=Counter()
     for tokens in good_tokens_list + bad_tokens_list:
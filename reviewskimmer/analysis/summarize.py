@@ -71,6 +71,9 @@ class ReviewSummarizer(object):
             word = j['rs_feature_name']
             classification = j['rs_classification']
             odds_ratio = j['rs_odds_ratio']
+            if odds_ratio is None or odds_ratio != odds_ratio:
+                # NULL (NaN in the DataFrame) is an infinite odds ratio
+                odds_ratio = float('inf')
 
             num_found=sum(word in i['text']['good_tokens'] for i in self.all_reviews if i['classification'] == classification)
             occurances[word]=dict(
@@ -147,9 +150,11 @@ class CachedReviewSummarizer(ReviewSummarizer):
         if not connector.does_quotes_cache_exist():
             connector.create_quotes_cache()
 
-        if connector.are_quotes_cached(imdb_movie_id):
-            self._data  = connector.get_cached_quotes(imdb_movie_id)
-        else:
+        self._data=connector.get_cached_quotes(imdb_movie_id)
+        if self._data is None:
+            # stamp the quotes with the reviews they were found from,
+            # even if more are added while summarizing
+            nreviews=connector.get_nreviews(imdb_movie_id)
             self._summarize()
-            connector.set_cached_quotes(imdb_movie_id, self._data)
+            connector.set_cached_quotes(imdb_movie_id, self._data, nreviews)
 
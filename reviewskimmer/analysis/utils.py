@@ -33,10 +33,11 @@ def get_most_informative_features(classifier, n=10, column_prefix=''):
         l0 = labels[0] 
         l1 = labels[-1] 
         if cpdist[l0,fname].prob(fval) == 0: 
-            ratio = 'INF' 
+            # infinite, which is stored in the database as NULL
+            ratio = None
         else: 
-            ratio = '%8.1f' % (cpdist[l1,fname].prob(fval) / 
-                              cpdist[l0,fname].prob(fval)) 
+            ratio = (cpdist[l1,fname].prob(fval) / 
+                     cpdist[l0,fname].prob(fval))
         results[feature_name].append(fname)
         results[classification].append(l1)
         results[classification_bool].append(l1==classifier._labels[0])
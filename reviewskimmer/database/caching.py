@@ -0,0 +1,191 @@
+from copy import deepcopy
+
+from reviewskimmer.utils.cache import LRUCache
+
+_MISSING=object()
+
+
+def _make_cached_method(name):
+    def method(self, *args, **kwargs):
+        if not args and 'imdb_movie_id' in kwargs:
+            # so that the movie comes first in the key, which _invalidate relies on
+            args=(kwargs.pop('imdb_movie_id'),)
+        key=(name,)+args+tuple(sorted(kwargs.items()))
+        value=self._get(key)
+        if value is _MISSING:
+            value=getattr(self.connector, name)(*args, **kwargs)
+            self._put(key, value)
+        return value
+    method.__name__=name
+    return method
+
+
+class CachingConnector(object):
+    """ Wrap an IMDBDatabaseConnector (or SnapshotConnector) so that
+        the results of its read methods are remembered in cache (a
+        reviewskimmer.utils.cache.LRUCache, which can be shared by many
+        CachingConnectors, e.g. one per web request).
+
+        Writes made through this connector invalidate what they change.
+        Writes made anywhere else (another process, or a connector
+        which isn't wrapped) are only seen once the cache's ttl runs out.
+
+        Any other method goes straight to the wrapped connector.
+
+        Values are copied into and out of the cache, so callers
+        can change what they get (e.g. sort a DataFrame in place)
+        without changing what other callers see.
+
+        connector can also be a function which returns the connector, which
+        is only called when something isn't cached, so that a request
+        which is served from the cache never connects to the database.
+    """
+
+    # reads which are cached, by their arguments
+    CACHED_METHODS=['get_newest_imdb_movie_id', 'get_imdb_movie_id',
+            'get_movie', 'get_movie_name', 'get_movie_description',
+            'get_imdb_poster_thumbnail_url', 'get_poster_derivatives',
+            'in_database', 'in_movie_database', 'in_review_database',
+            'get_nreviews', 'get_movie_stats',
+            'does_quotes_cache_exist', 'are_quotes_cached', 'get_cached_quotes',
+            'get_most_informative_features', 'get_model_version', 'get_top_grossing',
+            'get_top_100_all_time', 'get_bottom_100_all_time']
+
+    # methods whose results change when a movie is added or removed
+    MOVIE_METHODS=['get_movie', 'get_movie_name', 'get_movie_description',
+            'get_imdb_poster_thumbnail_url', 'in_database', 'in_movie_database',
+            'in_review_database', 'get_nreviews', 'get_movie_stats']
+    NAME_METHODS=['get_newest_imdb_movie_id', 'get_imdb_movie_id']
+    QUOTES_METHODS=['does_quotes_cache_exist', 'are_quotes_cached', 'get_cached_quotes']
+
+    def __init__(self, connector, cache=None):
+        self._connector=connector
+        self.cache=cache if cache is not None else LRUCache()
+
+    @property
+    def connector(self):
+        if callable(self._connector):
+            self._connector=self._connector()
+        return self._connector
+
+    def __getattr__(self, name):
+        return getattr(self.connector, name)
+
+    def _get(self, key):
+        value=self.cache.get(key, _MISSING)
+        return value if value is _MISSING else deepcopy(value)
+
+    def _put(self, key, value):
+        self.cache.put(key, deepcopy(value))
+
+    def _get_many(self, name, batch_name, imdb_movie_ids):
+        """ Read many movies with batch_name, sharing the cache
+            with name, which reads one movie at a time. Only
+            the movies which aren't cached are read. """
+        found=dict()
+        missing=[]
+        for imdb_movie_id in imdb_movie_ids:
+            value=self._get((name,imdb_movie_id))
+            if value is _MISSING:
+                missing.append(imdb_movie_id)
+            else:
+                found[imdb_movie_id]=value
+        if missing:
+            for imdb_movie_id,value in getattr(self.connector, batch_name)(missing).items():
+                self._put((name,imdb_movie_id), value)
+                found[imdb_movie_id]=value
+        return found
+
+    def get_movies(self, imdb_movie_ids):
+        return self._get_many('get_movie', 'get_movies', imdb_movie_ids)
+
+    def get_movie_names(self, imdb_movie_ids):
+        return self._get_many('get_movie_name', 'get_movie_names', imdb_movie_ids)
+
+    def get_poster_derivatives_for_movies(self, imdb_movie_ids):
+        return self._get_many('get_poster_derivatives', 'get_poster_derivatives_for_movies', imdb_movie_ids)
+
+    def _invalidate(self, methods, imdb_movie_id=None):
+        """ Forget the cached results of methods (for
+            one movie, unless imdb_movie_id is None). """
+        methods=set(methods)
+        def predicate(key):
+            return key[0] in methods and \
+                    (imdb_movie_id is None or key[1:2] == (imdb_movie_id,))
+        self.cache.invalidate(predicate)
+
+    def _invalidate_movie(self, imdb_movie_id):
+        self._invalidate(self.MOVIE_METHODS+self.QUOTES_METHODS+['get_poster_derivatives'], imdb_movie_id)
+        # a new movie can change which movie a name finds
+        self._invalidate(self.NAME_METHODS)
+
+    def add_movie(self, movie, force=False, lease_owner=None):
+        try:
+            return self.connector.add_movie(movie, force=force, lease_owner=lease_owner)
+        finally:
+            self._invalidate_movie(movie['imdb_movie_id'])
+
+    def append_reviews(self, imdb_movie_id, reviews):
+        try:
+            return self.connector.append_reviews(imdb_movie_id, reviews)
+        finally:
+            self._invalidate_movie(imdb_movie_id)
+
+    def del_movie(self, imdb_movie_id):
+        try:
+            return self.connector.del_movie(imdb_movie_id)
+        finally:
+            self._invalidate_movie(imdb_movie_id)
+
+    def set_cached_quotes(self, imdb_movie_id, _data, nreviews=None):
+        try:
+            return self.connector.set_cached_quotes(imdb_movie_id, _data, nreviews)
+        finally:
+            self._invalidate(['are_quotes_cached', 'get_cached_quotes'], imdb_movie_id)
+
+    def create_quotes_cache(self):
+        try:
+            return self.connector.create_quotes_cache()
+        finally:
+            self._invalidate(self.QUOTES_METHODS)
+
+    def delete_quotes_cache(self):
+        try:
+            return self.connector.delete_quotes_cache()
+        finally:
+            self._invalidate(self.QUOTES_METHODS)
+
+    def set_poster_derivatives(self, imdb_movie_id, derivatives):
+        try:
+            return self.connector.set_poster_derivatives(imdb_movie_id, derivatives)
+        finally:
+            self._invalidate(['get_poster_derivatives'], imdb_movie_id)
+
+    def set_most_informative_features(self, features):
+        try:
+            return self.connector.set_most_informative_features(features)
+        finally:
+            # which also makes the cached quotes stale
+            self._invalidate(['get_most_informative_features','get_model_version']+self.QUOTES_METHODS)
+
+    def create_top_grossing(self, top_grossing):
+        try:
+            return self.connector.create_top_grossing(top_grossing)
+        finally:
+            self._invalidate(['get_top_grossing'])
+
+    def create_top_100_all_time(self, top_100_all_time):
+        try:
+            return self.connector.create_top_100_all_time(top_100_all_time)
+        finally:
+            self._invalidate(['get_top_100_all_time'])
+
+    def create_bottom_100_all_time(self, bottom_100_all_time):
+        try:
+            return self.connector.create_bottom_100_all_time(bottom_100_all_time)
+        finally:
+            self._invalidate(['get_bottom_100_all_time'])
+
+
+for _name in CachingConnector.CACHED_METHODS:
+    setattr(CachingConnector, _name, _make_cached_method(_name))
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+""" Export the reviews into a directory of flat, column by column
+    files which can be memory mapped, so analysis can start without
+    reading the whole corpus out of MySQL (or into memory).
+
+    To export the reviews:
+
+        python -m reviewskimmer.database.columnar $REVIEWSKIMMER_MEDIA_DIR/reviews
+
+    and then to read them:
+
+        reviews=ColumnarReviews('$REVIEWSKIMMER_MEDIA_DIR/reviews')
+        analyze_reviews(reviews.iter_chunks(['rs_review_movie_score','rs_review_text']))
+
+    The database is read from the RDS_HOSTNAME, RDS_PORT,
+    RDS_USERNAME, RDS_PASSWORD and RDS_DB_NAME environment variables.
+"""
+import os
+import json
+import shutil
+import argparse
+from datetime import date
+from os.path import join, exists, expandvars
+
+import numpy as np
+from pandas import DataFrame
+
+FORMAT_VERSION=1
+
+# Numeric columns, with their dtype and the value which stands for NULL.
+# Dates are stored as the number of days since 1970-01-01.
+NUMERIC_COLUMNS=[
+        ('rs_imdb_movie_id', 'int32', None),
+        ('rs_imdb_reviewer_id', 'int32', None),
+        ('rs_review_movie_score', 'int8', 0),
+        ('rs_review_date', 'int32', None),
+        ('rs_num_likes', 'int32', -1),
+        ('rs_num_dislikes', 'int32', -1),
+        ('rs_imdb_review_ranking', 'int32', -1),
+        ]
+
+# Text columns are stored (utf-8 encoded) end to end in one file, with
+# an array of len(reviews)+1 offsets into it. NULL is stored as ''.
+TEXT_COLUMNS=['rs_reviewer', 'rs_review_text']
+
+_EPOCH=date(1970,1,1).toordinal()
+
+def date_to_day(d):
+    return d.toordinal()-_EPOCH
+
+def day_to_date(day):
+    return date.fromordinal(int(day)+_EPOCH)
+
+
+def _encode(text):
+    if text is None:
+        return ''
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return text
+
+
+def export_reviews(connector, directory, chunksize=10000):
+    """ Write every review in the database into directory (which is
+        replaced once the export is done). The reviews are streamed
+        from the database, so the export runs in bounded memory.
+        Returns the number of reviews exported. """
+    tmp_directory=directory+'.tmp'
+    if exists(tmp_directory):
+        shutil.rmtree(tmp_directory)
+    os.makedirs(tmp_directory)
+
+    numeric_files=dict((name,open(join(tmp_directory,name+'.bin'),'wb'))
+            for name,dtype,null in NUMERIC_COLUMNS)
+    text_files=dict((name,open(join(tmp_directory,name+'.bin'),'wb'))
+            for name in TEXT_COLUMNS)
+    offset_files=dict((name,open(join(tmp_directory,name+'.offsets.bin'),'wb'))
+            for name in TEXT_COLUMNS)
+    text_sizes=dict((name,0) for name in TEXT_COLUMNS)
+    for name in TEXT_COLUMNS:
+        np.array([0],dtype='int64').tofile(offset_files[name])
+
+    columns=[name for name,dtype,null in NUMERIC_COLUMNS]+TEXT_COLUMNS
+    nreviews=0
+    for chunk in connector.iter_reviews(columns=columns, chunksize=chunksize):
+        for name,dtype,null in NUMERIC_COLUMNS:
+            values=chunk[name].tolist()
+            if name == 'rs_review_date':
+                values=[date_to_day(i) for i in values]
+            values=[null if i is None or i != i else i for i in values]
+            np.array(values,dtype=dtype).tofile(numeric_files[name])
+
+        for name in TEXT_COLUMNS:
+            texts=[_encode(i) for i in chunk[name]]
+            text_files[name].write(''.join(texts))
+            offsets=text_sizes[name]+np.cumsum([len(i) for i in texts],dtype='int64')
+            offsets.tofile(offset_files[name])
+            text_sizes[name]=int(offsets[-1])
+
+        nreviews+=len(chunk)
+
+    for f in numeric_files.values()+text_files.values()+offset_files.values():
+        f.close()
+
+    meta=dict(version=FORMAT_VERSION, nreviews=nreviews,
+            numeric_columns=NUMERIC_COLUMNS, text_columns=TEXT_COLUMNS)
+    open(join(tmp_directory,'meta.json'),'w').write(json.dumps(meta, indent=2))
+
+    if exists(directory):
+        shutil.rmtree(directory)
+    os.rename(tmp_directory, directory)
+    return nreviews
+
+
+def _memmap(filename, dtype, shape):
+    # np.memmap can't map an empty file
+    if shape == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode='r', shape=(shape,))
+
+
+class ColumnarReviews(object):
+    """ Reviews written by export_reviews. Every column is memory mapped,
+        so opening them is instant, nothing is read until it is used, and
+        processes reading the same reviews share the pages. """
+
+    def __init__(self, directory):
+        self.directory=expandvars(directory)
+        meta=json.load(open(join(self.directory,'meta.json')))
+        if meta['version'] != FORMAT_VERSION:
+            raise Exception("Unsupported columnar review format %s" % meta['version'])
+
+        self.nreviews=meta['nreviews']
+        self.nulls=dict()
+        self._columns=dict()
+        for name,dtype,null in meta['numeric_columns']:
+            self._columns[name]=_memmap(join(self.directory,name+'.bin'), dtype, self.nreviews)
+            self.nulls[name]=null
+
+        self.text_columns=meta['text_columns']
+        self._offsets=dict()
+        self._texts=dict()
+        for name in self.text_columns:
+            self._offsets[name]=_memmap(join(self.directory,name+'.offsets.bin'), 'int64', self.nreviews+1)
+            self._texts[name]=_memmap(join(self.directory,name+'.bin'), 'uint8', int(self._offsets[name][-1]))
+
+    def __len__(self):
+        return self.nreviews
+
+    @property
+    def columns(self):
+        return sorted(self._columns.keys())+self.text_columns
+
+    def __getitem__(self, name):
+        """ The (memory mapped) array of a numeric column. """
+        return self._columns[name]
+
+    def get_text(self, name, i):
+        """ The text of review i in the text column name. """
+        offsets=self._offsets[name]
+        return self._texts[name][offsets[i]:offsets[i+1]].tostring()
+
+    def get_texts(self, name, start, stop):
+        offsets=self._offsets[name]
+        data=self._texts[name][offsets[start]:offsets[stop]].tostring()
+        starts=offsets[start:stop+1]-offsets[start]
+        return [data[a:b] for a,b in zip(starts[:-1],starts[1:])]
+
+    def get_dates(self):
+        """ The review dates, as an array of numpy datetime64s. """
+        return self._columns['rs_review_date'].astype('int64').view('datetime64[D]')
+
+    def iter_chunks(self, columns=None, chunksize=10000):
+        """ Iterate over DataFrames of at most chunksize reviews,
+            with only the given columns (like connector.iter_reviews,
+            so they can be passed into analyze_reviews). """
+        if columns is None:
+            columns=self.columns
+        for start in range(0,self.nreviews,chunksize):
+            stop=min(start+chunksize,self.nreviews)
+            data=dict()
+            for name in columns:
+                if name in self.text_columns:
+                    data[name]=self.get_texts(name, start, stop)
+                else:
+                    values=np.asarray(self._columns[name][start:stop])
+                    null=self.nulls[name]
+                    if null is not None and (values==null).any():
+                        # NULLs come back as NaN, like they do from the database
+                        values=values.astype('float64')
+                        values[values==null]=np.nan
+                    data[name]=values
+            yield DataFrame(data, columns=columns)
+
+
+if __name__ == '__main__':
+    parser=argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory', help='The directory to write the reviews to.')
+    parser.add_argument('--chunksize', type=int, default=10000)
+    args=parser.parse_args()
+
+    import MySQLdb
+    from reviewskimmer.database.dbconnect import IMDBDatabaseConnector
+    db=MySQLdb.Connection(host=os.environ['RDS_HOSTNAME'],
+            user=os.environ['RDS_USERNAME'],
+            port=int(os.environ['RDS_PORT']),
+            passwd=os.environ['RDS_PASSWORD'],
+            db=os.environ['RDS_DB_NAME'])
+    nreviews=export_reviews(IMDBDatabaseConnector(db), expandvars(args.directory), args.chunksize)
+    print 'Exported %s reviews' % nreviews
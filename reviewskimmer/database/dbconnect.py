@@ -1,19 +1,82 @@
 from datetime import datetime
-import pickle
+from contextlib import contextmanager
+import math
+import json
+import zlib
+import hashlib
 import traceback
 import urllib
 import pandas.io.sql as psql
+from pandas import DataFrame
+
+from reviewskimmer.utils.list import iter_batches, spool
+from reviewskimmer.database import migrations
+
+
+class LeaseLost(Exception):
+    """ The worker's lease on an ingest job expired
+        or was taken over by another worker. """
+    pass
+
 
 class IMDBDatabaseConnector(object):
     """ Class to interface with the movie database. """
 
-    def __init__(self, db):
+    def __init__(self, db, review_batch_size=500):
+        """ review_batch_size is the number of reviews read
+            at a time from a movie's (possibly streamed) reviews
+            when they are added to the database. Each batch is
+            written with a single multi-row INSERT, so it should
+            be small enough to fit in MySQL's max_allowed_packet. """
         self.db=db
+        self.review_batch_size=review_batch_size
 
     def get_most_informative_features(self):
         return psql.frame_query("""SELECT * FROM rs_most_informative_features""", con=self.db)
     def set_most_informative_features(self, features):
+        """ Save the features, and give them a new model version, which
+            makes every cached quote built with the old ones stale. """
+        model_version=hashlib.sha1(repr((list(features.columns),features.values.tolist()))).hexdigest()
+
+        # infinite odds ratios are NaN, which have to be written as NULL
+        features=features.copy()
+        odds_ratio=features['rs_odds_ratio']
+        features['rs_odds_ratio']=odds_ratio.astype(object).where(odds_ratio.notnull(), None)
         psql.write_frame(features, con=self.db, name='rs_most_informative_features', if_exists='replace', flavor='mysql')
+        self.db.query("""
+            ALTER TABLE rs_most_informative_features MODIFY rs_odds_ratio DOUBLE
+        """)
+
+        self.create_model_version_table()
+        self.modify_db("""
+            REPLACE INTO rs_model_version
+            VALUES (1,%s,%s)""",
+            (model_version, self.format_time(datetime.now()))
+        )
+
+    def create_model_version_table(self):
+        self.db.query("""
+            CREATE TABLE IF NOT EXISTS rs_model_version (
+            rs_id INT NOT NULL PRIMARY KEY,
+            rs_version VARCHAR(40) NOT NULL,
+            rs_updated DATETIME NOT NULL
+            );
+        """)
+
+    def get_model_version(self):
+        """ The version of the most informative features
+            (None if they were saved before versions existed). """
+        if not self.table_exists('rs_model_version'):
+            return None
+        l=self.query_db("""SELECT rs_version FROM rs_model_version""")
+        return l[0][0] if len(l)>0 else None
+
+    def table_exists(self, table):
+        l=self.query_db("""
+            SELECT COUNT(*) FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME=%s""",
+            (table,))
+        return l[0][0]==1
 
 
     def delete_db(self):
@@ -21,6 +84,8 @@ class IMDBDatabaseConnector(object):
         db=self.db
         db.query("DROP TABLE IF EXISTS rs_movies")
         db.query("DROP TABLE IF EXISTS rs_reviews")
+        db.query("DROP TABLE IF EXISTS rs_movie_stats")
+        db.query("DROP TABLE IF EXISTS rs_schema_version")
 
     def create_bottom_100_all_time(self,bottom_100_all_time):
         """ bottom_100_all_time should be a pandas DataFrame that comes from
@@ -44,20 +109,25 @@ class IMDBDatabaseConnector(object):
 
     def create_schema(self):
         """ Create the schema for the IMDB reviews databse.
+            Existing databases are upgraded to it with
+            reviewskimmer.database.migrations.migrate.
         """
         db=self.db
         db.query("""
             CREATE TABLE rs_movies (
             rs_imdb_movie_id INT NOT NULL PRIMARY KEY,
-            rs_movie_name TEXT NOT NULL,
-            rs_budget TEXT,
-            rs_gross TEXT,
+            rs_movie_name VARCHAR(255) NOT NULL,
+            rs_budget DOUBLE,
+            rs_gross DOUBLE,
             rs_imdb_movie_url TEXT NOT NULL,
             rs_imdb_poster_url TEXT,
             rs_imdb_poster_thumbnail_url TEXT,
             rs_db_insert_time DATETIME NOT NULL,
             rs_release_date DATE,
-            rs_imdb_description TEXT
+            rs_imdb_description TEXT,
+            rs_last_scraped DATETIME,
+            rs_nreviews_at_scrape INT,
+            INDEX rs_movie_name (rs_movie_name, rs_release_date)
             );
         """);
 
@@ -75,10 +145,15 @@ class IMDBDatabaseConnector(object):
             rs_imdb_review_ranking INT,
             rs_review_place TEXT,
             rs_imdb_review_url TEXT NOT NULL,
-            rs_review_text TEXT
+            rs_review_text TEXT,
+            INDEX rs_imdb_movie_id (rs_imdb_movie_id)
             );
         """)
 
+        self.create_movie_stats_table()
+
+        migrations.stamp_schema_version(self)
+
     @staticmethod
     def format_time(time):
         if time is None:
@@ -94,10 +169,13 @@ class IMDBDatabaseConnector(object):
             return urllib.unquote(url)
 
     def modify_db(self, a, b=None):
+        """ Run a query which modifies the database.
+            Returns the number of rows affected. """
         try:
             c=self.db.cursor()
             ex=c.execute(a,b)
             self.db.commit()
+            return ex
         except Exception, ex:
             print "Error running query %s" % ex
             traceback.print_exc()
@@ -115,7 +193,21 @@ class IMDBDatabaseConnector(object):
         finally:
             c.close()
 
-    def _add_movie_description(self,movie):
+    @contextmanager
+    def _transaction(self):
+        """ Yield a cursor, and commit everything run with it at the
+            end (or roll it all back if there was an error). """
+        c=self.db.cursor()
+        try:
+            yield c
+            self.db.commit()
+        except:
+            self.db.rollback()
+            raise
+        finally:
+            c.close()
+
+    def _add_movie_description(self,movie,c):
         """ Add in the IMDB descriptions of the movie. """
 
         rs_imdb_movie_id=movie['imdb_movie_id']
@@ -128,37 +220,105 @@ class IMDBDatabaseConnector(object):
         rs_imdb_poster_url=self.format_url(movie['imdb_poster_url'])
         rs_imdb_poster_thumbnail_url=self.format_url(movie['imdb_poster_thumbnail_url'])
         rs_imdb_description=movie['imdb_description']
+        rs_last_scraped=self.format_time(rs_db_insert_time)
+        rs_nreviews_at_scrape=movie['nreviews']
 
-        self.modify_db("""
+        c.execute("""
             INSERT INTO rs_movies
-            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)""", 
+            (rs_imdb_movie_id, rs_movie_name, rs_budget,
+            rs_gross, rs_imdb_movie_url, rs_imdb_poster_url, rs_imdb_poster_thumbnail_url,
+            rs_db_insert_time, rs_release_date, rs_imdb_description,
+            rs_last_scraped, rs_nreviews_at_scrape)
+            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)""", 
             (rs_imdb_movie_id, rs_movie_name, rs_budget,
             rs_gross,  rs_imdb_movie_url, rs_imdb_poster_url, rs_imdb_poster_thumbnail_url,
-            rs_db_insert_time, rs_release_date, rs_imdb_description,)
+            rs_db_insert_time, rs_release_date, rs_imdb_description,
+            rs_last_scraped, rs_nreviews_at_scrape,)
         )
 
-    def add_movie(self,movie, force=False):
+    def mark_scraped(self, imdb_movie_id, nreviews, time=None):
+        """ Record that a movie was just checked on IMDB,
+            where it had nreviews reviews. """
+        if time is None: time=datetime.now()
+        self.modify_db("""
+            UPDATE rs_movies
+            SET rs_last_scraped=%s, rs_nreviews_at_scrape=%s
+            WHERE rs_imdb_movie_id=%s""",
+            (self.format_time(time), nreviews, imdb_movie_id)
+        )
+
+    def get_scrape_status(self):
+        """ A DataFrame with when each movie was released and last
+            scraped, and how many reviews it had on IMDB at the time. """
+        return psql.frame_query("""
+            SELECT rs_imdb_movie_id, rs_release_date,
+            rs_last_scraped, rs_nreviews_at_scrape
+            FROM rs_movies""", con=self.db)
+
+    def add_movie(self,movie, force=False, lease_owner=None):
 	""" Take in a movie dictionary skimmed from
 	    reviewskimmer.imdb.scrape.scrape_movie and put the review
-	    into the database. """
+	    into the database.
+
+	    The movie's reviews can be a generator (from
+	    scrape_movie(stream=True)). It is read to the end into
+	    a temporary file before the transaction starts, so the
+	    transaction never waits on the scraper, and the reviews
+	    are inserted review_batch_size at a time, so the whole
+	    movie is never held in memory. The movie and all its
+	    reviews are added in one transaction.
+
+	    When lease_owner is given, the movie is the ingest job
+	    leased to lease_owner (see claim_ingest_job), which is
+	    marked done in the same transaction. If the lease was lost,
+	    nothing is written and LeaseLost is raised.
+
+	    Returns the number of reviews added. """
         imdb_movie_id=movie['imdb_movie_id']
 
-        if self.in_movie_database(imdb_movie_id) or self.in_review_database(imdb_movie_id):
-            if force:
-                self.del_movie(imdb_movie_id)
-            else:
-                raise Exception("Cannot insert movie %s because it already exists in database." % imdb_movie_id)
-
+        exists=self.in_movie_database(imdb_movie_id) or self.in_review_database(imdb_movie_id)
+        if exists and not force:
+            raise Exception("Cannot insert movie %s because it already exists in database." % imdb_movie_id)
+
+        reviews=self._spool_reviews(movie['reviews'])
+        with self._transaction() as c:
+            if lease_owner is not None:
+                # give up before deleting anything if the lease is gone
+                self._check_ingest_job_lease(imdb_movie_id,lease_owner,c)
+            if exists:
+                # in the same transaction, so the old movie is
+                # kept if reading the new reviews fails
+                self._del_movie(imdb_movie_id,c)
+            self._add_movie_description(movie,c)
+            nreviews=self._add_all_reviews(imdb_movie_id,reviews,c)
+            if lease_owner is not None:
+                # the lease may have expired while the reviews were read
+                self._complete_ingest_job(imdb_movie_id,lease_owner,c)
+            return nreviews
 
-        self._add_movie_description(movie)
+    @staticmethod
+    def _spool_reviews(reviews):
+        """ Scrape streamed reviews before a transaction starts, so it
+            doesn't hold its locks while pages are downloaded (or get
+            rolled back by a network error). """
+        if isinstance(reviews,(list,tuple)):
+            return reviews
+        return spool(reviews)
 
-        self._add_all_reviews(movie['reviews'])
+    # the columns of rs_reviews, in order
+    _REVIEW_PLACEHOLDERS="(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)"
 
     def _add_review(self,review):
 	""" Add a review dictionary to the database.  This dict
         comes from reviewskimmer.imdb.scrape.scrape_movie to the
         database. """
+        self.modify_db("""
+            INSERT INTO rs_reviews 
+            VALUES """+self._REVIEW_PLACEHOLDERS,
+            self._get_review_values(review)
+        )
 
+    def _get_review_values(self,review):
         rs_imdb_movie_id=review['imdb_movie_id']
         rs_imdb_reviewer_id=review['imdb_reviewer_id']
         reviwer=review['reviewer']
@@ -172,72 +332,197 @@ class IMDBDatabaseConnector(object):
         imdb_review_url=self.format_url(review['imdb_review_url'])
         imdb_review_text=review['imdb_review_text']
 
-        self.modify_db("""
-            INSERT INTO rs_reviews 
-            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)""", 
-            (rs_imdb_movie_id,rs_imdb_reviewer_id,reviwer,review_movie_score, 
+        return (rs_imdb_movie_id,rs_imdb_reviewer_id,reviwer,review_movie_score, 
                 review_date,review_num_likes, review_num_dislikes, 
                 review_spoilers, imdb_review_ranking,review_place, 
                 imdb_review_url, imdb_review_text)
+
+    def _add_all_reviews(self,imdb_movie_id,reviews,c):
+        """ Insert reviews review_batch_size at a time, each batch
+            with one multi-row INSERT, using the cursor c, and add
+            them to the movie's statistics. Nothing is committed,
+            so the caller decides the transaction. """
+        nreviews=0
+        histogram=[0]*len(self.REVIEW_SCORES)
+        latest_review_date=None
+        for batch in iter_batches(reviews,self.review_batch_size):
+            values=[]
+            for review in batch:
+                values.extend(self._get_review_values(review))
+                if review['review_score'] in self.REVIEW_SCORES:
+                    histogram[self.REVIEW_SCORES.index(review['review_score'])]+=1
+                if latest_review_date is None or review['date'] > latest_review_date:
+                    latest_review_date=review['date']
+            c.execute("""
+                INSERT INTO rs_reviews
+                VALUES """+','.join([self._REVIEW_PLACEHOLDERS]*len(batch)),
+                values
+            )
+            nreviews+=len(batch)
+        self._update_movie_stats(imdb_movie_id,nreviews,histogram,latest_review_date,c)
+        return nreviews
+
+    # the possible values of rs_review_movie_score
+    REVIEW_SCORES=range(1,11)
+
+    def create_movie_stats_table(self):
+        """ Per-movie statistics of the reviews in rs_reviews, kept
+            up to date as reviews are added and deleted, so that they
+            don't have to be computed from the reviews. rs_nscore_<N>
+            is the number of reviews with a score of N. """
+        db=self.db
+        db.query("""
+            CREATE TABLE rs_movie_stats (
+            rs_imdb_movie_id INT NOT NULL PRIMARY KEY,
+            rs_nreviews INT NOT NULL,
+            %s,
+            rs_latest_review_date DATE
+            );
+        """ % ',\n            '.join('rs_nscore_%d INT NOT NULL' % i for i in self.REVIEW_SCORES))
+
+    def rebuild_movie_stats(self):
+        """ Recompute the statistics of every movie from its reviews. """
+        with self._transaction() as c:
+            c.execute("""DELETE FROM rs_movie_stats""")
+            c.execute("""
+                INSERT INTO rs_movie_stats
+                SELECT m.rs_imdb_movie_id, COUNT(r.rs_imdb_movie_id),
+                %s,
+                MAX(r.rs_review_date)
+                FROM rs_movies m LEFT JOIN rs_reviews r
+                ON m.rs_imdb_movie_id=r.rs_imdb_movie_id
+                GROUP BY m.rs_imdb_movie_id
+            """ % ',\n            '.join('COALESCE(SUM(r.rs_review_movie_score=%d),0)' % i for i in self.REVIEW_SCORES))
+
+    def _update_movie_stats(self,imdb_movie_id,nreviews,histogram,latest_review_date,c):
+        columns=['rs_nscore_%d' % i for i in self.REVIEW_SCORES]
+        c.execute("""
+            INSERT INTO rs_movie_stats
+            (rs_imdb_movie_id, rs_nreviews, %s, rs_latest_review_date)
+            VALUES (%%s,%%s,%s,%%s)
+            ON DUPLICATE KEY UPDATE
+            rs_nreviews=rs_nreviews+VALUES(rs_nreviews),
+            %s,
+            rs_latest_review_date=GREATEST(
+                COALESCE(rs_latest_review_date,VALUES(rs_latest_review_date)),
+                COALESCE(VALUES(rs_latest_review_date),rs_latest_review_date))
+            """ % (', '.join(columns), ','.join(['%s']*len(columns)),
+                ',\n            '.join('%s=%s+VALUES(%s)' % (i,i,i) for i in columns)),
+            [imdb_movie_id,nreviews]+histogram+[self.format_time(latest_review_date)]
+        )
+
+    def get_movie_stats(self,imdb_movie_id):
+        """ Returns a dict with the number of reviews of a movie,
+            a histogram of their scores (a dict mapping each score
+            to the number of reviews with it), and the date of
+            the latest review. """
+        l=self.query_db("""
+            SELECT * FROM rs_movie_stats
+            WHERE rs_imdb_movie_id=%s""",
+            (imdb_movie_id,)
+        )
+        if len(l)==0:
+            raise Exception("Movie %d is not in the database" % imdb_movie_id)
+        row=l[0]
+        return dict(nreviews=int(row[1]),
+                score_histogram=dict(zip(self.REVIEW_SCORES,[int(i) for i in row[2:-1]])),
+                latest_review_date=row[-1])
+
+    @staticmethod
+    def review_key(imdb_reviewer_id, date):
+        """ Reviews are identified by the reviewer and the day of the review. """
+        if isinstance(date, datetime):
+            date=date.date()
+        return int(imdb_reviewer_id), date
+
+    def get_review_keys(self,imdb_movie_id):
+        """ The set of (reviewer id, review date) of every
+            review for a movie in the database. """
+        l=self.query_db("""
+            SELECT rs_imdb_reviewer_id, rs_review_date FROM rs_reviews
+            WHERE rs_imdb_movie_id=%s""",
+            (imdb_movie_id,)
         )
+        return set(self.review_key(*i) for i in l)
 
-    def _add_all_reviews(self,reviews):
-        for review in reviews:
-            self._add_review(review)
+    def append_reviews(self,imdb_movie_id,reviews):
+        """ Add reviews for a movie already in the database, skipping
+            any review which is already there. This is used to ingest
+            only the newest reviews of a movie. Returns the number
+            of reviews added. """
+        if not self.in_database(imdb_movie_id):
+            raise Exception("Movie %s not in database" % imdb_movie_id)
+
+        existing=self.get_review_keys(imdb_movie_id)
+        reviews=self._spool_reviews(reviews)
+
+        def new_reviews():
+            for review in reviews:
+                key=self.review_key(review['imdb_reviewer_id'],review['date'])
+                if key not in existing:
+                    existing.add(key)
+                    yield review
+
+        with self._transaction() as c:
+            return self._add_all_reviews(imdb_movie_id,new_reviews(),c)
 
     def del_movie(self,imdb_movie_id):
 
         if not self.in_database(imdb_movie_id):
             raise Exception("Movie %s not in database" % imdb_movie_id)
 
-        self._del_all_reviews_for_movie(imdb_movie_id)
-        self._del_movie_description(imdb_movie_id)
+        with self._transaction() as c:
+            self._del_movie(imdb_movie_id,c)
 
-    def _del_movie_description(self,imdb_movie_id):
+    def _del_movie(self,imdb_movie_id,c):
+	""" Remove a movie, its reviews and its statistics using
+	    the cursor c, without committing. """
+        for table in ['rs_reviews','rs_movies','rs_movie_stats']:
+            c.execute("""
+                DELETE FROM %s
+                WHERE rs_imdb_movie_id=%%s""" % table,
+                (imdb_movie_id,)
+            )
 
-        self.modify_db("""
-            DELETE FROM rs_movies
+    def get_nreviews(self,imdb_movie_id):
+        l=self.query_db("""
+            SELECT rs_nreviews FROM rs_movie_stats
             WHERE rs_imdb_movie_id=%s""",
             (imdb_movie_id,)
         )
+        if len(l)==0:
+            raise Exception("Movie %d is not in the database" % imdb_movie_id)
+        return int(l[0][0])
 
-    def _del_all_reviews_for_movie(self,imdb_movie_id):
-	""" Remove every review for a movie specified by imdb_movie_id.
-	"""
-        self.modify_db("""
-            DELETE FROM rs_reviews
+    def in_database(self,imdb_movie_id):
+        """ Test if a movie and its reviews are in the database. """
+        l=self.query_db("""
+            SELECT COUNT(*) FROM rs_movies JOIN rs_movie_stats
+            USING (rs_imdb_movie_id)
             WHERE rs_imdb_movie_id=%s""",
             (imdb_movie_id,)
         )
-
-    def get_nreviews(self,imdb_movie_id):
-        return len(self.get_reviews(imdb_movie_id))
-
-    def in_database(self,imdb_movie_id):
-        return self.in_review_database(imdb_movie_id) and self.in_movie_database(imdb_movie_id)
+        return l[0][0]==1
 
     def in_review_database(self,imdb_movie_id):
+        """ Test if the reviews of a movie are in the database. """
 
-        f=self.query_db("""
-            SELECT * FROM rs_movies 
+        l=self.query_db("""
+            SELECT COUNT(*) FROM rs_movie_stats 
             WHERE rs_imdb_movie_id=%s""",
             (imdb_movie_id,)
         )
-        l=len(f)
-        assert l<=1
-        return l==1
+        return l[0][0]==1
 
     def in_movie_database(self,imdb_movie_id):
         """ Test if a movie with a given imdb movie id is in the database. """
 
-        f=self.query_db("""
-            SELECT * FROM rs_movies 
+        l=self.query_db("""
+            SELECT COUNT(*) FROM rs_movies 
             WHERE rs_imdb_movie_id=%s""",
             (imdb_movie_id,)
         )
-        l=len(f)
-        assert l<=1
-        return l==1
+        return l[0][0]==1
 
     def get_newest_imdb_movie_id(self,movie_name):
             
@@ -275,13 +560,31 @@ class IMDBDatabaseConnector(object):
             raise Exception("Movie %d is not in the database" % imdb_movie_id)
         return self.get_movie(imdb_movie_id)['rs_imdb_description']
 
-    def get_reviews(self,imdb_movie_id):
+    # the columns of rs_reviews which can be selected by name
+    REVIEW_COLUMNS=['rs_imdb_movie_id', 'rs_imdb_reviewer_id', 'rs_reviewer',
+            'rs_review_movie_score', 'rs_review_date', 'rs_num_likes',
+            'rs_num_dislikes', 'rs_review_spoilers', 'rs_imdb_review_ranking',
+            'rs_review_place', 'rs_imdb_review_url', 'rs_review_text']
+
+    def _get_review_columns_sql(self,columns):
+        """ columns are put into the query, so they have
+            to be checked against the known columns. """
+        if columns is None:
+            return '*'
+        for column in columns:
+            if column not in self.REVIEW_COLUMNS:
+                raise Exception("Unrecognized review column %s" % column)
+        return ', '.join(columns)
+
+    def get_reviews(self,imdb_movie_id,columns=None):
+        """ A DataFrame of a movie's reviews, with only the
+            given columns (or all of them if columns is None). """
         if not self.in_review_database(imdb_movie_id):
             raise Exception("Movie %d is not in the database" % imdb_movie_id)
     
         query="""
-            SELECT * FROM rs_reviews 
-            WHERE rs_imdb_movie_id=%s""" % imdb_movie_id
+            SELECT %s FROM rs_reviews 
+            WHERE rs_imdb_movie_id=%s""" % (self._get_review_columns_sql(columns), int(imdb_movie_id))
         df_mysql = psql.frame_query(query, con=self.db)
 
         return df_mysql
@@ -301,69 +604,357 @@ class IMDBDatabaseConnector(object):
     def get_movie_name(self,imdb_movie_id):
         return self.get_movie(imdb_movie_id)['rs_movie_name']
 
-    def get_all_reviews(self):
-        query="""SELECT * FROM rs_reviews"""
+    @staticmethod
+    def _get_ids_sql(imdb_movie_ids):
+        return ','.join(str(int(i)) for i in imdb_movie_ids)
+
+    def get_movies(self,imdb_movie_ids):
+        """ Returns a dict mapping each of the movies which is in
+            the database to its row (like get_movie), from one query. """
+        if len(imdb_movie_ids)==0:
+            return dict()
+        query="""
+            SELECT * FROM rs_movies 
+            WHERE rs_imdb_movie_id IN (%s)""" % self._get_ids_sql(imdb_movie_ids)
+        df_mysql = psql.frame_query(query, con=self.db)
+        return dict((int(row['rs_imdb_movie_id']),row) for i,row in df_mysql.iterrows())
+
+    def get_movie_names(self,imdb_movie_ids):
+        """ Returns a dict mapping each of the movies which
+            is in the database to its name, from one query. """
+        if len(imdb_movie_ids)==0:
+            return dict()
+        l=self.query_db("""
+            SELECT rs_imdb_movie_id, rs_movie_name FROM rs_movies
+            WHERE rs_imdb_movie_id IN (%s)""" % self._get_ids_sql(imdb_movie_ids))
+        return dict((int(i),name) for i,name in l)
+
+    def get_all_reviews(self,columns=None):
+        query="""SELECT %s FROM rs_reviews""" % self._get_review_columns_sql(columns)
         df_mysql = psql.frame_query(query, con=self.db)
         return df_mysql
 
+    def _get_streaming_cursor(self):
+        """ A server-side cursor, which reads rows from the
+            server as they are fetched instead of all at once. """
+        # only needed here, so the connector can be used without MySQLdb
+        from MySQLdb.cursors import SSCursor
+        return self.db.cursor(SSCursor)
+
+    def iter_reviews(self,columns=None,imdb_movie_id=None,chunksize=10000):
+        """ Iterate over DataFrames of at most chunksize reviews
+            (of one movie, or of every movie if imdb_movie_id is None),
+            with only the given columns.
+
+            The reviews are streamed from the server with a server-side
+            cursor, so only one chunk is ever in memory. The connection
+            can't be used for anything else until the iteration is done. """
+        query="""SELECT %s FROM rs_reviews""" % self._get_review_columns_sql(columns)
+        args=None
+        if imdb_movie_id is not None:
+            query+=""" WHERE rs_imdb_movie_id=%s"""
+            args=(imdb_movie_id,)
+
+        c=self._get_streaming_cursor()
+        try:
+            c.execute(query,args)
+            names=[i[0] for i in c.description]
+            while True:
+                rows=c.fetchmany(chunksize)
+                if not rows:
+                    break
+                yield DataFrame.from_records(list(rows), columns=names)
+        finally:
+            c.close()
+
     def get_all_movies(self):
         query="""SELECT * FROM rs_movies"""
         df_mysql = psql.frame_query(query, con=self.db)
         return df_mysql
 
     def does_quotes_cache_exist(self):
-
-        l=self.query_db("""
-            SELECT count(*)
-            FROM information_schema.TABLES
-            WHERE (TABLE_SCHEMA = 'reviewskimmer') 
-            AND (TABLE_NAME = 'rs_quotes_cache')""")
-        return l[0][0]==1
+        return self.table_exists('rs_quotes_cache')
 
 
     def create_quotes_cache(self):
-        """ Code to cache quotes """
+        """ Code to cache quotes. Each movie's quotes are stamped with
+            the number of reviews and the model version (see
+            get_model_version) they were found with, and are stale
+            once either changes. """
         db=self.db
         db.query("""
             CREATE TABLE rs_quotes_cache (
             rs_imdb_movie_id INT NOT NULL PRIMARY KEY,
-            rs_data LONGBLOB NOT NULL
+            rs_nreviews INT NOT NULL,
+            rs_model_version VARCHAR(40),
+            rs_data MEDIUMBLOB NOT NULL
             );
         """)
+        # which the cached quotes are checked against
+        self.create_model_version_table()
 
     def delete_quotes_cache(self):
         """ Delete all tables from the IMDB databse. """
         db=self.db
         db.query("DROP TABLE IF EXISTS rs_quotes_cache")
 
-    def are_quotes_cached(self,imdb_movie_id):
+    @staticmethod
+    def encode_quotes(_data):
+        """ Quotes are stored as zlib compressed JSON. Infinite
+            numbers (which JSON can't hold) are stored as null. """
+        def clean(o):
+            if isinstance(o, float) and (math.isinf(o) or math.isnan(o)):
+                return None
+            if isinstance(o, dict):
+                return dict((k,clean(v)) for k,v in o.items())
+            if isinstance(o, (list,tuple)):
+                return [clean(i) for i in o]
+            return o
+        return zlib.compress(json.dumps(clean(_data), allow_nan=False))
 
-        f=self.query_db("""
-            SELECT * FROM rs_quotes_cache 
-            WHERE rs_imdb_movie_id=%s""",
+    @staticmethod
+    def decode_quotes(data):
+        return json.loads(zlib.decompress(data))
+
+    def _get_fresh_cached_quotes(self,imdb_movie_id):
+        """ The encoded quotes of a movie, or None if they
+            aren't cached or are stale. The stamp is checked
+            in the same query which reads the quotes. """
+        l=self.query_db("""
+            SELECT q.rs_nreviews, s.rs_nreviews, q.rs_model_version, v.rs_version, q.rs_data
+            FROM rs_quotes_cache q
+            LEFT JOIN rs_movie_stats s ON q.rs_imdb_movie_id=s.rs_imdb_movie_id
+            LEFT JOIN rs_model_version v ON v.rs_id=1
+            WHERE q.rs_imdb_movie_id=%s""",
             (imdb_movie_id,)
         )
-        l=len(f)
-        return l>0
+        if len(l)==0:
+            return None
+        cached_nreviews,nreviews,cached_model_version,model_version,data=l[0]
+        if cached_nreviews != nreviews or cached_model_version != model_version:
+            return None
+        return data
 
-    def set_cached_quotes(self, imdb_movie_id, _data):
+    def are_quotes_cached(self,imdb_movie_id):
+        return self._get_fresh_cached_quotes(imdb_movie_id) is not None
+
+    def set_cached_quotes(self, imdb_movie_id, _data, nreviews=None):
+        """ Cache a movie's quotes, which were found from
+            nreviews reviews (by default, the number
+            of reviews in the database now). """
+        if nreviews is None:
+            nreviews=self.get_nreviews(imdb_movie_id)
 
         self.modify_db("""
-            INSERT INTO rs_quotes_cache
-            VALUES (%s,%s)""", 
-            (imdb_movie_id, pickle.dumps(_data))
+            REPLACE INTO rs_quotes_cache
+            VALUES (%s,%s,%s,%s)""", 
+            (imdb_movie_id, nreviews, self.get_model_version(), self.encode_quotes(_data))
         )
 
     def get_cached_quotes(self, imdb_movie_id):
-        if not self.are_quotes_cached(imdb_movie_id):
-            raise Exception("No cached quotes for movie %s" % imdb_movie_id)
+        """ The cached quotes of a movie, or None if
+            they aren't cached or are stale. """
+        data=self._get_fresh_cached_quotes(imdb_movie_id)
+        if data is None:
+            return None
+        return self.decode_quotes(data)
+
+
+    def does_poster_derivatives_table_exist(self):
+        return self.table_exists('rs_poster_derivatives')
 
+    def create_poster_derivatives_table(self):
+        """ Table of the resized posters stored in S3 (see
+            reviewskimmer.imdb.poster.generate_all_poster_derivatives). """
+        db=self.db
+        db.query("""
+            CREATE TABLE rs_poster_derivatives (
+            rs_imdb_movie_id INT NOT NULL,
+            rs_size VARCHAR(16) NOT NULL,
+            rs_format VARCHAR(16) NOT NULL,
+            rs_s3_key VARCHAR(255) NOT NULL,
+            rs_width INT NOT NULL,
+            rs_height INT NOT NULL,
+            PRIMARY KEY (rs_imdb_movie_id, rs_size, rs_format)
+            );
+        """)
+
+    def set_poster_derivatives(self, imdb_movie_id, derivatives):
+        """ derivatives is a list of dicts with the size,
+            format, s3_key, width and height of each derivative.
+            They replace the movie's derivatives in one transaction,
+            so a movie never has only some of them. """
+        values=[]
+        for d in derivatives:
+            values.extend((imdb_movie_id, d['size'], d['format'], d['s3_key'], d['width'], d['height']))
+        with self._transaction() as c:
+            c.execute("""
+                DELETE FROM rs_poster_derivatives
+                WHERE rs_imdb_movie_id=%s""",
+                (imdb_movie_id,)
+            )
+            if len(derivatives) > 0:
+                c.execute("""
+                    INSERT INTO rs_poster_derivatives
+                    VALUES """+','.join(['(%s,%s,%s,%s,%s,%s)']*len(derivatives)),
+                    values
+                )
+
+    def get_poster_derivatives(self, imdb_movie_id):
+        """ Returns a dict mapping (size, format) to the
+            S3 key of each of a movie's poster derivatives. """
         l=self.query_db("""
-            SELECT * FROM rs_quotes_cache 
+            SELECT rs_size, rs_format, rs_s3_key FROM rs_poster_derivatives
             WHERE rs_imdb_movie_id=%s""",
             (imdb_movie_id,)
         )
+        if l is None: return dict()
+        return dict(((size,format),s3_key) for size,format,s3_key in l)
+
+    def get_poster_derivatives_for_movies(self, imdb_movie_ids):
+        """ Like get_poster_derivatives, for many movies with one query.
+            Returns a dict mapping each movie id to its derivatives. """
+        derivatives=dict((int(i),dict()) for i in imdb_movie_ids)
+        if len(derivatives)==0:
+            return derivatives
+        l=self.query_db("""
+            SELECT rs_imdb_movie_id, rs_size, rs_format, rs_s3_key FROM rs_poster_derivatives
+            WHERE rs_imdb_movie_id IN (%s)""" % self._get_ids_sql(imdb_movie_ids))
+        for imdb_movie_id,size,format,s3_key in l:
+            derivatives[int(imdb_movie_id)][size,format]=s3_key
+        return derivatives
+
+    def get_imdb_movie_ids_with_poster_derivatives(self):
+        l=self.query_db("""
+            SELECT DISTINCT rs_imdb_movie_id FROM rs_poster_derivatives""")
+        return set(i[0] for i in l)
+
+    def create_ingest_jobs_table(self):
+        """ Queue of movies to ingest, shared by any number of
+            workers (see reviewskimmer.imdb.worker). A worker leases a
+            job until rs_lease_expires. If it dies, the job is handed
+            to another worker once the lease expires. """
+        db=self.db
+        db.query("""
+            CREATE TABLE rs_ingest_jobs (
+            rs_imdb_movie_id INT NOT NULL PRIMARY KEY,
+            rs_status VARCHAR(16) NOT NULL,
+            rs_lease_owner VARCHAR(128),
+            rs_lease_expires DATETIME,
+            rs_attempts INT NOT NULL DEFAULT 0,
+            rs_last_error TEXT,
+            rs_updated DATETIME NOT NULL,
+            INDEX (rs_status, rs_lease_expires)
+            ) ENGINE=InnoDB;
+        """)
+
+    def delete_ingest_jobs_table(self):
+        db=self.db
+        db.query("DROP TABLE IF EXISTS rs_ingest_jobs")
+
+    def enqueue_ingest_jobs(self, imdb_movie_ids, reset=False):
+        """ Add movies to the ingest queue. Movies already in the queue
+            are left alone, unless reset is True, in which case
+            they are put back to pending. """
+        for imdb_movie_id in imdb_movie_ids:
+            if reset:
+                self.modify_db("""
+                    REPLACE INTO rs_ingest_jobs
+                    (rs_imdb_movie_id, rs_status, rs_attempts, rs_updated)
+                    VALUES (%s,'pending',0,NOW())""",
+                    (imdb_movie_id,))
+            else:
+                self.modify_db("""
+                    INSERT IGNORE INTO rs_ingest_jobs
+                    (rs_imdb_movie_id, rs_status, rs_attempts, rs_updated)
+                    VALUES (%s,'pending',0,NOW())""",
+                    (imdb_movie_id,))
+
+    def claim_ingest_job(self, lease_owner, lease_seconds=3600, max_attempts=3):
+        """ Lease the next pending job (or a job whose lease has expired)
+            to lease_owner, which must be unique to this claim.
+            Returns the imdb movie id, or None if there is nothing to do.
+
+            The UPDATE is atomic, so two workers can never claim the
+            same job, and the database's clock is used for the leases
+            so workers on different hosts agree on when they expire.
+
+            Jobs whose lease expired on their last attempt are
+            marked failed, instead of being left leased forever. """
+        self.modify_db("""
+            UPDATE rs_ingest_jobs
+            SET rs_status='failed', rs_lease_expires=NULL,
+                rs_last_error=COALESCE(rs_last_error,'The lease expired'), rs_updated=NOW()
+            WHERE rs_status='leased' AND rs_lease_expires < NOW()
+            AND rs_attempts >= %s""",
+            (max_attempts,))
+
+        n=self.modify_db("""
+            UPDATE rs_ingest_jobs
+            SET rs_status='leased', rs_lease_owner=%s,
+                rs_lease_expires=NOW() + INTERVAL %s SECOND,
+                rs_attempts=rs_attempts+1, rs_updated=NOW()
+            WHERE (rs_status='pending' OR (rs_status='leased' AND rs_lease_expires < NOW()))
+            AND rs_attempts < %s
+            ORDER BY rs_imdb_movie_id
+            LIMIT 1""",
+            (lease_owner, lease_seconds, max_attempts))
+        if not n:
+            return None
+
+        l=self.query_db("""
+            SELECT rs_imdb_movie_id FROM rs_ingest_jobs
+            WHERE rs_lease_owner=%s AND rs_status='leased'""",
+            (lease_owner,))
+        self.db.commit()
         assert len(l)==1
-        imdb_movie_id,_data=l[0]
-        return pickle.loads(_data)
+        return l[0][0]
 
+    _HOLDS_LEASE="""rs_imdb_movie_id=%s AND rs_lease_owner=%s
+            AND rs_status='leased' AND rs_lease_expires > NOW()"""
+
+    def complete_ingest_job(self, imdb_movie_id, lease_owner):
+        """ Mark a job done. Returns False if the lease had
+            already expired or been taken over by another worker. """
+        try:
+            with self._transaction() as c:
+                self._complete_ingest_job(imdb_movie_id, lease_owner, c)
+        except LeaseLost:
+            return False
+        return True
+
+    def _check_ingest_job_lease(self, imdb_movie_id, lease_owner, c):
+        c.execute("""
+            SELECT COUNT(*) FROM rs_ingest_jobs
+            WHERE """+self._HOLDS_LEASE,
+            (imdb_movie_id, lease_owner))
+        if c.fetchall()[0][0] != 1:
+            raise LeaseLost("Lost the lease on movie %s" % imdb_movie_id)
+
+    def _complete_ingest_job(self, imdb_movie_id, lease_owner, c):
+        """ The UPDATE locks the job, so another worker
+            can't claim it until the transaction is over. """
+        n=c.execute("""
+            UPDATE rs_ingest_jobs
+            SET rs_status='done', rs_lease_expires=NULL, rs_updated=NOW()
+            WHERE """+self._HOLDS_LEASE,
+            (imdb_movie_id, lease_owner))
+        if n != 1:
+            raise LeaseLost("Lost the lease on movie %s" % imdb_movie_id)
+
+    def fail_ingest_job(self, imdb_movie_id, lease_owner, error, max_attempts=3):
+        """ Give a job back to the queue to be tried again,
+            or mark it failed after max_attempts. """
+        self.modify_db("""
+            UPDATE rs_ingest_jobs
+            SET rs_status=IF(rs_attempts >= %s, 'failed', 'pending'),
+                rs_lease_expires=NULL, rs_last_error=%s, rs_updated=NOW()
+            WHERE rs_imdb_movie_id=%s AND rs_lease_owner=%s AND rs_status='leased'""",
+            (max_attempts, error, imdb_movie_id, lease_owner))
+
+    def get_ingest_job_counts(self):
+        """ Returns a dict of the number of jobs with each status. """
+        l=self.query_db("""
+            SELECT rs_status, COUNT(*) FROM rs_ingest_jobs
+            GROUP BY rs_status""")
+        return dict((status,int(n)) for status,n in l)
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+""" Upgrade an existing reviewskimmer database, in place,
+    to the schema that IMDBDatabaseConnector.create_schema creates.
+
+    Each migration is applied once, in order, and recorded
+    in the rs_schema_version table. To upgrade a database:
+
+        python -m reviewskimmer.database.migrations
+
+    The database is read from the RDS_HOSTNAME, RDS_PORT,
+    RDS_USERNAME, RDS_PASSWORD and RDS_DB_NAME environment variables.
+"""
+import os
+import argparse
+from datetime import datetime
+
+
+def _column_exists(connector, table, column):
+    l=connector.query_db("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME=%s AND COLUMN_NAME=%s""",
+        (table, column))
+    return l[0][0]==1
+
+def _index_exists(connector, table, index):
+    l=connector.query_db("""
+        SELECT COUNT(*) FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME=%s AND INDEX_NAME=%s""",
+        (table, index))
+    return l[0][0]>0
+
+
+# Databases created before the migrations existed may
+# already have some of these changes, so each one
+# checks whether it is needed first.
+
+def _add_scrape_tracking(connector):
+    """ Movies are assumed to have been scraped when they were inserted. """
+    if _column_exists(connector, 'rs_movies', 'rs_last_scraped'):
+        return
+    connector.db.query("""
+        ALTER TABLE rs_movies
+        ADD COLUMN rs_last_scraped DATETIME,
+        ADD COLUMN rs_nreviews_at_scrape INT
+    """)
+    connector.db.query("""
+        UPDATE rs_movies SET rs_last_scraped=rs_db_insert_time
+    """)
+    _backfill_nreviews_at_scrape(connector)
+
+def _backfill_nreviews_at_scrape(connector):
+    """ The refresh schedule estimates how fast movies get reviews
+        from rs_nreviews_at_scrape, so movies which were never marked
+        as scraped are given the number of reviews in the database. """
+    connector.db.query("""
+        UPDATE rs_movies m
+        JOIN (SELECT rs_imdb_movie_id, COUNT(*) AS nreviews
+            FROM rs_reviews GROUP BY rs_imdb_movie_id) r
+        ON m.rs_imdb_movie_id=r.rs_imdb_movie_id
+        SET m.rs_nreviews_at_scrape=r.nreviews
+        WHERE m.rs_nreviews_at_scrape IS NULL
+    """)
+
+def _index_reviews_by_movie(connector):
+    if _index_exists(connector, 'rs_reviews', 'rs_imdb_movie_id'):
+        return
+    connector.db.query("""
+        ALTER TABLE rs_reviews ADD INDEX rs_imdb_movie_id (rs_imdb_movie_id)
+    """)
+
+def _index_movie_names(connector):
+    """ Movies are searched for by name, newest first. """
+    if _index_exists(connector, 'rs_movies', 'rs_movie_name'):
+        return
+    connector.db.query("""
+        ALTER TABLE rs_movies
+        MODIFY rs_movie_name VARCHAR(255) NOT NULL,
+        ADD INDEX rs_movie_name (rs_movie_name, rs_release_date)
+    """)
+
+# A finite number, which MySQL can convert to a DOUBLE. 'inf' and
+# 'nan' (which Python writes for non-finite floats) don't match.
+_NUMBER_REGEXP='^[-+]?[0-9]+[.]?[0-9]*([eE][-+]?[0-9]+)?$'
+
+def _numeric_budget_and_gross(connector):
+    for column in ['rs_budget','rs_gross']:
+        # anything which isn't a number was never valid
+        connector.db.query("""
+            UPDATE rs_movies SET %s=NULL
+            WHERE %s NOT REGEXP '%s'
+        """ % (column, column, _NUMBER_REGEXP))
+    connector.db.query("""
+        ALTER TABLE rs_movies
+        MODIFY rs_budget DOUBLE,
+        MODIFY rs_gross DOUBLE
+    """)
+
+def _numeric_odds_ratio(connector):
+    """ Infinite odds ratios were stored as 'INF' (or, when the ratio
+        overflowed, as '%8.1f' formatted 'inf' or 'nan'). Anything
+        which isn't a finite number, which MySQL would refuse to
+        convert, is now NULL. """
+    if not connector.table_exists('rs_most_informative_features'):
+        return
+    connector.db.query("""
+        UPDATE rs_most_informative_features SET rs_odds_ratio=NULL
+        WHERE TRIM(rs_odds_ratio) NOT REGEXP '%s'
+    """ % _NUMBER_REGEXP)
+    connector.db.query("""
+        ALTER TABLE rs_most_informative_features MODIFY rs_odds_ratio DOUBLE
+    """)
+
+def _add_movie_stats(connector):
+    if not connector.table_exists('rs_movie_stats'):
+        connector.create_movie_stats_table()
+    connector.rebuild_movie_stats()
+
+def _compact_quotes_cache(connector):
+    """ The old pickled quotes can't be stamped, so they are
+        dropped and found again as the movies are viewed. """
+    if not connector.table_exists('rs_quotes_cache'):
+        return
+    connector.delete_quotes_cache()
+    connector.create_quotes_cache()
+
+def _add_model_version(connector):
+    """ Cached quotes are read joined to rs_model_version,
+        which used to only exist once features were saved. """
+    connector.create_model_version_table()
+
+
+MIGRATIONS=[
+        (1, 'add rs_last_scraped and rs_nreviews_at_scrape to rs_movies', _add_scrape_tracking),
+        (2, 'index rs_reviews by movie', _index_reviews_by_movie),
+        (3, 'index rs_movies by name', _index_movie_names),
+        (4, 'store budget and gross as numbers', _numeric_budget_and_gross),
+        (5, 'store odds ratios as numbers', _numeric_odds_ratio),
+        (6, 'add rs_movie_stats', _add_movie_stats),
+        (7, 'store quotes as compressed JSON stamped with the review count and model version', _compact_quotes_cache),
+        (8, 'backfill rs_nreviews_at_scrape from rs_reviews', _backfill_nreviews_at_scrape),
+        (9, 'add rs_model_version', _add_model_version),
+        ]
+
+LATEST_VERSION=MIGRATIONS[-1][0]
+
+
+def create_schema_version_table(connector):
+    connector.db.query("""
+        CREATE TABLE IF NOT EXISTS rs_schema_version (
+        rs_version INT NOT NULL PRIMARY KEY,
+        rs_description TEXT NOT NULL,
+        rs_applied DATETIME NOT NULL
+        );
+    """)
+
+def get_schema_version(connector):
+    """ The version of the newest migration applied to
+        the database (0 for a database which predates them). """
+    if not connector.table_exists('rs_schema_version'):
+        return 0
+    l=connector.query_db("""SELECT MAX(rs_version) FROM rs_schema_version""")
+    return l[0][0] or 0
+
+def _record_version(connector, version, description):
+    connector.modify_db("""
+        INSERT INTO rs_schema_version
+        VALUES (%s,%s,%s)""",
+        (version, description, connector.format_time(datetime.now())))
+
+def stamp_schema_version(connector, version=LATEST_VERSION):
+    """ Mark the migrations up to version as applied, without running
+        them. Used for databases created with the newest schema. """
+    create_schema_version_table(connector)
+    current=get_schema_version(connector)
+    for v,description,migration in MIGRATIONS:
+        if current < v <= version:
+            _record_version(connector, v, description)
+
+def migrate(connector, target=LATEST_VERSION):
+    """ Apply (in order) every migration newer than the
+        database's version, up to target. Returns the
+        versions which were applied. """
+    create_schema_version_table(connector)
+    current=get_schema_version(connector)
+
+    applied=[]
+    for version,description,migration in MIGRATIONS:
+        if current < version <= target:
+            print 'Migrating to version %s: %s' % (version, description)
+            migration(connector)
+            connector.db.commit()
+            _record_version(connector, version, description)
+            applied.append(version)
+    return applied
+
+
+if __name__ == '__main__':
+    parser=argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', type=int, default=LATEST_VERSION, help='Version to migrate to.')
+    parser.add_argument('--status', action='store_true', help='Print the current version.')
+    args=parser.parse_args()
+
+    import MySQLdb
+    from reviewskimmer.database.dbconnect import IMDBDatabaseConnector
+    db=MySQLdb.Connection(host=os.environ['RDS_HOSTNAME'],
+            user=os.environ['RDS_USERNAME'],
+            port=int(os.environ['RDS_PORT']),
+            passwd=os.environ['RDS_PASSWORD'],
+            db=os.environ['RDS_DB_NAME'])
+    connector=IMDBDatabaseConnector(db)
+
+    if args.status:
+        print 'Schema version %s (latest is %s)' % (get_schema_version(connector), LATEST_VERSION)
+    else:
+        migrate(connector, args.target)
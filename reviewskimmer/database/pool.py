@@ -0,0 +1,161 @@
+import time
+import threading
+import traceback
+from contextlib import contextmanager
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool(object):
+    """ A bounded pool of database connections, shared between threads.
+
+        connect is a function which opens a new connection
+        (for example, a MySQLdb.Connection).
+
+        At most max_size connections are open at once. get() waits
+        up to timeout seconds for one to be returned before raising
+        PoolTimeout. Connections older than max_lifetime seconds are
+        closed instead of reused (so the server never drops one from
+        under us), and connections idle for more than ping_interval
+        seconds are pinged before being handed out.
+    """
+
+    def __init__(self, connect, max_size=10, max_lifetime=3600, timeout=10., ping_interval=30):
+        self.connect=connect
+        self.max_size=max_size
+        self.max_lifetime=max_lifetime
+        self.timeout=timeout
+        self.ping_interval=ping_interval
+
+        # idle connections, as (connection, created, last_used), most recently used last
+        self._idle=[]
+        # created time of the connections which are checked out
+        self._in_use=dict()
+        self._cond=threading.Condition()
+
+        self._stats=dict(checkouts=0, created=0, closed=0, ping_failures=0,
+                timeouts=0, total_wait=0., max_wait=0.)
+
+    @property
+    def size(self):
+        return len(self._idle)+len(self._in_use)
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._stats['closed']+=1
+
+    def _is_usable(self, conn, created, last_used, now):
+        if now-created > self.max_lifetime:
+            return False
+        if now-last_used > self.ping_interval:
+            try:
+                conn.ping()
+            except Exception:
+                with self._cond:
+                    self._stats['ping_failures']+=1
+                return False
+        return True
+
+    def get(self):
+        """ Check out a connection. It must be given back with put(). """
+        start=time.time()
+        deadline=start+self.timeout
+        with self._cond:
+            while not self._idle and self.size >= self.max_size:
+                remaining=deadline-time.time()
+                if remaining <= 0:
+                    self._stats['timeouts']+=1
+                    raise PoolTimeout('No database connection free after %s seconds' % self.timeout)
+                self._cond.wait(remaining)
+
+            if self._idle:
+                conn,created,last_used=self._idle.pop()
+                key=id(conn)
+            else:
+                conn=None
+                key=object()
+            # hold the slot while pinging or connecting
+            self._in_use[key]=start
+
+        try:
+            if conn is not None and not self._is_usable(conn, created, last_used, time.time()):
+                self._close(conn)
+                conn=None
+            if conn is None:
+                conn=self.connect()
+                created=time.time()
+                with self._cond:
+                    self._stats['created']+=1
+        except:
+            with self._cond:
+                del self._in_use[key]
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            del self._in_use[key]
+            self._in_use[id(conn)]=created
+            wait=time.time()-start
+            self._stats['checkouts']+=1
+            self._stats['total_wait']+=wait
+            self._stats['max_wait']=max(self._stats['max_wait'],wait)
+        return conn
+
+    def put(self, conn, discard=False):
+        """ Return a connection to the pool. Anything uncommitted is
+            rolled back. When discard is True (for example, after an
+            error), the connection is closed instead of reused. """
+        if not discard:
+            try:
+                conn.rollback()
+            except Exception:
+                traceback.print_exc()
+                discard=True
+
+        with self._cond:
+            created=self._in_use.pop(id(conn))
+            if not discard and time.time()-created <= self.max_lifetime:
+                self._idle.append((conn, created, time.time()))
+                conn=None
+            self._cond.notify()
+
+        if conn is not None:
+            self._close(conn)
+
+    @contextmanager
+    def connection(self):
+        """ For example:
+
+                with pool.connection() as db:
+                    connector=IMDBDatabaseConnector(db)
+        """
+        conn=self.get()
+        try:
+            yield conn
+        except:
+            self.put(conn, discard=True)
+            raise
+        self.put(conn)
+
+    def close(self):
+        """ Close the idle connections. """
+        with self._cond:
+            idle,self._idle=self._idle,[]
+        for conn,created,last_used in idle:
+            self._close(conn)
+
+    def get_stats(self):
+        """ A dict with the number of connections open, in use
+            and idle, and how long get() has had to wait for them. """
+        with self._cond:
+            stats=dict(self._stats)
+            stats.update(size=self.size, in_use=len(self._in_use),
+                    idle=len(self._idle), max_size=self.max_size)
+        stats['mean_wait']=stats['total_wait']/stats['checkouts'] if stats['checkouts'] else 0.
+        return stats
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+""" Export the tables the website reads into a read-only
+    sqlite file, which each web server can read locally
+    instead of going to MySQL for every page.
+
+    To build a snapshot:
+
+        python -m reviewskimmer.database.snapshot $REVIEWSKIMMER_SNAPSHOT
+
+    The database is read from the RDS_HOSTNAME, RDS_PORT,
+    RDS_USERNAME, RDS_PASSWORD and RDS_DB_NAME environment variables.
+"""
+import os
+import sqlite3
+import argparse
+
+from reviewskimmer.database.dbconnect import IMDBDatabaseConnector
+
+# The tables the website reads, with the primary key
+# and the indexes each one needs in the snapshot.
+SNAPSHOT_TABLES=[
+        ('rs_movies', ['rs_imdb_movie_id'], [['rs_movie_name','rs_release_date']]),
+        ('rs_movie_stats', ['rs_imdb_movie_id'], []),
+        ('rs_poster_derivatives', ['rs_imdb_movie_id','rs_size','rs_format'], []),
+        ('rs_quotes_cache', ['rs_imdb_movie_id'], []),
+        ('rs_most_informative_features', None, []),
+        ('rs_model_version', ['rs_id'], []),
+        ('rs_top_grossing', None, [['rs_year']]),
+        ('rs_top_100_all_time', None, []),
+        ('rs_bottom_100_all_time', None, []),
+        ]
+
+
+# The sqlite column type for each MySQL data type. Dates are
+# declared so that sqlite3 gives them back as dates.
+_SQLITE_TYPES=dict(date='DATE', datetime='TIMESTAMP', timestamp='TIMESTAMP',
+        tinyint='INTEGER', smallint='INTEGER', mediumint='INTEGER', int='INTEGER',
+        bigint='INTEGER', year='INTEGER', bool='INTEGER',
+        float='REAL', double='REAL', decimal='REAL',
+        tinyblob='BLOB', blob='BLOB', mediumblob='BLOB', longblob='BLOB')
+
+def _get_column_types(connector, table):
+    """ A dict mapping each of a table's columns to its sqlite type. """
+    l=connector.query_db("""
+        SELECT COLUMN_NAME, DATA_TYPE FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME=%s""",
+        (table,))
+    return dict((name,_SQLITE_TYPES.get(data_type.lower(),'TEXT')) for name,data_type in l)
+
+
+def _copy_table(connector, snapshot, table, primary_key, indexes, batch_size=1000):
+    types=_get_column_types(connector, table)
+    c=connector.db.cursor()
+    try:
+        c.execute("""SELECT * FROM %s""" % table)
+        columns=[(i[0],types[i[0]]) for i in c.description]
+
+        definition=', '.join('%s %s' % i for i in columns)
+        if primary_key is not None:
+            definition+=', PRIMARY KEY (%s)' % ', '.join(primary_key)
+        snapshot.execute("""CREATE TABLE %s (%s)""" % (table, definition))
+
+        insert="""INSERT INTO %s VALUES (%s)""" % (table, ','.join(['?']*len(columns)))
+        nrows=0
+        while True:
+            rows=c.fetchmany(batch_size)
+            if not rows:
+                break
+            snapshot.executemany(insert, rows)
+            nrows+=len(rows)
+    finally:
+        c.close()
+
+    for index in indexes:
+        snapshot.execute("""CREATE INDEX %s ON %s (%s)""" % (
+            '_'.join([table]+index), table, ', '.join(index)))
+    return nrows
+
+
+def export_snapshot(connector, filename):
+    """ Copy the tables in SNAPSHOT_TABLES (those which exist) into a
+        new sqlite file. The file is written next to filename and
+        then renamed over it, so web servers never open a partial
+        snapshot. Returns a dict of the number of rows in each table. """
+    tmp_filename=filename+'.tmp'
+    if os.path.exists(tmp_filename):
+        os.remove(tmp_filename)
+
+    snapshot=sqlite3.connect(tmp_filename)
+    # MySQLdb gives back byte strings, which are stored as is
+    snapshot.text_factory=str
+
+    nrows=dict()
+    for table,primary_key,indexes in SNAPSHOT_TABLES:
+        if not connector.table_exists(table):
+            print 'Skipping %s, which does not exist' % table
+            continue
+        nrows[table]=_copy_table(connector, snapshot, table, primary_key, indexes)
+        print 'Copied %s rows of %s' % (nrows[table], table)
+
+    snapshot.commit()
+    snapshot.execute("""ANALYZE""")
+    snapshot.close()
+
+    os.rename(tmp_filename, filename)
+    return nrows
+
+
+class SnapshotConnector(IMDBDatabaseConnector):
+    """ A read-only IMDBDatabaseConnector over a snapshot from
+        export_snapshot.
+
+        The snapshot doesn't have the reviews, and can't be written to.
+        Those requests (and quotes which weren't cached when the
+        snapshot was made) go to the connector returned by
+        get_fallback, which is only called the first time it is
+        needed. Without get_fallback, they raise an Exception. """
+
+    # methods which always go to the fallback connector
+    FALLBACK_METHODS=['get_reviews', 'get_all_reviews', 'iter_reviews',
+            'get_review_keys', 'get_scrape_status',
+            'add_movie', 'append_reviews', 'del_movie', 'mark_scraped',
+            'set_cached_quotes', 'create_quotes_cache', 'delete_quotes_cache',
+            'set_most_informative_features', 'create_top_grossing',
+            'create_top_100_all_time', 'create_bottom_100_all_time',
+            'set_poster_derivatives']
+
+    def __init__(self, filename, get_fallback=None):
+        db=sqlite3.connect(filename, detect_types=sqlite3.PARSE_DECLTYPES)
+        db.text_factory=str
+        db.execute("""PRAGMA query_only=ON""")
+        super(SnapshotConnector,self).__init__(db)
+        # the snapshot is read-only, so its tables never change
+        self._tables=set(i[0] for i in self.query_db("""
+            SELECT name FROM sqlite_master WHERE type='table'"""))
+
+        self.get_fallback=get_fallback
+        self._fallback=None
+
+    @property
+    def fallback(self):
+        if self._fallback is None:
+            if self.get_fallback is None:
+                raise Exception("The snapshot is read-only and has no reviews")
+            self._fallback=self.get_fallback()
+        return self._fallback
+
+    def close(self):
+        self.db.close()
+
+    def query_db(self, a, b=None):
+        c=self.db.cursor()
+        try:
+            c.execute(a.replace('%s','?'), b or ())
+            return c.fetchall()
+        finally:
+            c.close()
+
+    def modify_db(self, a, b=None):
+        raise Exception("The snapshot is read-only")
+
+    def table_exists(self, table):
+        return table in self._tables
+
+    def does_quotes_cache_exist(self):
+        return self.table_exists('rs_quotes_cache') or \
+                (self.get_fallback is not None and self.fallback.does_quotes_cache_exist())
+
+    def get_poster_derivatives(self, imdb_movie_id):
+        if not self.table_exists('rs_poster_derivatives'):
+            return dict()
+        return super(SnapshotConnector,self).get_poster_derivatives(imdb_movie_id)
+
+    def get_poster_derivatives_for_movies(self, imdb_movie_ids):
+        if not self.table_exists('rs_poster_derivatives'):
+            return dict((int(i),dict()) for i in imdb_movie_ids)
+        return super(SnapshotConnector,self).get_poster_derivatives_for_movies(imdb_movie_ids)
+
+    def _get_snapshot_quotes(self, imdb_movie_id):
+        """ The encoded quotes in the snapshot, if they are fresh
+            against the snapshot's own review counts and model version
+            (they are never compared against the fallback's). """
+        for table in ['rs_quotes_cache', 'rs_movie_stats', 'rs_model_version']:
+            if not self.table_exists(table):
+                return None
+        return self._get_fresh_cached_quotes(imdb_movie_id)
+
+    def are_quotes_cached(self, imdb_movie_id):
+        return self._get_snapshot_quotes(imdb_movie_id) is not None or \
+                (self.get_fallback is not None and self.fallback.are_quotes_cached(imdb_movie_id))
+
+    def get_cached_quotes(self, imdb_movie_id):
+        data=self._get_snapshot_quotes(imdb_movie_id)
+        if data is not None:
+            return self.decode_quotes(data)
+        if self.get_fallback is None:
+            return None
+        return self.fallback.get_cached_quotes(imdb_movie_id)
+
+
+def _make_fallback_method(name):
+    def method(self, *args, **kwargs):
+        return getattr(self.fallback, name)(*args, **kwargs)
+    method.__name__=name
+    method.__doc__=getattr(IMDBDatabaseConnector, name).__doc__
+    return method
+
+for _name in SnapshotConnector.FALLBACK_METHODS:
+    setattr(SnapshotConnector, _name, _make_fallback_method(_name))
+
+
+if __name__ == '__main__':
+    parser=argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('filename', help='The sqlite file to write.')
+    args=parser.parse_args()
+
+    import MySQLdb
+    db=MySQLdb.Connection(host=os.environ['RDS_HOSTNAME'],
+            user=os.environ['RDS_USERNAME'],
+            port=int(os.environ['RDS_PORT']),
+            passwd=os.environ['RDS_PASSWORD'],
+            db=os.environ['RDS_DB_NAME'])
+    export_snapshot(IMDBDatabaseConnector(db), os.path.expandvars(args.filename))
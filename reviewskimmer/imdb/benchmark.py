@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+""" Benchmark the scraper against recorded pages
+    (see reviewskimmer.utils.replay).
+
+    To record the pages for a few movies and a chart:
+
+        python -m reviewskimmer.imdb.benchmark --fixtures $DIR --record --movies 1905041 --years 2012
+
+    and then to benchmark them:
+
+        python -m reviewskimmer.imdb.benchmark --fixtures $DIR --movies 1905041 --years 2012
+"""
+import time
+import Queue
+import shutil
+import tempfile
+import resource
+import argparse
+import traceback
+import multiprocessing
+
+from reviewskimmer.imdb import scrape, charts
+from reviewskimmer.utils.replay import ReplayServer, RecordingSession
+from reviewskimmer.utils.web import HTTPSession
+from reviewskimmer.utils.cache import DiskCache
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.
+
+
+def _benchmark_scrape_movie(session, imdb_movie_id, nworkers=1):
+    s=scrape.IMDBScraper(imdb_movie_id=imdb_movie_id, session=session, nworkers=nworkers)
+    s.scrape_movie()
+    return dict(nreviews=len(s.reviews))
+
+def _benchmark_review_pages(session, imdb_movie_id):
+    # download the pages into a cache first so that only the parsing is timed
+    cache_dir=tempfile.mkdtemp()
+    try:
+        session=HTTPSession(proxy=session.proxy, rate_limiter=False,
+                cache=DiskCache(cache_dir, ttl=None, max_size=None))
+        s=scrape.IMDBScraper(imdb_movie_id=imdb_movie_id, session=session)
+        s.scrape_main_page()
+        urls=s.get_review_page_urls()
+        for url in urls:
+            session.get(url)
+        start=time.time()
+        nreviews=sum(len(s.get_reviews_from_page(url)) for url in urls)
+        return dict(nreviews=nreviews, elapsed=time.time()-start, npages=len(urls))
+    finally:
+        shutil.rmtree(cache_dir)
+
+def _benchmark_top_box_office(session, year, number):
+    d=charts.get_top_box_office_by_year(year, number, session=session)
+    return dict(nmovies=len(d))
+
+BENCHMARKS=dict(
+        scrape_movie=_benchmark_scrape_movie,
+        get_reviews_from_page=_benchmark_review_pages,
+        get_top_box_office_by_year=_benchmark_top_box_office)
+
+
+# seconds to wait for a benchmark to finish
+TIMEOUT=60*60
+
+
+def _run(fixtures, name, args, kwargs, queue):
+    """ Run in the child process. Puts (True, results)
+        or (False, the traceback) into queue. """
+    try:
+        server=ReplayServer(fixtures)
+        try:
+            session=server.get_session()
+            start=time.time()
+            results=BENCHMARKS[name](session, *args, **kwargs)
+            results.setdefault('elapsed',time.time()-start)
+            results.setdefault('npages',server.nrequests)
+            results['nmisses']=server.nmisses
+            results['peak_rss_mb']=_peak_rss_mb()
+        finally:
+            server.shutdown()
+    except:
+        queue.put((False, traceback.format_exc()))
+    else:
+        queue.put((True, results))
+
+def _get_result(name, p, queue, timeout):
+    deadline=time.time()+timeout
+    while True:
+        try:
+            return queue.get(timeout=1)
+        except Queue.Empty:
+            pass
+        if not p.is_alive():
+            # it may have finished just after the get timed out
+            try:
+                return queue.get(timeout=1)
+            except Queue.Empty:
+                raise Exception('Benchmark %s exited with code %s' % (name, p.exitcode))
+        if time.time() > deadline:
+            p.terminate()
+            raise Exception('Benchmark %s did not finish in %s seconds' % (name, timeout))
+
+def run_benchmark(fixtures, name, *args, **kwargs):
+    """ Run one of the BENCHMARKS against the pages recorded in the
+        fixtures directory. Each benchmark runs in its own process so
+        that the peak memory (RSS) is measured independently.
+
+        Returns a dict which includes the elapsed time, pages/s
+        and reviews/s (when the benchmark reads reviews). Raises an
+        Exception if the benchmark fails or takes longer than TIMEOUT. """
+    queue=multiprocessing.Queue()
+    p=multiprocessing.Process(target=_run, args=(fixtures, name, args, kwargs, queue))
+    p.start()
+    try:
+        ok,results=_get_result(name, p, queue, TIMEOUT)
+    finally:
+        p.join()
+    if not ok:
+        raise Exception('Benchmark %s failed:\n%s' % (name, results))
+
+    elapsed=max(results['elapsed'],1e-9)
+    results['pages_per_sec']=results['npages']/elapsed
+    if 'nreviews' in results:
+        results['reviews_per_sec']=results['nreviews']/elapsed
+    return results
+
+def format_results(name, results):
+    s='%s: %.2fs, %d pages, %.1f pages/s' % (name, results['elapsed'], results['npages'], results['pages_per_sec'])
+    if 'reviews_per_sec' in results:
+        s+=', %d reviews, %.1f reviews/s' % (results['nreviews'], results['reviews_per_sec'])
+    s+=', peak RSS %.1f MB' % results['peak_rss_mb']
+    if results['nmisses'] > 0:
+        s+=' (%d pages were not recorded!)' % results['nmisses']
+    return s
+
+def record(fixtures, imdb_movie_ids, years, number):
+    session=RecordingSession(fixtures)
+    for imdb_movie_id in imdb_movie_ids:
+        print 'Recording movie %s' % imdb_movie_id
+        scrape.scrape_movie(imdb_movie_id=imdb_movie_id, session=session)
+    for year in years:
+        print 'Recording top box office for %s' % year
+        charts.get_top_box_office_by_year(year, number, session=session)
+
+
+if __name__ == '__main__':
+    parser=argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fixtures', required=True, help='Directory of recorded pages.')
+    parser.add_argument('--record', action='store_true', help='Record the pages from imdb.com.')
+    parser.add_argument('--movies', type=int, nargs='*', default=[])
+    parser.add_argument('--years', type=int, nargs='*', default=[])
+    parser.add_argument('--number', type=int, default=100, help='Number of movies to read from each chart.')
+    parser.add_argument('--nworkers', type=int, nargs='*', default=[1])
+    args=parser.parse_args()
+
+    if args.record:
+        record(args.fixtures, args.movies, args.years, args.number)
+
+    for imdb_movie_id in args.movies:
+        for nworkers in args.nworkers:
+            r=run_benchmark(args.fixtures, 'scrape_movie', imdb_movie_id, nworkers=nworkers)
+            print format_results('scrape_movie(%s, nworkers=%s)' % (imdb_movie_id, nworkers), r)
+        r=run_benchmark(args.fixtures, 'get_reviews_from_page', imdb_movie_id)
+        print format_results('get_reviews_from_page(%s)' % imdb_movie_id, r)
+
+    for year in args.years:
+        r=run_benchmark(args.fixtures, 'get_top_box_office_by_year', year, args.number)
+        print format_results('get_top_box_office_by_year(%s)' % year, r)
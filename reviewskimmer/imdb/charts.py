@@ -3,14 +3,16 @@ try:
 except:
     from ordereddict import OrderedDict
 import re
+import json
+from multiprocessing.pool import ThreadPool
 from pandas import DataFrame
 
 from reviewskimmer.utils.strings import clean_unicode
 from reviewskimmer.utils.web import get_soup
 
-def _get_movie_list(url):
+def _get_movie_list(url, session=None):
 
-    soup = get_soup(url)
+    soup = get_soup(url, session=session)
     votes=soup.find(text='Votes')
     current_movie=votes.next.next.next.next.next.next.next.next.next.next.next
 
@@ -31,84 +33,127 @@ def _get_movie_list(url):
 
     return DataFrame({'imdb_movie_id':imdb_movie_id,'ranking':ranking})
 
-def get_top_100_all_time():
-    df=_get_movie_list(url='http://www.imdb.com/chart/top')
+def get_top_100_all_time(session=None):
+    df=_get_movie_list(url='http://www.imdb.com/chart/top', session=session)
     df.columns = ['rs_imdb_movie_id', 'rs_top_100_ranking']
     return df
 
 
-def get_bottom_100_all_time():
-    df=_get_movie_list(url='http://www.imdb.com/chart/bottom')
+def get_bottom_100_all_time(session=None):
+    df=_get_movie_list(url='http://www.imdb.com/chart/bottom', session=session)
     df.columns = ['rs_imdb_movie_id', 'rs_bottom_100_ranking']
     return df
 
-def get_top_box_office_by_year(year, number, debug=False):
-    """ Pull out the 'number' highest-grosing
-        movies of the year.
-    """
-    NUM_MOVIES_PER_PAGE=50
+NUM_MOVIES_PER_PAGE=50
 
+def _get_top_box_office_url(year, start):
     sort='boxoffice_gross_us'
+    return 'http://www.imdb.com/search/title?at=0&sort=%s&start=%s&title_type=feature&year=%s,%s' % (sort,start,year,year)
+
+def _get_top_box_office_page(year, start, session=None, cache=None):
+    """ Read one page of the highest-grossing movies of a year.
+        Returns a list of (imdb_movie_id, movie_name).
+
+        cache is an optional reviewskimmer.utils.cache.DiskCache
+        in which the parsed page is stored.
+    """
+    url_page = _get_top_box_office_url(year=year,start=start)
 
-    def get_website(start,year):
-        website='http://www.imdb.com/search/title?at=0&sort=%s&start=%s&title_type=feature&year=%s,%s' % (sort,start,year,year)
-        return website
+    key='top_box_office:%s' % url_page
+    if cache is not None:
+        entry=cache.get(key)
+        if entry is not None and cache.is_fresh(entry):
+            return [(imdb_movie_id,movie_name.encode('utf8')) for imdb_movie_id,movie_name in json.loads(entry.body)]
 
-    n=1
+    print url_page
 
-    ret_list=OrderedDict()
+    # I don't get why, but IMDB barfs when I specify a user agent???
+    soup=get_soup(url_page,no_user_agent=True,session=session)
 
-    while n<number:
-        print 'n=%s/%s' % (n,number)
-        url_page = get_website(start=n,year=year)
+    # Match on <td class="number">, which refers to the ranking of the movie
+    all_movies=soup.findAll('td',**{'class':"number"})
 
-        print url_page
-        n+=NUM_MOVIES_PER_PAGE
+    movies=[]
+    for movie in all_movies:
+        title_part=movie.next.next.next.next.next.next.next.next.next.next.next.next.next
 
-        # I don't get why, but IMDB barfs when I specify a user agent???
-        soup=get_soup(url_page,no_user_agent=True)
+        movie_name=clean_unicode(title_part.next)
 
-        # Match on <td class="number">, which refers to the ranking of the movie
-        all_movies=soup.findAll('td',**{'class':"number"})
+        link=str(title_part['href'])
+        m=re.match('/title/tt(\d+)/',link)
+        groups=m.groups()
+        assert len(groups)==1
+        imdb_movie_id=int(groups[0])
 
-        for movie in all_movies:
-            title_part=movie.next.next.next.next.next.next.next.next.next.next.next.next.next
+        _year=title_part.next.next.next.next
+        m=re.match(r'\((\d+)\)',_year)
+        groups=m.groups()
+        assert len(groups)==1
 
-            movie_name=clean_unicode(title_part.next)
+        movies.append((imdb_movie_id,movie_name))
 
-            link=str(title_part['href'])
-            m=re.match('/title/tt(\d+)/',link)
-            groups=m.groups()
-            assert len(groups)==1
-            imdb_movie_id=int(groups[0])
+    if cache is not None:
+        cache.put(key, json.dumps(movies))
 
-            _year=title_part.next.next.next.next
-            m=re.match(r'\((\d+)\)',_year)
-            groups=m.groups()
-            assert len(groups)==1
-            year=int(groups[0])
+    return movies
 
-            ret_list[imdb_movie_id]=movie_name
+def get_top_box_office_by_years(years, number, session=None, nworkers=1, cache=None):
+    """ Pull out the 'number' highest-grossing movies of each year.
+        Returns an OrderedDict mapping each year
+        to an OrderedDict of imdb_movie_id -> movie_name.
 
+        The result pages (for all years) are read nworkers at a time.
+        cache is an optional reviewskimmer.utils.cache.DiskCache
+        in which the parsed pages are stored, so that only
+        expired pages are read again.
+    """
+    pages=[(year,start) for year in years for start in range(1,number,NUM_MOVIES_PER_PAGE)]
+
+    def get_page(page):
+        year,start=page
+        return _get_top_box_office_page(year, start, session=session, cache=cache)
+
+    if nworkers > 1:
+        pool=ThreadPool(nworkers)
+        try:
+            results=pool.map(get_page, pages)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results=[get_page(page) for page in pages]
+
+    ret=OrderedDict((year,OrderedDict()) for year in years)
+    for (year,start),movies in zip(pages,results):
+        for imdb_movie_id,movie_name in movies:
             # if only a few movies are requested
-            if len(ret_list) == number:
-                return ret_list
+            if len(ret[year]) == number:
+                break
+            ret[year][imdb_movie_id]=movie_name
+    return ret
 
-    return ret_list
+def get_top_box_office_by_year(year, number, debug=False, session=None, nworkers=1, cache=None):
+    """ Pull out the 'number' highest-grosing
+        movies of the year.
+    """
+    return get_top_box_office_by_years([year], number,
+            session=session, nworkers=nworkers, cache=cache)[year]
 
 
-def get_top_grossing_dataframe(years, number):
+def get_top_grossing_dataframe(years, number, session=None, nworkers=1, cache=None):
 
     rs_imdb_movie_id=[]
     rs_ranking=[]
     rs_year=[]
 
+    top_box_office=get_top_box_office_by_years(years, number,
+            session=session, nworkers=nworkers, cache=cache)
+
     for year in years:
-        d=get_top_box_office_by_year(year, number, debug=False)
+        d=top_box_office[year]
         for i,k in enumerate(d.keys()):
             rs_ranking.append(i)
             rs_imdb_movie_id.append(k)
             rs_year.append(year)
 
     return DataFrame({'rs_imdb_movie_id':rs_imdb_movie_id,'rs_ranking':rs_ranking,'rs_year':rs_year})
-
@@ -1,13 +1,45 @@
 import traceback
 import sys
 from . import scrape
+from reviewskimmer.utils.io import iter_archive_movies, TruncatedMovie
 
 def ingest_movies(imdb_movie_ids, connector, 
-        nreview_limit=None, force=False, **kwargs):
+        nreview_limit=None, force=False, incremental=False, archive=None,
+        refresh_budget=None, **kwargs):
     """ ingest multiple movies,
         skipping movies which are already in teh
         database, unless nreview_limit is sufficinetly
-        large (or None) that more reviews need to be pulled in. """
+        large (or None) that more reviews need to be pulled in.
+
+        When incremental is True, movies needing more reviews
+        only have the review pages past the reviews already in the
+        database read in, and the new reviews are appended
+        to the database (instead of re-ingesting the whole movie).
+
+        By default, reviews are streamed from the scraper into
+        the database (see scrape_movie's stream argument), through
+        a temporary file, so that the database transaction only
+        starts once every review page has been downloaded.
+
+        archive is an optional reviewskimmer.utils.io.ArchiveWriter
+        which every fully scraped movie is also written to (as it is
+        streamed into the database), so the database can later
+        be rebuilt with import_archive instead of re-scraping.
+
+        Checking a movie which is already in the database costs
+        at least a fetch of its main page. refresh_budget is an
+        optional number of page fetches to spend on them: only the
+        movies reviewskimmer.imdb.schedule.choose_movies_to_refresh
+        picks within it are checked, and the rest are skipped (new
+        movies are always scraped). By default, every movie is checked. """
+    kwargs.setdefault('stream',True)
+
+    refresh=None
+    if refresh_budget is not None and not force:
+        # imported here since schedule uses this module
+        from .schedule import choose_movies_to_refresh
+        refresh=set(choose_movies_to_refresh(connector, refresh_budget, imdb_movie_ids=imdb_movie_ids))
+
     def _scrape(imdb_movie_id,force=False):
         try:
             print ' -> loading ',
@@ -15,13 +47,42 @@ def ingest_movies(imdb_movie_ids, connector,
                 imdb_movie_id=imdb_movie_id,
                 nreview_limit=nreview_limit,
                 **kwargs)
-            print '%s :)' % movie['movie_name']
-            connector.add_movie(movie,force=force)
+            print '%s' % movie['movie_name'],
+            if archive is not None:
+                movie=archive.tee_movie(movie)
+            nadded=connector.add_movie(movie,force=force)
+            print '(%s reviews) :)' % nadded
             return movie
         except:
             print 'Error Reading Movie %s, moving on...' % imdb_movie_id
             traceback.print_exc(sys.stdout)
 
+    def _scrape_new_reviews(imdb_movie_id,nreviews_in_db):
+        try:
+            print ' -> loading new reviews ',
+            movie=scrape.scrape_movie(
+                imdb_movie_id=imdb_movie_id,
+                nreview_limit=nreview_limit,
+                start=nreviews_in_db,
+                **kwargs)
+            nadded=connector.append_reviews(imdb_movie_id,movie['reviews'])
+            connector.mark_scraped(imdb_movie_id,movie['nreviews'])
+            print '%s (%s new reviews) :)' % (movie['movie_name'],nadded)
+            return movie
+        except:
+            print 'Error Reading Movie %s, moving on...' % imdb_movie_id
+            traceback.print_exc(sys.stdout)
+
+    def _update(imdb_movie_id,nreviews_in_db):
+        if incremental:
+            _scrape_new_reviews(imdb_movie_id,nreviews_in_db)
+        else:
+            _scrape(imdb_movie_id,force=True)
+
+    def _nreviews_on_page(imdb_movie_id):
+        return scrape.nreviews_on_page(imdb_movie_id, debug=False,
+                base_url=kwargs.get('base_url'), session=kwargs.get('session'))
+
     for i,imdb_movie_id in enumerate(imdb_movie_ids):
 
         print imdb_movie_id,'%s/%s' % (i,len(imdb_movie_ids))
@@ -31,25 +92,56 @@ def ingest_movies(imdb_movie_ids, connector,
         else:
             if not connector.in_database(imdb_movie_id):
                 movie=_scrape(imdb_movie_id)
+            elif refresh is not None and imdb_movie_id not in refresh:
+                print ' -> not due for a refresh, skipping :('
             else:
                 nreviews_in_db=connector.get_nreviews(imdb_movie_id)
 
                 if nreview_limit is None:
                     # Default to read all reviews
-                    nreviews_in_imdb=scrape.nreviews_on_page(imdb_movie_id, debug=False)
+                    nreviews_in_imdb=_nreviews_on_page(imdb_movie_id)
                     if nreviews_in_db < nreviews_in_imdb:
-                       _scrape(imdb_movie_id,force=True)
+                       _update(imdb_movie_id,nreviews_in_db)
                     else:
+                       connector.mark_scraped(imdb_movie_id,nreviews_in_imdb)
                        print ' -> skipping %s :(' % connector.get_movie_name(imdb_movie_id)
                 else: # specify # of reviews to read
                     if nreview_limit <= nreviews_in_db:
                         # if enough reviews already in database
                         print ' -> skipping %s :(' % connector.get_movie_name(imdb_movie_id)
                     else:
-                        nreviews_in_imdb=scrape.nreviews_on_page(imdb_movie_id, debug=False)
+                        nreviews_in_imdb=_nreviews_on_page(imdb_movie_id)
                         if nreviews_in_imdb <= nreviews_in_db:
                             # or the required # of reviews is small
+                            connector.mark_scraped(imdb_movie_id,nreviews_in_imdb)
                             print ' -> skipping %s :(' % connector.get_movie_name(imdb_movie_id)
                         else:
-                            _scrape(imdb_movie_id,force=True)
+                            _update(imdb_movie_id,nreviews_in_db)
         print
+
+
+def import_archive(filename, connector, force=False):
+    """ Load the movies in an archive written by
+        reviewskimmer.utils.io.ArchiveWriter into the database.
+        Reviews are streamed from the file into the database,
+        so the archive can be much bigger than memory.
+
+        A movie whose reviews were not all archived is skipped:
+        add_movie reads all of its reviews before writing anything,
+        so nothing is written when they turn out to be truncated.
+
+        Returns the number of movies added. """
+    nmovies=0
+    for movie in iter_archive_movies(filename):
+        print movie['imdb_movie_id'],movie['movie_name'],
+        if not force and connector.in_database(movie['imdb_movie_id']):
+            print ' -> skipping :('
+            continue
+        try:
+            nadded=connector.add_movie(movie,force=force)
+        except TruncatedMovie, e:
+            print ' -> %s, skipping :(' % e
+            continue
+        print '(%s reviews) :)' % nadded
+        nmovies+=1
+    return nmovies
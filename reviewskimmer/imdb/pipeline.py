@@ -0,0 +1,169 @@
+import os
+import sys
+import time
+import threading
+import traceback
+import Queue
+from os.path import expandvars, exists
+
+from . import scrape
+
+
+class IngestCheckpoint(object):
+    """ Keep track of which movies have been ingested in a file
+        (one imdb movie id per line), so that an interrupted
+        ingest can be restarted where it left off. """
+
+    def __init__(self, filename):
+        self.filename=expandvars(filename)
+        self.completed=set()
+        if exists(self.filename):
+            for line in open(self.filename):
+                line=line.strip()
+                if line != '':
+                    self.completed.add(int(line))
+
+    def is_done(self, imdb_movie_id):
+        return imdb_movie_id in self.completed
+
+    def mark_done(self, imdb_movie_id):
+        self.completed.add(imdb_movie_id)
+        f=open(self.filename,'a')
+        try:
+            f.write('%s\n' % imdb_movie_id)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+
+
+class StageStats(object):
+    """ Count the movies, reviews and time spent in one stage of the pipeline. """
+
+    def __init__(self, name):
+        self.name=name
+        self.nmovies=0
+        self.nreviews=0
+        self.nerrors=0
+        self.busy=0.
+        self._lock=threading.Lock()
+
+    def add(self, elapsed, nreviews=0, error=False):
+        with self._lock:
+            self.busy+=elapsed
+            if error:
+                self.nerrors+=1
+            else:
+                self.nmovies+=1
+                self.nreviews+=nreviews
+
+    def report(self, wall_time):
+        wall_time=max(wall_time,1e-9)
+        return '%s: %d movies (%d errors), %d reviews, %.2f movies/s, %.1f reviews/s, %.1fs busy' % \
+            (self.name, self.nmovies, self.nerrors, self.nreviews,
+             self.nmovies/wall_time, self.nreviews/wall_time, self.busy)
+
+
+def ingest_movies_pipelined(imdb_movie_ids, connector,
+        nworkers=4, queue_size=8, checkpoint=None,
+        force=False, report_every=10, **kwargs):
+    """ Ingest many movies, scraping nworkers movies at once.
+
+        Scraped movies are put on a queue (of at most queue_size
+        movies) which is drained by a single writer, the calling
+        thread, that adds them to the database with connector.
+
+        checkpoint is an optional filename. Each movie written to the
+        database is recorded in it, and movies already recorded are
+        skipped, so a crashed ingest can simply be run again.
+
+        Unlike reviewskimmer.imdb.ingest.ingest_movies, movies already
+        in the database are skipped (unless force is True), so this is
+        meant for backfilling new movies. kwargs are passed
+        into reviewskimmer.imdb.scrape.scrape_movie, except for
+        stream: the scraper threads read every review of a movie
+        before it is queued, since otherwise the review pages would
+        be downloaded by the writer.
+
+        Returns a dict of the StageStats for the 'scrape' and 'write' stages.
+    """
+    kwargs['stream']=False
+
+    if checkpoint is not None:
+        checkpoint=IngestCheckpoint(checkpoint)
+
+    todo=[]
+    for imdb_movie_id in imdb_movie_ids:
+        if checkpoint is not None and checkpoint.is_done(imdb_movie_id):
+            continue
+        if not force and connector.in_database(imdb_movie_id):
+            if checkpoint is not None: checkpoint.mark_done(imdb_movie_id)
+            continue
+        todo.append(imdb_movie_id)
+
+    print 'Ingesting %s movies (%s skipped)' % (len(todo),len(imdb_movie_ids)-len(todo))
+
+    scrape_stats=StageStats('scrape')
+    write_stats=StageStats('write')
+
+    inputs=Queue.Queue()
+    for imdb_movie_id in todo:
+        inputs.put(imdb_movie_id)
+
+    outputs=Queue.Queue(maxsize=queue_size)
+
+    def scrape_worker():
+        while True:
+            try:
+                imdb_movie_id=inputs.get_nowait()
+            except Queue.Empty:
+                break
+
+            start=time.time()
+            try:
+                movie=scrape.scrape_movie(imdb_movie_id=imdb_movie_id, **kwargs)
+                scrape_stats.add(time.time()-start, len(movie['reviews']))
+            except:
+                print 'Error Reading Movie %s, moving on...' % imdb_movie_id
+                traceback.print_exc(sys.stdout)
+                scrape_stats.add(time.time()-start, error=True)
+                movie=None
+            outputs.put((imdb_movie_id,movie))
+
+    workers=[threading.Thread(target=scrape_worker) for i in range(nworkers)]
+    for worker in workers:
+        worker.daemon=True
+        worker.start()
+
+    wall_start=time.time()
+
+    for i in range(len(todo)):
+        imdb_movie_id,movie=outputs.get()
+        if movie is None:
+            continue
+
+        start=time.time()
+        try:
+            nadded=connector.add_movie(movie, force=force)
+            write_stats.add(time.time()-start, nadded)
+            if checkpoint is not None: checkpoint.mark_done(imdb_movie_id)
+            print '%s: %s :)' % (imdb_movie_id,movie['movie_name'])
+        except:
+            print 'Error Writing Movie %s, moving on...' % imdb_movie_id
+            traceback.print_exc(sys.stdout)
+            write_stats.add(time.time()-start, error=True)
+
+        if report_every is not None and (i+1) % report_every == 0:
+            wall_time=time.time()-wall_start
+            print ' * %s/%s, queue=%s' % (i+1, len(todo), outputs.qsize())
+            print ' * ' + scrape_stats.report(wall_time)
+            print ' * ' + write_stats.report(wall_time)
+
+    for worker in workers:
+        worker.join()
+
+    wall_time=time.time()-wall_start
+    print scrape_stats.report(wall_time)
+    print write_stats.report(wall_time)
+
+    return dict(scrape=scrape_stats, write=write_stats)
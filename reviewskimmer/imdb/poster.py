@@ -1,6 +1,52 @@
+try:
+    from collections import OrderedDict
+except:
+    from ordereddict import OrderedDict
 from os.path import expandvars, join, exists
 import os
-import urllib
+import hashlib
+import tempfile
+from cStringIO import StringIO
+import sys
+import threading
+import traceback
+from multiprocessing.pool import ThreadPool
+
+from reviewskimmer.utils.web import get_default_session
+
+BUCKET_NAME='reviewskimmer'
+
+S3_URL='https://s3-us-west-2.amazonaws.com/%s' % BUCKET_NAME
+
+# The width (in pixels) of each poster derivative. 'retina' is
+# twice 'medium' so it can be served to high density screens.
+POSTER_SIZES=OrderedDict([('small',100),('medium',182),('retina',364)])
+
+# Formats of the poster derivatives, best first.
+# Browsers which can't show webp get the jpeg.
+POSTER_FORMATS=OrderedDict([('webp','image/webp'),('jpeg','image/jpeg')])
+
+# Derivatives are named by their contents, so they never change
+POSTER_CACHE_CONTROL='public, max-age=31536000'
+
+def get_poster_thumbnail_basename(imdb_movie_id):
+    return 'poster_thumbnail_%s.jpg' % imdb_movie_id
+
+def save_poster(filename, body):
+    """ Write a downloaded poster through a temporary file, so a
+        failed download never leaves a partial poster behind (which
+        would be uploaded as it is, and never downloaded again). """
+    assert len(body)>0
+    fd,temp=tempfile.mkstemp(dir=os.path.dirname(filename), suffix='.tmp')
+    try:
+        try:
+            os.write(fd,body)
+        finally:
+            os.close(fd)
+        os.rename(temp,filename)
+    except:
+        os.remove(temp)
+        raise
 
 def scrape_movie_poster_thumbnail(imdb_movie_id, connector, poster_thumbnail_dir):
 
@@ -8,7 +54,7 @@ def scrape_movie_poster_thumbnail(imdb_movie_id, connector, poster_thumbnail_dir
     movie = connector.get_movie(imdb_movie_id)
 
     imdb_poster_thumbnail_url = movie['rs_imdb_poster_thumbnail_url']
-    local_poster_thumbnail_filename=join(poster_thumbnail_dir,'poster_thumbnail_%s.jpg' % imdb_movie_id)
+    local_poster_thumbnail_filename=join(poster_thumbnail_dir,get_poster_thumbnail_basename(imdb_movie_id))
 
     if imdb_poster_thumbnail_url is None:
         print ' * Skipping thumbnail poster for movie %s b/c it is not on IMDB' % imdb_movie_id
@@ -16,8 +62,8 @@ def scrape_movie_poster_thumbnail(imdb_movie_id, connector, poster_thumbnail_dir
     else:
         if not exists(local_poster_thumbnail_filename):
             print ' * downloading thumbnail poster %s' % imdb_poster_thumbnail_url
-            urllib.urlretrieve(imdb_poster_thumbnail_url,local_poster_thumbnail_filename)
-            assert os.stat(local_poster_thumbnail_filename).st_size>0
+            body=get_default_session().get(imdb_poster_thumbnail_url).body
+            save_poster(local_poster_thumbnail_filename, body)
         else:
             print ' * skipping thumbnail poster %s' % imdb_poster_thumbnail_url
         return local_poster_thumbnail_filename
@@ -46,3 +92,187 @@ def scrape_all_movie_posters(connector, s3, poster_thumbnail_dir):
         if local_poster_thumbnail_filename is not None:
             injest_movie_poster_into_s3(local_poster_thumbnail_filename,s3)
         print
+
+def connect_s3(host=None, port=None, is_secure=True):
+    """ Connect to S3, or (when host is given) to a local
+        S3 stand-in such as fakes3 or moto_server. """
+    import boto
+    if host is None:
+        return boto.connect_s3()
+    from boto.s3.connection import OrdinaryCallingFormat
+    return boto.connect_s3(aws_access_key_id='local', aws_secret_access_key='local',
+            host=host, port=port, is_secure=is_secure,
+            calling_format=OrdinaryCallingFormat())
+
+def list_bucket_keys(bucket):
+    """ The names of every key in a bucket (boto pages
+        through the listing 1000 keys at a time). """
+    return set(k.name for k in bucket.list())
+
+def sync_movie_posters(connector, poster_thumbnail_dir, s3_connect=connect_s3,
+        bucket_name=BUCKET_NAME, nworkers=8, session=None):
+    """ Put the poster of every movie in the database into S3.
+
+        The bucket is listed once and only the missing posters are
+        downloaded (unless they are already in poster_thumbnail_dir)
+        and uploaded, nworkers at a time.
+
+        s3_connect is a function returning a new boto S3 connection.
+        Since boto connections can not be shared between threads,
+        each worker makes its own.
+
+        Returns the list of imdb movie ids whose posters were added.
+    """
+    poster_thumbnail_dir = expandvars(poster_thumbnail_dir)
+    if session is None: session=get_default_session()
+
+    movies=connector.get_all_movies()
+
+    existing=list_bucket_keys(s3_connect().get_bucket(bucket_name))
+
+    missing=[]
+    for i,movie in movies.iterrows():
+        imdb_movie_id=int(movie['rs_imdb_movie_id'])
+        url=movie['rs_imdb_poster_thumbnail_url']
+        if url is None or url != url:
+            continue
+        if get_poster_thumbnail_basename(imdb_movie_id) not in existing:
+            missing.append((imdb_movie_id,url))
+
+    print '%s posters in S3, %s missing' % (len(existing),len(missing))
+
+    local=threading.local()
+
+    def get_bucket():
+        if not hasattr(local,'bucket'):
+            local.bucket=s3_connect().get_bucket(bucket_name)
+        return local.bucket
+
+    def sync(args):
+        imdb_movie_id,url=args
+        try:
+            basename=get_poster_thumbnail_basename(imdb_movie_id)
+            filename=join(poster_thumbnail_dir,basename)
+            if not exists(filename):
+                save_poster(filename, session.get(url).body)
+
+            k=get_bucket().new_key(basename)
+            k.set_contents_from_filename(filename, policy='public-read')
+            print ' * added poster for movie %s' % imdb_movie_id
+            return imdb_movie_id
+        except:
+            print 'Error syncing poster for movie %s, moving on...' % imdb_movie_id
+            traceback.print_exc(sys.stdout)
+
+    pool=ThreadPool(nworkers)
+    try:
+        added=pool.map(sync, missing)
+    finally:
+        pool.close()
+        pool.join()
+
+    return [i for i in added if i is not None]
+
+def make_poster_derivatives(image_data):
+    """ Resize a poster image into each of the POSTER_SIZES,
+        saving each size in every one of the POSTER_FORMATS
+        that PIL can write. Returns a list of dicts. """
+    from PIL import Image
+
+    image=Image.open(StringIO(image_data))
+    image=image.convert('RGB')
+
+    derivatives=[]
+    for size,width in POSTER_SIZES.items():
+        height=int(round(float(image.size[1])*width/image.size[0]))
+        resized=image.resize((width,height), Image.ANTIALIAS)
+
+        for format,content_type in POSTER_FORMATS.items():
+            buf=StringIO()
+            try:
+                if format == 'webp':
+                    resized.save(buf, 'WEBP', quality=80)
+                else:
+                    resized.save(buf, 'JPEG', quality=85, optimize=True, progressive=True)
+            except (IOError, KeyError):
+                # this PIL was built without support for the format
+                continue
+            derivatives.append(dict(size=size, format=format, 
+                content_type=content_type, width=width, height=height, 
+                body=buf.getvalue()))
+    return derivatives
+
+def get_poster_derivative_basename(imdb_movie_id, derivative):
+    digest=hashlib.sha1(derivative['body']).hexdigest()[:12]
+    extension='jpg' if derivative['format'] == 'jpeg' else derivative['format']
+    return 'poster_%s_%s_%s.%s' % (imdb_movie_id, derivative['size'], digest, extension)
+
+def upload_poster_derivatives(imdb_movie_id, image_data, bucket):
+    """ Make the derivatives of a poster and put them into S3 (with
+        long cache lifetimes, since the names change whenever the
+        contents do). Returns the derivatives, without their bodies,
+        but with the 's3_key' each was stored in. """
+    derivatives=make_poster_derivatives(image_data)
+    for d in derivatives:
+        d['s3_key']=get_poster_derivative_basename(imdb_movie_id, d)
+        k=bucket.new_key(d['s3_key'])
+        k.set_contents_from_string(d.pop('body'), policy='public-read',
+                headers={'Content-Type':d['content_type'],
+                         'Cache-Control':POSTER_CACHE_CONTROL})
+    return derivatives
+
+def generate_all_poster_derivatives(connector, s3_connect=connect_s3,
+        bucket_name=BUCKET_NAME, nworkers=8, session=None, force=False):
+    """ Make the poster derivatives for every movie in the
+        database which doesn't have them yet (or every movie, when force
+        is True), nworkers at a time, and record them in the database.
+
+        The full size IMDB poster is used when there is one, since it
+        resizes better than the thumbnail. """
+    if session is None: session=get_default_session()
+
+    if not connector.does_poster_derivatives_table_exist():
+        connector.create_poster_derivatives_table()
+
+    done=set() if force else connector.get_imdb_movie_ids_with_poster_derivatives()
+
+    movies=connector.get_all_movies()
+
+    todo=[]
+    for i,movie in movies.iterrows():
+        imdb_movie_id=int(movie['rs_imdb_movie_id'])
+        if imdb_movie_id in done: continue
+        for url in [movie['rs_imdb_poster_url'],movie['rs_imdb_poster_thumbnail_url']]:
+            if url is not None and url == url:
+                todo.append((imdb_movie_id,url))
+                break
+
+    print 'Making poster derivatives for %s movies' % len(todo)
+
+    local=threading.local()
+
+    def get_bucket():
+        if not hasattr(local,'bucket'):
+            local.bucket=s3_connect().get_bucket(bucket_name)
+        return local.bucket
+
+    def generate(args):
+        imdb_movie_id,url=args
+        try:
+            image_data=session.get(url).body
+            return imdb_movie_id,upload_poster_derivatives(imdb_movie_id, image_data, get_bucket())
+        except:
+            print 'Error making poster derivatives for movie %s, moving on...' % imdb_movie_id
+            traceback.print_exc(sys.stdout)
+            return imdb_movie_id,None
+
+    pool=ThreadPool(nworkers)
+    try:
+        # the database is only written to from this thread
+        for imdb_movie_id,derivatives in pool.imap_unordered(generate, todo):
+            if derivatives is not None:
+                connector.set_poster_derivatives(imdb_movie_id, derivatives)
+                print ' * added poster derivatives for movie %s' % imdb_movie_id
+    finally:
+        pool.close()
+        pool.join()
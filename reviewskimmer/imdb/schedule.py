@@ -0,0 +1,124 @@
+import math
+from datetime import datetime, date
+
+from .ingest import ingest_movies
+
+# IMDB review pages have 10 reviews each
+REVIEWS_PER_PAGE=10
+
+
+def _to_datetime(d):
+    """ Convert the dates which come out of the database (which
+        may be missing) into datetimes or None. """
+    if d is None or d != d: # d != d for NaN/NaT
+        return None
+    if hasattr(d,'to_pydatetime'):
+        d=d.to_pydatetime()
+    if isinstance(d,datetime):
+        return d
+    if isinstance(d,date):
+        return datetime(d.year,d.month,d.day)
+    return None
+
+
+def expected_new_reviews(nreviews, days_since_release, days_since_scrape):
+    """ Estimate how many reviews a movie got since it was last scraped.
+
+        Reviews are assumed to come in at the movie's average rate so far
+        (nreviews/days_since_release), which favors popular movies and
+        recent releases (most reviews are written soon after release).
+        A month is added to the movie's age so brand new movies
+        don't get an infinite rate. """
+    return nreviews*days_since_scrape/(days_since_release+30.)
+
+
+def get_refresh_priorities(connector, now=None, min_age_days=1, max_age_days=365, imdb_movie_ids=None):
+    """ Rank the movies in the database (or only those in
+        imdb_movie_ids) by how much they need to be re-scraped.
+        Returns a list of dicts (most urgent first) with
+        the imdb_movie_id, the expected number of new reviews,
+        and the estimated cost (in page fetches) to refresh it.
+
+        Movies scraped less than min_age_days ago are never picked. Movies
+        not scraped in max_age_days are picked before all others so
+        that no movie goes stale forever. """
+    if now is None: now=datetime.now()
+
+    status=connector.get_scrape_status()
+    if imdb_movie_ids is not None:
+        imdb_movie_ids=set(imdb_movie_ids)
+
+    priorities=[]
+    for i,movie in status.iterrows():
+        if imdb_movie_ids is not None and int(movie['rs_imdb_movie_id']) not in imdb_movie_ids:
+            continue
+        last_scraped=_to_datetime(movie['rs_last_scraped'])
+        release_date=_to_datetime(movie['rs_release_date'])
+
+        nreviews=movie['rs_nreviews_at_scrape']
+        if nreviews is None or nreviews != nreviews: nreviews=0
+
+        if release_date is None:
+            days_since_release=10*365.
+        else:
+            days_since_release=max((now-release_date).days,0)
+
+        if last_scraped is None:
+            days_since_scrape=days_since_release
+        else:
+            days_since_scrape=(now-last_scraped).total_seconds()/(24*60*60.)
+
+        if days_since_scrape < min_age_days:
+            continue
+
+        expected=expected_new_reviews(nreviews, days_since_release, days_since_scrape)
+
+        # reading the main page, plus the new review pages
+        cost=1+int(math.ceil(expected/REVIEWS_PER_PAGE))
+
+        priorities.append(dict(
+            imdb_movie_id=int(movie['rs_imdb_movie_id']),
+            expected_new_reviews=expected,
+            overdue=days_since_scrape >= max_age_days,
+            cost=cost))
+
+    priorities.sort(key=lambda x: (x['overdue'], x['expected_new_reviews']), reverse=True)
+    return priorities
+
+
+def choose_movies_to_refresh(connector, budget, **kwargs):
+    """ Pick the movies to re-scrape with at most budget page fetches.
+        kwargs are passed into get_refresh_priorities.
+
+        So that a movie which costs more than the budget isn't skipped
+        forever, the most urgent overdue movie which doesn't fit is
+        picked anyway (which can take the run over budget by one movie).
+        The other overdue movies which don't fit are printed. """
+    chosen=[]
+    over_budget=None
+    skipped=[]
+    for p in get_refresh_priorities(connector, **kwargs):
+        if p['cost'] <= budget:
+            chosen.append(p['imdb_movie_id'])
+            budget-=p['cost']
+        elif p['overdue'] and over_budget is None:
+            over_budget=p
+            chosen.append(p['imdb_movie_id'])
+            budget-=p['cost']
+        elif p['overdue']:
+            skipped.append(p)
+
+    for p in skipped:
+        print 'Skipping overdue movie %s, which costs %s pages (over budget)' % (p['imdb_movie_id'], p['cost'])
+    return chosen
+
+
+def refresh_movies(connector, budget, min_age_days=1, max_age_days=365, **kwargs):
+    """ Incrementally re-scrape the movies most likely to have new
+        reviews, spending about budget page fetches. kwargs
+        are passed into ingest_movies. """
+    imdb_movie_ids=choose_movies_to_refresh(connector, budget,
+            min_age_days=min_age_days, max_age_days=max_age_days)
+    print 'Refreshing %s movies' % len(imdb_movie_ids)
+    ingest_movies(imdb_movie_ids, connector, incremental=True, **kwargs)
+    return imdb_movie_ids
@@ -7,33 +7,87 @@ import os
 import datetime
 from os.path import expandvars,join
 import traceback
+import threading
+from multiprocessing.pool import ThreadPool
+from bs4 import SoupStrainer
 
 from reviewskimmer.utils.web import url_join, get_html_text, get_soup
 from reviewskimmer.utils.strings import clean_unicode
 
-def scrape_movie(**kwargs):
-    """ Convenience function  which scrapes one movie. """
+def scrape_movie(stream=False, **kwargs):
+    """ Convenience function  which scrapes one movie. 
+
+        When stream is True, only the main page is scraped
+        up front and 'reviews' is a generator which scrapes the
+        review pages as it is consumed (see IMDBScraper.iter_reviews).
+    """
     s=IMDBScraper(**kwargs)
+    if stream:
+        s.scrape_main_page()
+        return s.get_results(reviews=s.iter_reviews())
     s.scrape_movie()
     return s.get_results()
 
-def nreviews_on_page(imdb_movie_id, debug=False):
+def nreviews_on_page(imdb_movie_id, debug=False, base_url=None, session=None):
     """ This static function is necessary for caching. """
-    main_page_url=IMDBScraper.get_main_page_url(imdb_movie_id)
-    main_page_soup = get_soup(main_page_url)
+    main_page_url=IMDBScraper.get_main_page_url(imdb_movie_id, base_url)
+    main_page_soup = get_soup(main_page_url, session=session)
     return IMDBScraper._scrape_nreviews(main_page_soup,imdb_movie_id,debug)
 
 
 class IMDBScraper(object):
+
+    IMDB_URL='http://www.imdb.com'
+
+    # All the reviews on a review page are inside this div
+    REVIEW_PAGE_STRAINER=SoupStrainer('div', id='tn15content')
+
+    # Everything read from the main page is either the <title>
+    # or inside of a <div>. This skips the <head>, scripts, etc.
+    MAIN_PAGE_STRAINER=SoupStrainer(['title','div'])
+
     def __init__(self, 
             imdb_movie_id,
             debug=False, 
-            nreview_limit=None):
+            nreview_limit=None,
+            nworkers=1,
+            base_url=None,
+            session=None,
+            start=0,
+            fast_parsing=True):
+        """ nworkers is the number of threads used to download
+            and parse review pages. The default of 1 scrapes
+            the pages serially.
+
+            base_url can be used to point the scraper at a
+            server other than www.imdb.com (for example, a
+            local server of recorded pages).
+
+            session is the reviewskimmer.utils.web.HTTPSession used
+            to download pages. By default, the shared session is used.
+
+            start is the first review to read. Pages before it are
+            skipped, which is used to only read in new reviews.
+            Since IMDB pages hold 10 reviews, start is rounded down
+            to the beginning of its page.
+
+            When fast_parsing is True, only the parts of the pages
+            which are scraped get parsed. Set it to False to parse
+            the full pages.
+        """
         self.imdb_movie_id = imdb_movie_id
         self.debug=debug
         self.nreview_limit=nreview_limit
+        self.nworkers=nworkers
+        self.base_url=base_url
+        self.session=session
+        self.start=start - start % 10
+        self.fast_parsing=fast_parsing
 
         assert self.nreview_limit is None or self.nreview_limit % 10 == 0
+        assert self.nworkers >= 1
+
+        self.imdb_review_ranking_counter=self.start
 
     @staticmethod
     def format_imdb_date(date):
@@ -143,13 +197,15 @@ class IMDBScraper(object):
                 self.gross = None
 
     @staticmethod
-    def get_main_page_url(imdb_movie_id):
-        return url_join('http://www.imdb.com/title/','tt%07d' % imdb_movie_id)
+    def get_main_page_url(imdb_movie_id, base_url=None):
+        if base_url is None: base_url=IMDBScraper.IMDB_URL
+        return url_join(base_url,'title','tt%07d' % imdb_movie_id)
     
     def scrape_main_page(self):
 
-        self.main_page_url = self.get_main_page_url(self.imdb_movie_id)
-        self.main_page_soup = get_soup(self.main_page_url)
+        self.main_page_url = self.get_main_page_url(self.imdb_movie_id, self.base_url)
+        self.main_page_soup = get_soup(self.main_page_url, session=self.session,
+                parse_only=self.MAIN_PAGE_STRAINER if self.fast_parsing else None)
 
         self.scrape_title()
         self.scrape_nreviews()
@@ -165,31 +221,87 @@ class IMDBScraper(object):
 
         self.scrape_main_page()
 
-
         # load in all review pages
-        n=0
+        self.reviews = list(self.iter_reviews())
 
-        self.reviews = []
-        self.imdb_review_ranking_counter=0
+    def iter_reviews(self):
+        """ Generator which scrapes the review pages one at a time
+            (or nworkers at a time), yielding each review. Only the pages
+            being scraped are held in memory. scrape_main_page must
+            be called first. """
 
-        while n < self.nreviews:
-            imdb_review_url=url_join(self.main_page_url,'reviews?start=%s' % n)
+        review_urls = self.get_review_page_urls()
 
-            if n % 50 ==0 and self.debug:
-                print ' * n=%d/%d' % (n, self.nreviews)
+        self.imdb_review_ranking_counter=self.start
 
+        if self.nworkers > 1:
+            pages = self._iter_pages_concurrently(review_urls)
+        else:
+            pages = (self._get_reviews_from_page(url) for url in review_urls)
+
+        for i,page in enumerate(pages):
+            if i % 5 == 0 and self.debug:
+                print ' * n=%d/%d' % (self.start+10*i, self.nreviews)
+
+            for review in self._rank_reviews(page):
+                yield review
+
+    def _iter_pages_concurrently(self, review_urls):
+        """ Scrape the review pages with nworkers threads, yielding them
+            in the same order as review_urls, so the ranking is identical
+            to the serial case. """
+        pool = ThreadPool(self.nworkers)
+
+        # imap hands out the urls as fast as the pool can take them, so
+        # only let it get 2*nworkers pages ahead of the reviews being read
+        ahead = threading.Semaphore(2*self.nworkers)
+        stopped = threading.Event()
+        def urls():
+            for url in review_urls:
+                ahead.acquire()
+                if stopped.is_set(): return
+                yield url
 
-            self.reviews += self.get_reviews_from_page(imdb_review_url)
+        try:
+            for page in pool.imap(self._get_reviews_from_page, urls()):
+                ahead.release()
+                yield page
+        finally:
+            # wake up imap, if it is waiting for a free slot
+            stopped.set()
+            ahead.release()
+            pool.close()
+            pool.join()
+
+    def get_review_page_urls(self):
+        """ Return the urls of all the review pages to scrape. """
+        n=self.start
+        review_urls=[]
+        while n < self.nreviews:
+            if self.nreview_limit is not None and n >= self.nreview_limit:
+                break
 
-            n+=10 # imdb pages increment in steps of 10
+            review_urls.append(url_join(self.main_page_url,'reviews?start=%s' % n))
 
-            if self.nreview_limit is not None and n == self.nreview_limit:
-                break
+            n+=10 # imdb pages increment in steps of 10
+        return review_urls
 
+    def _rank_reviews(self,reviews):
+        """ Number the reviews in the order they were read in. """
+        for review in reviews:
+            review['imdb_review_ranking']=self.imdb_review_ranking_counter
+            self.imdb_review_ranking_counter+=1
+        return reviews
 
     def get_reviews_from_page(self,imdb_review_url):
+        return self._rank_reviews(self._get_reviews_from_page(imdb_review_url))
+
+    def _get_reviews_from_page(self,imdb_review_url):
+        """ Read in all reviews on a page, without ranking them.
+            This is safe to call from multiple threads. """
 
-        soup = get_soup(imdb_review_url)
+        soup = get_soup(imdb_review_url, session=self.session,
+                parse_only=self.REVIEW_PAGE_STRAINER if self.fast_parsing else None)
 
         # find all reviews on the page
         # The easiest way si to match on user avatars:
@@ -202,9 +314,15 @@ class IMDBScraper(object):
             except:
                 print 'Error Reading in review on page %s' % imdb_review_url
                 if self.debug: traceback.print_exc()
+
+        # Free the parse tree now instead of waiting for
+        # the garbage collector to break its reference cycles.
+        soup.decompose()
+
         return all_reviews
 
-    def get_results(self):
+    def get_results(self, reviews=None):
+        if reviews is None: reviews=self.reviews
         return dict(
                 imdb_movie_id=self.imdb_movie_id,
                 imdb_movie_url=self.main_page_url,
@@ -216,7 +334,7 @@ class IMDBScraper(object):
                 imdb_poster_thumbnail_url=self.imdb_poster_thumbnail_url,
                 movie_name=self.movie_name,
                 release_date=self.release_date,
-                reviews=self.reviews)
+                reviews=reviews)
 
     def get_posters(self):
         """ Read in the movie posters from a page.
@@ -269,7 +387,10 @@ class IMDBScraper(object):
             assert review_score[1]==10
             review_score=review_score[0]
 
-            _reviewer=_title.next.next.next.contents[3].next
+            # html.parser nests everything after an unclosed <br> inside of
+            # it (lxml doesn't), so look for the reviewer's link instead
+            # of walking into the <br>
+            _reviewer=review_image.find_next('a').next
         else:
             # No user review, jump to reviewer
             review_score=None
@@ -311,7 +432,7 @@ class IMDBScraper(object):
             review_place = groups[0]
             review_place=review_place
 
-            _date=_review_place.next.contents[1].next
+            _date=_review_place.find_next('small').next
 
         date=str(_date)
         date=datetime.datetime.strptime(date,'%d %B %Y')
@@ -337,9 +458,8 @@ class IMDBScraper(object):
                 num_dislikes = num_dislikes,
                 imdb_movie_id=self.imdb_movie_id,
                 imdb_reviewer_id=imdb_reviewer_id,
-                imdb_review_ranking=self.imdb_review_ranking_counter,
+                imdb_review_ranking=None,
                 imdb_review_url=imdb_review_url)
 
-        self.imdb_review_ranking_counter+=1
         return d
 
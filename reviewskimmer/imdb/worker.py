@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+""" Ingest movies from the rs_ingest_jobs queue. Any number
+    of these workers can run at once, on any number of hosts.
+
+    To queue up movies and then run a worker:
+
+        python -m reviewskimmer.imdb.worker --enqueue 1905041 1408101
+        python -m reviewskimmer.imdb.worker
+
+    The database is read from the RDS_HOSTNAME, RDS_PORT,
+    RDS_USERNAME, RDS_PASSWORD and RDS_DB_NAME environment variables.
+"""
+import os
+import sys
+import time
+import uuid
+import socket
+import argparse
+import traceback
+
+from . import scrape
+from reviewskimmer.database.dbconnect import LeaseLost
+
+
+def get_worker_name():
+    return '%s:%s' % (socket.gethostname(), os.getpid())
+
+
+def run_ingest_worker(connector, lease_seconds=3600, max_attempts=3,
+        wait=False, poll_interval=30, max_jobs=None, **kwargs):
+    """ Claim jobs from the queue and ingest them until there is
+        nothing left to do (or, when wait is True, wait poll_interval
+        seconds for more jobs). kwargs are passed into
+        reviewskimmer.imdb.scrape.scrape_movie.
+
+        Each job is leased for lease_seconds, which should be longer
+        than it takes to scrape the biggest movie. Each movie is
+        written (with force=True) in the same transaction that marks
+        its job done, which is rolled back if the lease was lost, so
+        only the worker holding the lease ever writes the movie.
+
+        Returns the number of movies ingested. """
+    kwargs.setdefault('stream',True)
+
+    worker_name=get_worker_name()
+    njobs=0
+
+    while max_jobs is None or njobs < max_jobs:
+        # each claim gets a unique owner so a worker never confuses
+        # its current lease with one it lost earlier
+        lease_owner='%s:%s' % (worker_name, uuid.uuid4().hex[:8])
+
+        imdb_movie_id=connector.claim_ingest_job(lease_owner,
+                lease_seconds=lease_seconds, max_attempts=max_attempts)
+
+        if imdb_movie_id is None:
+            if not wait: break
+            time.sleep(poll_interval)
+            continue
+
+        njobs+=1
+        print '%s: claimed movie %s' % (worker_name, imdb_movie_id),
+        try:
+            movie=scrape.scrape_movie(imdb_movie_id=imdb_movie_id, **kwargs)
+            nadded=connector.add_movie(movie, force=True, lease_owner=lease_owner)
+            print '%s (%s reviews) :)' % (movie['movie_name'], nadded)
+        except LeaseLost:
+            # another worker has the job now, so nothing was written
+            print '%s, but the lease expired :(' % movie['movie_name']
+        except:
+            print 'Error Reading Movie %s, moving on...' % imdb_movie_id
+            traceback.print_exc(sys.stdout)
+            connector.fail_ingest_job(imdb_movie_id, lease_owner,
+                    traceback.format_exc(), max_attempts=max_attempts)
+
+    return njobs
+
+
+def _connect():
+    import MySQLdb
+    from reviewskimmer.database.dbconnect import IMDBDatabaseConnector
+    db=MySQLdb.Connection(host=os.environ['RDS_HOSTNAME'],
+            user=os.environ['RDS_USERNAME'],
+            port=int(os.environ['RDS_PORT']),
+            passwd=os.environ['RDS_PASSWORD'],
+            db=os.environ['RDS_DB_NAME'])
+    return IMDBDatabaseConnector(db)
+
+
+if __name__ == '__main__':
+    parser=argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--create', action='store_true', help='Create the rs_ingest_jobs table.')
+    parser.add_argument('--enqueue', type=int, nargs='*', help='Movies to add to the queue.')
+    parser.add_argument('--status', action='store_true', help='Print the number of jobs of each status.')
+    parser.add_argument('--wait', action='store_true', help='Wait for more jobs when the queue is empty.')
+    parser.add_argument('--lease-seconds', type=int, default=3600)
+    parser.add_argument('--nworkers', type=int, default=1, help='Threads used to scrape each movie.')
+    args=parser.parse_args()
+
+    connector=_connect()
+
+    if args.create:
+        connector.create_ingest_jobs_table()
+    if args.enqueue:
+        connector.enqueue_ingest_jobs(args.enqueue)
+    if args.status:
+        print connector.get_ingest_job_counts()
+    if not (args.create or args.enqueue or args.status):
+        run_ingest_worker(connector, lease_seconds=args.lease_seconds,
+                wait=args.wait, nworkers=args.nworkers)
@@ -0,0 +1,172 @@
+""" The review page parsing from before pages were parsed with strainers
+    and lxml (copied unchanged from the original IMDBScraper, apart from
+    the surrounding class), so tests can check that the new parsing
+    scrapes exactly the same reviews as html.parser always did. """
+import re
+import datetime
+import traceback
+
+from bs4 import BeautifulSoup
+
+from reviewskimmer.utils.strings import clean_unicode
+
+
+def get_html_text(review_text):
+    """ This function takes in a (part of an)
+        HTML document, extracts the text out of it
+
+        The review has a bunch of text + html formatting.
+        Clean the review up by pulling out all the text,
+        adding missing periods, and 
+    """
+    text=review_text.findAll(text=True)
+
+    # remove garbage (new lines, etc ...) from beginning and end of text
+    text=[i.strip() for i in text if i.strip() != '']
+
+    # add in missing exclamations
+    text=[i if i[-1] in ['.','!','?'] else i+'.' for i in text]
+
+    # join all the text with spaces
+    text=' '.join(text)
+
+    # remove new lines
+    text=text.replace('\n', ' ')
+
+    # convert multiple spaces to single spaces
+    text=re.sub('\s+',' ',text)
+    return clean_unicode(text)
+
+
+
+class BaselineReviewParser(object):
+
+    def __init__(self, imdb_movie_id, debug=False):
+        self.imdb_movie_id=imdb_movie_id
+        self.debug=debug
+        self.imdb_review_ranking_counter=0
+
+    def get_reviews_from_page(self,imdb_review_url,html):
+
+        soup = BeautifulSoup(html, 'html.parser')
+
+        # find all reviews on the page
+        # The easiest way si to match on user avatars:
+        all_reviews_html = soup.findAll('img',**{'class':"avatar"})
+
+        all_reviews = []
+        for i in all_reviews_html:
+            try:
+                all_reviews.append(self.get_review_from_page(i,imdb_review_url))
+            except:
+                print 'Error Reading in review on page %s' % imdb_review_url
+                if self.debug: traceback.print_exc()
+        return all_reviews
+
+    def get_review_from_page(self,review_soup,imdb_review_url):
+        """ Pull out a single review form an IMDB
+            movie review page.
+
+            review is a soup object anchored on a reviewer's avatar.
+        """
+        # Most reviews begin with the text 
+        #   > "XXX out of XXX found the following review useful:"
+        # we have to back up to find it, but sometimes it doesn't exist
+        _quality_of_review = review_soup.previous.previous.previous.previous
+        m=re.match('(\d+) out of (\d+) people found the following review useful:', str(_quality_of_review))
+        if m is not None and len(m.groups())==2:
+            groups=m.groups()
+            num_likes = int(groups[0])
+            num_dislikes = int(groups[1])-int(groups[0])
+        else:
+            num_likes = num_dislikes = None
+
+        _title=review_soup.next.next.next
+        review_title=clean_unicode(_title)
+
+        # the next thing to look for is the review score.
+        # Note that this doesn't not always exist:
+        review_image = _title.next.next
+        if review_image.name == 'img':
+            _review_score=_title.next.next.attrs['alt']
+            review_score=_review_score.split('/')
+            assert review_score[0].isdigit() and review_score[1].isdigit()
+            review_score=[int(review_score[0]),int(review_score[1])]
+            assert review_score[0] in range(1,11)
+            assert review_score[1]==10
+            review_score=review_score[0]
+
+            _reviewer=_title.next.next.next.contents[3].next
+        else:
+            # No user review, jump to reviewer
+            review_score=None
+            _reviewer=_title.next.next.next.next.next.next
+
+        reviewer_url=_reviewer.previous['href']
+        m=re.match('/user/ur(\d+)/',reviewer_url)
+        groups=m.groups()
+        assert len(groups)==1
+        imdb_reviewer_id = int(groups[0])
+
+        if _reviewer == ' ':
+            # for some reason, I think some reviewers don't have
+            # a reviewer name. I found this problem here:
+            #   http://www.imdb.com/title/tt1408101/reviews?start=120
+            reviewer=None
+            _review_place=_reviewer.next.next
+        elif hasattr(_reviewer,'name') and _reviewer.name == 'br':
+            # this happens when there is no reviewer and no place!
+            # This happend at: http://www.imdb.com/title/tt1392170/reviews?start=1340
+            # If so, move the '_place' up the "<small>8 April 2012</small>"
+            # html so that it will get caught at the next condition
+            reviewer=None
+            _review_place=_reviewer.next.next 
+        else:
+            reviewer=clean_unicode(_reviewer)
+            _review_place=_reviewer.next.next.next
+
+        if hasattr(_review_place,'name') and _review_place.name == 'small':
+            # this happens when there is no place.
+            # If so, skip on to date
+            # For an example of this ...
+            review_place = None
+            _date = _review_place.next
+        else:
+            m = re.match('from (.+)', _review_place)
+            groups=m.groups()
+            assert len(groups)==1
+            review_place = groups[0]
+            review_place=review_place
+
+            _date=_review_place.next.contents[1].next
+
+        date=str(_date)
+        date=datetime.datetime.strptime(date,'%d %B %Y')
+
+
+        _review_text=_date.next.next.next.next
+        imdb_review_text=get_html_text(_review_text)
+        if imdb_review_text=='*** This review may contain spoilers ***.':
+            spoilers=True
+            _review_text=_review_text.next.next.next.next
+            imdb_review_text=get_html_text(_review_text)
+        else:
+            spoilers=False
+
+        d=dict(review_title=review_title,
+                date=date,
+                review_score=review_score,
+                reviewer=reviewer,
+                review_place=review_place,
+                imdb_review_text=imdb_review_text,
+                spoilers=spoilers,
+                num_likes = num_likes,
+                num_dislikes = num_dislikes,
+                imdb_movie_id=self.imdb_movie_id,
+                imdb_reviewer_id=imdb_reviewer_id,
+                imdb_review_ranking=self.imdb_review_ranking_counter,
+                imdb_review_url=imdb_review_url)
+
+        self.imdb_review_ranking_counter+=1
+        return d
+
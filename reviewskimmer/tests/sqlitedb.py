@@ -0,0 +1,179 @@
+""" An in-memory sqlite database which stands in for the MySQLdb
+    connection IMDBDatabaseConnector is given, so that its queries
+    (and the ALTERs of reviewskimmer.database.migrations) can be
+    tested without MySQL. """
+import re
+import math
+import sqlite3
+from datetime import datetime
+
+from reviewskimmer.database.dbconnect import IMDBDatabaseConnector
+
+
+def _translate(query):
+    """ Rewrite the bits of MySQL's dialect which the connector uses. """
+    query=re.sub(r'information_schema\.TABLES\s+WHERE TABLE_SCHEMA=DATABASE\(\) AND TABLE_NAME=%s',
+            "sqlite_master WHERE type='table' AND name=%s", query)
+    # MySQL's DATA_TYPE is the lower case type, without its length
+    query=re.sub(r'COLUMN_NAME, DATA_TYPE FROM information_schema\.COLUMNS\s+WHERE TABLE_SCHEMA=DATABASE\(\) AND TABLE_NAME=%s',
+            "name, lower(replace(rtrim(CASE WHEN instr(type,'(') THEN substr(type,1,instr(type,'(')-1) ELSE type END),"
+            "'MYSQL_','')) FROM pragma_table_info(%s)", query)
+    query=re.sub(r'information_schema\.COLUMNS\s+WHERE TABLE_SCHEMA=DATABASE\(\) AND TABLE_NAME=%s AND COLUMN_NAME=%s',
+            'pragma_table_info(%s) WHERE name=%s', query)
+    # MySQL's index names are per table, but sqlite's are per database
+    query=re.sub(r'information_schema\.STATISTICS\s+WHERE TABLE_SCHEMA=DATABASE\(\) AND TABLE_NAME=%s AND INDEX_NAME=%s',
+            "sqlite_master WHERE type='index' AND tbl_name=%s AND name=tbl_name||'__'||%s", query)
+    query=query.replace('%s','?')
+    query=query.replace('ON DUPLICATE KEY UPDATE','ON CONFLICT DO UPDATE SET')
+    query=re.sub(r'VALUES\((\w+)\)', r'excluded.\1', query)
+    query=query.replace('GREATEST(','MAX(')
+    query=query.replace('NOW()',"datetime('now','localtime')")
+    return query
+
+def _translate_update_join(query):
+    """ UPDATE t a JOIN ... ON ... SET ... WHERE ... is UPDATE ... FROM in sqlite. """
+    m=re.match(r'\s*UPDATE (\w+) (\w+)\s+JOIN (.*)\s+ON (.*?)\s+SET (.*?)\s+WHERE (.*)', query, re.S)
+    if m is None:
+        return query
+    table,alias,join,on,assignments,where=m.groups()
+    # sqlite doesn't qualify the columns being set
+    assignments=re.sub(r'\b%s\.(\w+)\s*=' % alias, r'\1=', assignments)
+    return 'UPDATE %s AS %s SET %s FROM %s WHERE (%s) AND (%s)' % (
+            table, alias, assignments, join, on, where)
+
+def _regexp(pattern, value):
+    if value is None:
+        return None
+    return re.search(pattern, str(value)) is not None
+
+def _mysql_double(value):
+    """ Convert a value to a DOUBLE the way MySQL's strict mode does
+        when altering a column, which fails for anything that isn't
+        a finite number. """
+    try:
+        number=float(value)
+    except ValueError:
+        number=None
+    if number is None or math.isinf(number) or math.isnan(number):
+        raise sqlite3.OperationalError('Incorrect DOUBLE value: %r' % value)
+    return number
+
+
+# MySQL drops the time from datetimes stored in DATE columns,
+# and MySQLdb reads DATETIME columns back as datetimes
+sqlite3.register_converter('MYSQL_DATE', lambda s: datetime.strptime(s[:10],'%Y-%m-%d').date())
+sqlite3.register_converter('MYSQL_DATETIME', lambda s: datetime.strptime(s[:19],'%Y-%m-%d %H:%M:%S'))
+
+
+class Cursor(object):
+    """ Translates the queries run through it into sqlite's dialect. """
+
+    def __init__(self, cursor):
+        self.cursor=cursor
+
+    def execute(self, query, args=None):
+        self.cursor.execute(_translate(query), args or ())
+        return self.cursor.rowcount
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def fetchmany(self, size):
+        return self.cursor.fetchmany(size)
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    def close(self):
+        self.cursor.close()
+
+
+class Connection(object):
+
+    def __init__(self):
+        self.db=sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_DECLTYPES)
+        self.db.text_factory=str
+        self.db.create_function('REGEXP', 2, _regexp)
+
+    def cursor(self):
+        return Cursor(self.db.cursor())
+
+    def query(self, query):
+        query=query.replace('ENGINE=InnoDB','')
+        query=re.sub(r'\b(DATE|DATETIME)\b', r'MYSQL_\1', query)
+
+        m=re.match(r'\s*ALTER TABLE (\w+)\s+(.*)', query, re.S)
+        if m is not None:
+            table=m.group(1)
+            # sqlite makes one change at a time
+            for change in re.split(r',(?![^(]*\))', m.group(2)):
+                self._alter(table, change.strip())
+            return
+
+        # sqlite can't create indexes inside of CREATE TABLE
+        indexes=re.findall(r',\s*INDEX\s*(\w*)\s*\(([^)]*)\)', query)
+        query=re.sub(r',\s*INDEX[^(]*\([^)]*\)', '', query)
+        self.db.execute(_translate_update_join(query))
+        if indexes:
+            table=re.search(r'CREATE TABLE (?:IF NOT EXISTS )?(\w+)', query).group(1)
+            for name,columns in indexes:
+                self._create_index(table, name, columns)
+
+    def _create_index(self, table, name, columns):
+        # MySQL names an index after its first column by default
+        name=name or columns.split(',')[0].strip()
+        self.db.execute('CREATE INDEX IF NOT EXISTS %s__%s ON %s (%s)' % (table, name, table, columns))
+
+    def _alter(self, table, change):
+        m=re.match(r'ADD INDEX (\w*)\s*\((.*)\)$', change, re.S)
+        if m is not None:
+            self._create_index(table, m.group(1), m.group(2))
+            return
+        m=re.match(r'MODIFY (\w+) (.*)$', change, re.S)
+        if m is not None:
+            self._modify(table, m.group(1), m.group(2))
+            return
+        self.db.execute('ALTER TABLE %s %s' % (table, change))
+
+    def _modify(self, table, column, definition):
+        """ sqlite can't change a column, so the table is copied
+            into a new one with the column changed. """
+        if definition == 'DOUBLE':
+            for value, in self.db.execute("""SELECT %s FROM %s
+                    WHERE %s IS NOT NULL""" % (column, table, column)):
+                _mysql_double(value)
+
+        create,=self.db.execute("""SELECT sql FROM sqlite_master
+            WHERE type='table' AND name=?""", (table,)).fetchone()
+        indexes=[sql for sql, in self.db.execute("""SELECT sql FROM sqlite_master
+            WHERE type='index' AND tbl_name=? AND sql IS NOT NULL""", (table,))]
+        create=re.sub(r'([(,]\s*%s)\s(?:[^,()]|\([^)]*\))*' % column, r'\1 %s' % definition, create, count=1)
+        create=re.sub(r'^CREATE TABLE (?:IF NOT EXISTS )?"?\w+"?', 'CREATE TABLE %s__new' % table, create)
+
+        self.db.execute(create)
+        self.db.execute("""INSERT INTO %s__new SELECT * FROM %s""" % (table, table))
+        self.db.execute("""DROP TABLE %s""" % table)
+        self.db.execute("""ALTER TABLE %s__new RENAME TO %s""" % (table, table))
+        for sql in indexes:
+            self.db.execute(sql)
+
+    def commit(self):
+        self.db.commit()
+
+    def rollback(self):
+        self.db.rollback()
+
+    def close(self):
+        self.db.close()
+
+
+class SqliteConnector(IMDBDatabaseConnector):
+    """ An IMDBDatabaseConnector on a new, empty database. """
+
+    def __init__(self, **kwargs):
+        super(SqliteConnector,self).__init__(Connection(), **kwargs)
+
+    def _get_streaming_cursor(self):
+        # sqlite's cursors already read rows as they are fetched
+        return self.db.cursor()
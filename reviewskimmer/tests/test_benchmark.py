@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from reviewskimmer.imdb import benchmark
+
+
+def _count_pages(session, npages):
+    return dict(npages=npages, nreviews=10*npages, elapsed=2.)
+
+def _fail(session):
+    raise ValueError('scraping failed')
+
+def _crash(session):
+    os._exit(3)
+
+
+class TestRunBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.fixtures=tempfile.mkdtemp()
+        benchmark.BENCHMARKS.update(count_pages=_count_pages, fail=_fail, crash=_crash)
+
+    def tearDown(self):
+        shutil.rmtree(self.fixtures)
+        for name in ['count_pages','fail','crash']:
+            del benchmark.BENCHMARKS[name]
+
+    def test_results(self):
+        results=benchmark.run_benchmark(self.fixtures, 'count_pages', 4)
+        self.assertEqual(results['pages_per_sec'], 2.)
+        self.assertEqual(results['reviews_per_sec'], 20.)
+        self.assertEqual(results['nmisses'], 0)
+
+    def test_error(self):
+        with self.assertRaises(Exception) as cm:
+            benchmark.run_benchmark(self.fixtures, 'fail')
+        self.assertIn('scraping failed', str(cm.exception))
+
+    def test_crash(self):
+        with self.assertRaises(Exception) as cm:
+            benchmark.run_benchmark(self.fixtures, 'crash')
+        self.assertIn('exited with code 3', str(cm.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from reviewskimmer.utils.cache import DiskCache, LRUCache
+
+
+class TestDiskCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory=tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_put_get(self):
+        cache=DiskCache(self.directory)
+        self.assertIsNone(cache.get('http://a'))
+        cache.put('http://a', 'body', etag='"v1"', last_modified='Fri, 24 May 2013 00:00:00 GMT')
+        entry=cache.get('http://a')
+        self.assertEqual(entry.body, 'body')
+        self.assertEqual(entry.etag, '"v1"')
+        self.assertEqual(entry.last_modified, 'Fri, 24 May 2013 00:00:00 GMT')
+        self.assertTrue(cache.is_fresh(entry))
+
+        # the cache persists between instances
+        self.assertEqual(DiskCache(self.directory).get('http://a').body, 'body')
+
+    def test_stale(self):
+        cache=DiskCache(self.directory, ttl=10)
+        cache.put('http://a', 'body')
+        entry=cache.get('http://a')
+        entry.stored-=11
+        self.assertFalse(cache.is_fresh(entry))
+        self.assertTrue(DiskCache(self.directory, ttl=None).is_fresh(entry))
+
+    def test_content_addressed(self):
+        cache=DiskCache(self.directory)
+        cache.put('http://a', 'same')
+        cache.put('http://b', 'same')
+        self.assertEqual(len(os.listdir(os.path.join(self.directory,'objects'))), 1)
+        self.assertEqual(cache.size(), 4)
+
+        cache.delete('http://a')
+        self.assertIsNone(cache.get('http://a'))
+        self.assertEqual(cache.get('http://b').body, 'same')
+
+    def test_evict_least_recently_used(self):
+        cache=DiskCache(self.directory, max_size=25)
+        cache.put('http://a', 'a'*10)
+        cache.put('http://b', 'b'*10)
+        # make a the most recently used
+        os.utime(cache._key_filename('http://b'), (time.time()-60,)*2)
+        cache.get('http://a')
+
+        cache.put('http://c', 'c'*10)
+        self.assertIsNone(cache.get('http://b'))
+        self.assertEqual(cache.get('http://a').body, 'a'*10)
+        self.assertEqual(cache.get('http://c').body, 'c'*10)
+        self.assertEqual(cache.size(), 20)
+        self.assertEqual(cache._size, 20)
+
+    def test_no_evict_under_max_size(self):
+        cache=DiskCache(self.directory, max_size=100)
+        calls=[]
+        cache.evict=lambda: calls.append(1)
+        for i in range(10):
+            cache.put('http://%d' % i, str(i)*5)
+        self.assertEqual(calls, [])
+        self.assertEqual(cache._size, 50)
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_get_put(self):
+        cache=LRUCache()
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('a', 1), 1)
+        cache.put('a', 2)
+        self.assertEqual(cache.get('a'), 2)
+        cache.put('a', 3)
+        self.assertEqual(cache.get('a'), 3)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get_stats(), dict(size=1, max_size=10000, hits=2, misses=2))
+
+    def test_evict_least_recently_used(self):
+        cache=LRUCache(max_size=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_ttl(self):
+        cache=LRUCache(ttl=60)
+        cache.put('a', 1)
+        now=time.time()
+        self.assertEqual(cache.get('a'), 1)
+        original_time=time.time
+        time.time=lambda: now+61
+        try:
+            self.assertIsNone(cache.get('a'))
+        finally:
+            time.time=original_time
+        self.assertEqual(len(cache), 0)
+
+    def test_invalidate(self):
+        cache=LRUCache()
+        for key in [('get_movie',1), ('get_movie',2), ('get_nreviews',1)]:
+            cache.put(key, key)
+        cache.invalidate(lambda key: key[1] == 1)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get(('get_movie',2)), ('get_movie',2))
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import unittest
+
+from pandas import DataFrame
+
+from reviewskimmer.database.caching import CachingConnector
+from reviewskimmer.utils.cache import LRUCache
+
+
+class FakeConnector(object):
+    """ Movies in a dict, counting the reads which reach it. """
+
+    def __init__(self):
+        self.movies={1:dict(movie_name='The Great Gatsby', nreviews=3),
+                2:dict(movie_name='Iron Man 3', nreviews=5)}
+        self.reads=[]
+
+    def get_movie(self, imdb_movie_id):
+        self.reads.append(('get_movie',imdb_movie_id))
+        return dict(self.movies[imdb_movie_id])
+
+    def get_movies(self, imdb_movie_ids):
+        self.reads.append(('get_movies',tuple(imdb_movie_ids)))
+        return dict((i,dict(self.movies[i])) for i in imdb_movie_ids)
+
+    def get_nreviews(self, imdb_movie_id):
+        self.reads.append(('get_nreviews',imdb_movie_id))
+        return self.movies[imdb_movie_id]['nreviews']
+
+    def get_newest_imdb_movie_id(self, movie_name):
+        self.reads.append(('get_newest_imdb_movie_id',movie_name))
+        return max(i for i,movie in self.movies.items() if movie['movie_name'] == movie_name)
+
+    def get_top_grossing(self):
+        self.reads.append(('get_top_grossing',))
+        return DataFrame(dict(rs_imdb_movie_id=[2,1], rs_ranking=[2,1]))
+
+    def add_movie(self, movie, force=False, lease_owner=None):
+        self.movies[movie['imdb_movie_id']]=dict(movie_name=movie['movie_name'], nreviews=len(movie['reviews']))
+        return len(movie['reviews'])
+
+    def del_movie(self, imdb_movie_id):
+        del self.movies[imdb_movie_id]
+
+
+class TestCachingConnector(unittest.TestCase):
+
+    def setUp(self):
+        self.fake=FakeConnector()
+        self.connector=CachingConnector(self.fake, LRUCache())
+
+    def test_cached(self):
+        self.assertEqual(self.connector.get_movie(1)['movie_name'], 'The Great Gatsby')
+        self.assertEqual(self.connector.get_movie(1)['movie_name'], 'The Great Gatsby')
+        self.assertEqual(self.connector.get_nreviews(1), 3)
+        self.assertEqual(self.connector.get_nreviews(imdb_movie_id=1), 3)
+        self.assertEqual(self.fake.reads, [('get_movie',1), ('get_nreviews',1)])
+
+    def test_get_many_shares_cache(self):
+        self.connector.get_movie(1)
+        movies=self.connector.get_movies([1,2])
+        self.assertEqual(sorted(movies.keys()), [1,2])
+        self.connector.get_movie(2)
+        self.assertEqual(self.fake.reads, [('get_movie',1), ('get_movies',(2,))])
+
+    def test_values_are_copied(self):
+        self.connector.get_movie(1)['movie_name']='Changed'
+        self.assertEqual(self.connector.get_movie(1)['movie_name'], 'The Great Gatsby')
+        self.connector.get_movies([1,2])[2]['movie_name']='Changed'
+        self.assertEqual(self.connector.get_movies([2])[2]['movie_name'], 'Iron Man 3')
+
+        top=self.connector.get_top_grossing()
+        top['rs_ranking']=0
+        self.assertEqual(self.connector.get_top_grossing()['rs_ranking'].tolist(), [2,1])
+        self.assertEqual(len(self.fake.reads), 3)
+
+    def test_add_movie_invalidates(self):
+        self.assertEqual(self.connector.get_nreviews(1), 3)
+        self.assertEqual(self.connector.get_nreviews(2), 5)
+        self.assertEqual(self.connector.get_newest_imdb_movie_id('The Great Gatsby'), 1)
+
+        self.connector.add_movie(dict(imdb_movie_id=1, movie_name='The Great Gatsby', reviews=[1,2,3,4]), force=True)
+        self.assertEqual(self.connector.get_nreviews(imdb_movie_id=1), 4)
+        self.connector.add_movie(dict(imdb_movie_id=3, movie_name='The Great Gatsby', reviews=[]))
+        self.assertEqual(self.connector.get_newest_imdb_movie_id('The Great Gatsby'), 3)
+
+        # other movies are still cached
+        self.assertEqual(self.connector.get_nreviews(2), 5)
+        self.assertEqual(self.fake.reads.count(('get_nreviews',2)), 1)
+
+    def test_invalidates_after_failed_write(self):
+        self.connector.get_movie(1)
+        self.assertRaises(KeyError, self.connector.del_movie, 3)
+        self.connector.del_movie(1)
+        self.assertRaises(KeyError, self.connector.get_movie, 1)
+        self.assertEqual(self.fake.reads, [('get_movie',1), ('get_movie',1)])
+
+    def test_lazy_connector(self):
+        connectors=[]
+        def connect():
+            connectors.append(self.fake)
+            return self.fake
+        cache=LRUCache()
+        CachingConnector(self.fake, cache).get_movie(1)
+
+        connector=CachingConnector(connect, cache)
+        self.assertEqual(connector.get_movie(1)['movie_name'], 'The Great Gatsby')
+        self.assertEqual(connectors, [])
+        connector.get_movie(2)
+        self.assertEqual(connectors, [self.fake])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import shutil
+import tempfile
+import threading
+import unittest
+import urlparse
+
+from reviewskimmer.imdb import charts
+from reviewskimmer.utils.cache import DiskCache
+from reviewskimmer.utils.web import HTTPResponse
+
+ROW="""<tr class="odd detailed">
+<td class="number">%(rank)d.</td>
+<td class="image"><a href="/title/tt%(id)07d/" title="%(name)s (%(year)d)"><img src="x.jpg" height="74" width="54" alt="%(name)s (%(year)d)" title="%(name)s (%(year)d)"></a></td>
+<td class="title"><a name="tt%(id)07d"></a>
+<span class="wlb_wrapper" data-tconst="tt%(id)07d"><a class="wlb_watchlist_lite" data-size="small"></a></span>
+<a href="/title/tt%(id)07d/">%(name)s</a>
+<span class="year_type">(%(year)d)</span><br>
+</td></tr>
+"""
+
+
+class BoxOfficeSession(object):
+    """ Search result pages of nmovies movies a year, 50 to a page.
+        The movie ranked rank in year has the id year*1000+rank. """
+
+    def __init__(self, nmovies=130):
+        self.nmovies=nmovies
+        self.urls=[]
+        self.lock=threading.Lock()
+
+    def get(self, url, headers=None, no_user_agent=False):
+        with self.lock:
+            self.urls.append(url)
+        query=urlparse.parse_qs(urlparse.urlsplit(url).query)
+        year=int(query['year'][0].split(',')[0])
+        start=int(query['start'][0])
+        rows=''.join(ROW % dict(rank=rank, id=year*1000+rank, name='Movie %d' % rank, year=year)
+                for rank in range(start,min(start+charts.NUM_MOVIES_PER_PAGE,self.nmovies+1)))
+        return HTTPResponse(url, 200, dict(), '<html><body><table>%s</table></body></html>' % rows)
+
+
+class TestTopBoxOffice(unittest.TestCase):
+
+    def setUp(self):
+        self.directory=tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_by_years(self):
+        session=BoxOfficeSession()
+        top=charts.get_top_box_office_by_years([2011,2012], 120, session=session)
+        self.assertEqual(top.keys(), [2011,2012])
+        for year in [2011,2012]:
+            self.assertEqual(top[year].items(),
+                    [(year*1000+rank,'Movie %d' % rank) for rank in range(1,121)])
+        self.assertEqual(len(session.urls), 6)
+
+    def test_concurrent_same_as_sequential(self):
+        years=[2009,2010,2011,2012]
+        sequential=charts.get_top_box_office_by_years(years, 120, session=BoxOfficeSession())
+        session=BoxOfficeSession()
+        concurrent=charts.get_top_box_office_by_years(years, 120, session=session, nworkers=4)
+        self.assertEqual(concurrent.keys(), years)
+        for year in years:
+            self.assertEqual(concurrent[year].items(), sequential[year].items())
+        self.assertEqual(len(session.urls), 12)
+
+        self.assertEqual(charts.get_top_grossing_dataframe(years, 120, session=BoxOfficeSession(), nworkers=4).values.tolist(),
+                charts.get_top_grossing_dataframe(years, 120, session=BoxOfficeSession()).values.tolist())
+
+    def test_cache(self):
+        cache=DiskCache(self.directory, ttl=60)
+        session=BoxOfficeSession()
+        top=charts.get_top_box_office_by_years([2011,2012], 100, session=session, cache=cache)
+        self.assertEqual(len(session.urls), 4)
+
+        # every page is cached
+        session=BoxOfficeSession()
+        cached=charts.get_top_box_office_by_years([2011,2012], 100, session=session, cache=cache, nworkers=2)
+        self.assertEqual(session.urls, [])
+        for year in [2011,2012]:
+            self.assertEqual(cached[year].items(), top[year].items())
+
+        # only the pages which aren't cached are read
+        charts.get_top_box_office_by_years([2011,2012,2013], 100, session=session, cache=cache)
+        self.assertEqual(len(session.urls), 2)
+        self.assertTrue(all('year=2013,2013' in url for url in session.urls))
+
+        # expired pages are read again
+        cache.ttl=0
+        session=BoxOfficeSession(nmovies=60)
+        expired=charts.get_top_box_office_by_years([2011], 100, session=session, cache=cache)
+        self.assertEqual(len(session.urls), 2)
+        self.assertEqual(len(expired[2011]), 60)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import shutil
+import tempfile
+import unittest
+from datetime import date
+from os.path import join
+
+import numpy as np
+from pandas import DataFrame
+
+from reviewskimmer.database.columnar import export_reviews, ColumnarReviews, NUMERIC_COLUMNS, TEXT_COLUMNS
+
+COLUMNS=[name for name,dtype,null in NUMERIC_COLUMNS]+TEXT_COLUMNS
+
+REVIEWS=[
+        (1, 11, 8, date(2013,5,10), 3, 1, 1, 'reviewer 11', 'Old sport.'),
+        (1, 12, None, date(2013,5,11), None, None, 2, None, u'Caf\xe9 society'),
+        (2, 13, 10, date(1999,12,31), 0, 0, 1, 'reviewer 13', ''),
+        (2, 14, 1, date(2014,1,1), 7, 2, None, u'r\xe9viewer 14', 'So bad.'),
+        (3, 15, 5, date(2013,6,1), 1, 1, 1, 'reviewer 15', 'Meh.'),
+        ]
+
+
+class FakeConnector(object):
+    """ Stream REVIEWS in chunks, like IMDBDatabaseConnector.iter_reviews. """
+
+    def __init__(self, reviews):
+        self.reviews=reviews
+
+    def iter_reviews(self, columns=None, chunksize=10000):
+        assert columns == COLUMNS
+        for start in range(0,len(self.reviews),chunksize):
+            yield DataFrame.from_records(self.reviews[start:start+chunksize], columns=COLUMNS)
+
+
+class TestColumnarReviews(unittest.TestCase):
+
+    def setUp(self):
+        self.dir=tempfile.mkdtemp()
+        self.directory=join(self.dir,'reviews')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def export(self, reviews, chunksize=2):
+        self.assertEqual(export_reviews(FakeConnector(reviews), self.directory, chunksize), len(reviews))
+        return ColumnarReviews(self.directory)
+
+    def test_numeric_columns(self):
+        reviews=self.export(REVIEWS)
+        self.assertEqual(len(reviews), 5)
+        self.assertEqual(reviews['rs_imdb_movie_id'].tolist(), [1,1,2,2,3])
+        self.assertEqual(reviews['rs_review_movie_score'].tolist(), [8,0,10,1,5])
+        self.assertEqual(reviews['rs_num_likes'].tolist(), [3,-1,0,7,1])
+        self.assertTrue(isinstance(reviews['rs_imdb_reviewer_id'], np.memmap))
+        self.assertEqual(reviews.get_dates().tolist(), [r[3] for r in REVIEWS])
+
+    def test_texts(self):
+        reviews=self.export(REVIEWS)
+        self.assertEqual(reviews.get_text('rs_review_text',0), 'Old sport.')
+        self.assertEqual(reviews.get_text('rs_review_text',1).decode('utf-8'), u'Caf\xe9 society')
+        self.assertEqual(reviews.get_text('rs_reviewer',1), '')
+        self.assertEqual(reviews.get_texts('rs_review_text',1,4),
+                [u'Caf\xe9 society'.encode('utf-8'), '', 'So bad.'])
+        self.assertEqual(reviews.get_texts('rs_review_text',2,2), [])
+
+    def test_iter_chunks(self):
+        reviews=self.export(REVIEWS)
+        chunks=list(reviews.iter_chunks(['rs_review_movie_score','rs_review_text','rs_imdb_review_ranking'], chunksize=2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2,2,1])
+        self.assertEqual(list(chunks[0].columns), ['rs_review_movie_score','rs_review_text','rs_imdb_review_ranking'])
+
+        # NULLs come back as NaN, but only in the chunks which have them
+        scores=chunks[0]['rs_review_movie_score'].tolist()
+        self.assertEqual(scores[0], 8)
+        self.assertTrue(np.isnan(scores[1]))
+        self.assertEqual(chunks[1]['rs_review_movie_score'].tolist(), [10,1])
+        self.assertEqual(chunks[0]['rs_imdb_review_ranking'].tolist(), [1,2])
+        self.assertTrue(np.isnan(chunks[1]['rs_imdb_review_ranking'].tolist()[1]))
+        self.assertEqual(chunks[2]['rs_review_text'].tolist(), ['Meh.'])
+
+        self.assertEqual(list(next(reviews.iter_chunks()).columns), reviews.columns)
+
+    def test_empty(self):
+        reviews=self.export([])
+        self.assertEqual(len(reviews), 0)
+        self.assertEqual(reviews['rs_imdb_movie_id'].tolist(), [])
+        self.assertEqual(list(reviews.iter_chunks()), [])
+
+    def test_export_replaces_directory(self):
+        self.export(REVIEWS)
+        reviews=self.export(REVIEWS[:1])
+        self.assertEqual(len(reviews), 1)
+        self.assertEqual(reviews.get_texts('rs_reviewer',0,1), ['reviewer 11'])
+
+
+if __name__ == '__main__':
+    unittest.main()
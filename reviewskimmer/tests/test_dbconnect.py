@@ -0,0 +1,259 @@
+import unittest
+from datetime import datetime, date, timedelta
+
+import pandas.io.sql as psql
+
+from reviewskimmer.database.dbconnect import IMDBDatabaseConnector, LeaseLost
+from reviewskimmer.tests.sqlitedb import SqliteConnector
+
+
+def make_review(imdb_movie_id, imdb_reviewer_id, score, day):
+    return dict(imdb_movie_id=imdb_movie_id, imdb_reviewer_id=imdb_reviewer_id,
+            reviewer='reviewer %s' % imdb_reviewer_id, review_score=score,
+            date=datetime(2013,5,day), num_likes=1, num_dislikes=2,
+            spoilers=False, imdb_review_ranking=imdb_reviewer_id,
+            review_place=None, imdb_review_url='http://imdb.test/reviews',
+            imdb_review_text='review %s' % imdb_reviewer_id, review_title='title')
+
+def make_movie(imdb_movie_id, reviews, name='The Great Gatsby'):
+    return dict(imdb_movie_id=imdb_movie_id, movie_name=name,
+            budget=105e6, gross=144e6, release_date=datetime(2013,5,10),
+            imdb_movie_url='http://imdb.test/title/tt%07d' % imdb_movie_id,
+            imdb_poster_url=None, imdb_poster_thumbnail_url=None,
+            imdb_description='A movie', nreviews=10, reviews=reviews)
+
+
+class TestAddMovie(unittest.TestCase):
+
+    def setUp(self):
+        self.connector=SqliteConnector(review_batch_size=2)
+        self.connector.create_schema()
+
+    def count(self, table, imdb_movie_id):
+        return self.connector.query_db("""
+            SELECT COUNT(*) FROM %s WHERE rs_imdb_movie_id=%%s""" % table,
+            (imdb_movie_id,))[0][0]
+
+    def test_add_movie(self):
+        reviews=[make_review(1,i,score,i) for i,score in enumerate([8,8,3,None,10],1)]
+        self.assertEqual(self.connector.add_movie(make_movie(1,iter(reviews))), 5)
+        self.assertTrue(self.connector.in_database(1))
+        self.assertEqual(self.count('rs_reviews',1), 5)
+
+        stats=self.connector.get_movie_stats(1)
+        self.assertEqual(stats['nreviews'], 5)
+        self.assertEqual(stats['score_histogram'][8], 2)
+        self.assertEqual(stats['score_histogram'][3], 1)
+        self.assertEqual(stats['score_histogram'][1], 0)
+        self.assertEqual(stats['latest_review_date'], date(2013,5,5))
+
+        self.assertRaises(Exception, self.connector.add_movie, make_movie(1,[]))
+
+    def test_append_reviews(self):
+        self.connector.add_movie(make_movie(1,[make_review(1,1,8,1)]))
+        reviews=[make_review(1,1,8,1), make_review(1,2,3,2), make_review(1,2,3,2)]
+        self.assertEqual(self.connector.append_reviews(1,reviews), 1)
+        self.assertEqual(self.connector.get_nreviews(1), 2)
+
+    def test_force_replaces_movie(self):
+        self.connector.add_movie(make_movie(1,[make_review(1,i,8,i) for i in range(1,4)]))
+        self.connector.add_movie(make_movie(1,[make_review(1,9,3,9)], name='Gatsby'), force=True)
+        self.assertEqual(self.connector.get_movie_names([1]), {1:'Gatsby'})
+        self.assertEqual(self.connector.get_nreviews(1), 1)
+        self.assertEqual(self.count('rs_reviews',1), 1)
+
+    def test_force_keeps_old_movie_on_error(self):
+        self.connector.add_movie(make_movie(1,[make_review(1,i,8,i) for i in range(1,4)]))
+        self.connector.add_movie(make_movie(2,[make_review(2,1,8,1)]))
+
+        def reviews():
+            for i in range(1,6):
+                yield make_review(1,i,3,i)
+            raise IOError('the scrape failed')
+
+        self.assertRaises(IOError, self.connector.add_movie,
+                make_movie(1,reviews(),name='Gatsby'), force=True)
+
+        self.assertEqual(self.connector.get_movie_names([1]), {1:'The Great Gatsby'})
+        self.assertEqual(self.count('rs_reviews',1), 3)
+        self.assertEqual(self.connector.get_movie_stats(1)['score_histogram'][8], 3)
+        self.assertEqual(self.connector.get_nreviews(2), 1)
+
+    def test_streamed_reviews_read_before_transaction(self):
+        events=[]
+        transaction=self.connector._transaction
+        def _transaction():
+            events.append('transaction')
+            return transaction()
+        self.connector._transaction=_transaction
+
+        def reviews():
+            for i in range(1,6):
+                events.append(i)
+                yield make_review(1,i,8,i)
+        self.assertEqual(self.connector.add_movie(make_movie(1,reviews())), 5)
+        self.assertEqual(events, [1,2,3,4,5,'transaction'])
+        self.assertEqual(self.count('rs_reviews',1), 5)
+
+        events[:]=[]
+        def new_reviews():
+            for i in range(4,8):
+                events.append(i)
+                yield make_review(1,i,8,i)
+        self.assertEqual(self.connector.append_reviews(1,new_reviews()), 2)
+        self.assertEqual(events, [4,5,6,7,'transaction'])
+
+    def test_del_movie(self):
+        self.connector.add_movie(make_movie(1,[make_review(1,1,8,1)]))
+        self.connector.add_movie(make_movie(2,[make_review(2,1,8,1)]))
+        self.connector.del_movie(1)
+        for table in ['rs_movies','rs_reviews','rs_movie_stats']:
+            self.assertEqual(self.count(table,1), 0)
+        self.assertTrue(self.connector.in_database(2))
+        self.assertRaises(Exception, self.connector.del_movie, 1)
+
+
+class TestIngestJobLease(unittest.TestCase):
+
+    def setUp(self):
+        self.connector=SqliteConnector()
+        self.connector.create_schema()
+        self.connector.create_ingest_jobs_table()
+        self.connector.add_movie(make_movie(1,[make_review(1,1,8,1)]))
+
+    def lease(self, lease_owner, seconds):
+        expires=datetime.now()+timedelta(seconds=seconds)
+        self.connector.modify_db("""
+            REPLACE INTO rs_ingest_jobs
+            (rs_imdb_movie_id, rs_status, rs_lease_owner, rs_lease_expires, rs_attempts, rs_updated)
+            VALUES (1,'leased',%s,%s,1,%s)""",
+            (lease_owner, self.connector.format_time(expires), self.connector.format_time(datetime.now())))
+
+    def get_status(self):
+        return self.connector.query_db("""
+            SELECT rs_status, rs_lease_owner FROM rs_ingest_jobs""")[0]
+
+    def test_add_movie_with_lease(self):
+        self.lease('worker-a', 60)
+        self.connector.add_movie(make_movie(1,[make_review(1,2,3,2)],name='Gatsby'),
+                force=True, lease_owner='worker-a')
+        self.assertEqual(self.connector.get_movie_names([1]), {1:'Gatsby'})
+        self.assertEqual(self.get_status()[0], 'done')
+
+    def assertNothingWritten(self, owner):
+        self.assertEqual(self.connector.get_movie_names([1]), {1:'The Great Gatsby'})
+        self.assertEqual(self.connector.get_nreviews(1), 1)
+        self.assertEqual(self.get_status(), ('leased',owner))
+
+    def test_expired_lease(self):
+        self.lease('worker-a', -1)
+        self.assertRaises(LeaseLost, self.connector.add_movie,
+                make_movie(1,[make_review(1,2,3,2)],name='Gatsby'),
+                force=True, lease_owner='worker-a')
+        self.assertNothingWritten('worker-a')
+        self.assertFalse(self.connector.complete_ingest_job(1,'worker-a'))
+
+    def test_lease_lost_while_scraping(self):
+        self.lease('worker-a', 60)
+        def reviews():
+            yield make_review(1,2,3,2)
+            self.lease('worker-a', -1)
+            yield make_review(1,3,3,3)
+        self.assertRaises(LeaseLost, self.connector.add_movie,
+                make_movie(1,reviews(),name='Gatsby'),
+                force=True, lease_owner='worker-a')
+        self.assertNothingWritten('worker-a')
+
+    def test_lease_lost_while_writing(self):
+        self.lease('worker-a', 60)
+        add_all_reviews=self.connector._add_all_reviews
+        def _add_all_reviews(imdb_movie_id, reviews, c):
+            # the lease expires while the reviews are inserted (this is
+            # rolled back with the rest, since it shares the connection)
+            c.execute("""
+                UPDATE rs_ingest_jobs SET rs_lease_expires=%s""",
+                (self.connector.format_time(datetime.now()-timedelta(seconds=1)),))
+            return add_all_reviews(imdb_movie_id, reviews, c)
+        self.connector._add_all_reviews=_add_all_reviews
+        self.assertRaises(LeaseLost, self.connector.add_movie,
+                make_movie(1,[make_review(1,2,3,2)],name='Gatsby'),
+                force=True, lease_owner='worker-a')
+        self.assertNothingWritten('worker-a')
+
+    def test_complete_ingest_job(self):
+        self.lease('worker-a', 60)
+        self.assertFalse(self.connector.complete_ingest_job(1,'worker-b'))
+        self.assertTrue(self.connector.complete_ingest_job(1,'worker-a'))
+        self.assertEqual(self.get_status()[0], 'done')
+
+
+class TestIterReviews(unittest.TestCase):
+
+    def setUp(self):
+        self.connector=SqliteConnector()
+        self.connector.create_schema()
+        self.connector.add_movie(make_movie(1,[make_review(1,i,8,i) for i in range(1,6)]))
+        self.connector.add_movie(make_movie(2,[make_review(2,i,3,i) for i in range(1,4)]))
+
+    def test_chunks(self):
+        chunks=list(self.connector.iter_reviews(chunksize=3))
+        self.assertEqual([len(chunk) for chunk in chunks], [3,3,2])
+        self.assertEqual(list(chunks[0].columns), IMDBDatabaseConnector.REVIEW_COLUMNS)
+        self.assertEqual(sorted((int(r['rs_imdb_movie_id']),int(r['rs_imdb_reviewer_id']))
+                for chunk in chunks for i,r in chunk.iterrows()),
+                [(1,i) for i in range(1,6)]+[(2,i) for i in range(1,4)])
+
+    def test_columns(self):
+        chunks=list(self.connector.iter_reviews(columns=['rs_review_movie_score','rs_imdb_movie_id']))
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(list(chunks[0].columns), ['rs_review_movie_score','rs_imdb_movie_id'])
+        self.assertEqual(sorted(chunks[0]['rs_review_movie_score'].tolist()), [3]*3+[8]*5)
+
+    def test_unknown_columns(self):
+        self.assertEqual(self.connector._get_review_columns_sql(None), '*')
+        self.assertEqual(self.connector._get_review_columns_sql(['rs_imdb_movie_id','rs_review_text']),
+                'rs_imdb_movie_id, rs_review_text')
+        for columns in [['rs_movie_name'], ['rs_imdb_movie_id','rs_review_text FROM rs_reviews; DROP TABLE rs_reviews; --']]:
+            self.assertRaises(Exception, self.connector._get_review_columns_sql, columns)
+            self.assertRaises(Exception, list, self.connector.iter_reviews(columns=columns))
+        self.assertEqual(self.connector.get_nreviews(1), 5)
+
+    def test_movie(self):
+        chunks=list(self.connector.iter_reviews(columns=['rs_imdb_movie_id','rs_imdb_reviewer_id'],
+            imdb_movie_id=2, chunksize=2))
+        self.assertEqual([chunk.values.tolist() for chunk in chunks], [[[2,1],[2,2]], [[2,3]]])
+        self.assertEqual(list(self.connector.iter_reviews(imdb_movie_id=3)), [])
+
+class TestBatchLookups(unittest.TestCase):
+
+    def setUp(self):
+        self.connector=SqliteConnector()
+        self.connector.create_schema()
+        self.connector.add_movie(make_movie(1,[make_review(1,1,8,1)]))
+        self.connector.add_movie(make_movie(2,[], name='Iron Man 3'))
+        self.connector.create_poster_derivatives_table()
+        self.connector.set_poster_derivatives(1, [
+            dict(size='small', format='jpeg', s3_key='a.jpg', width=100, height=150)])
+
+    def test_get_movie_names(self):
+        self.assertEqual(self.connector.get_movie_names([]), dict())
+        self.assertEqual(self.connector.get_movie_names([2,1]), {1:'The Great Gatsby', 2:'Iron Man 3'})
+        self.assertEqual(self.connector.get_movie_names([1,3,1]), {1:'The Great Gatsby'})
+
+    def test_get_poster_derivatives_for_movies(self):
+        self.assertEqual(self.connector.get_poster_derivatives_for_movies([]), dict())
+        derivatives=self.connector.get_poster_derivatives_for_movies([1,2,3,1])
+        self.assertEqual(derivatives, {1:{('small','jpeg'):'a.jpg'}, 2:dict(), 3:dict()})
+        for i in [1,2,3]:
+            self.assertEqual(derivatives[i], self.connector.get_poster_derivatives(i))
+
+    @unittest.skipIf(not hasattr(psql,'frame_query'), 'needs the pinned pandas')
+    def test_get_movies(self):
+        self.assertEqual(self.connector.get_movies([]), dict())
+        movies=self.connector.get_movies([2,3,1,2])
+        self.assertEqual(sorted(movies.keys()), [1,2])
+        for i in [1,2]:
+            self.assertEqual(movies[i].to_dict(), self.connector.get_movie(i).to_dict())
+
+if __name__ == '__main__':
+    unittest.main()
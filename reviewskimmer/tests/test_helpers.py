@@ -0,0 +1,104 @@
+import unittest
+
+from pandas import DataFrame
+import pandas.io.sql as psql
+
+from reviewskimmer.website import helpers
+from reviewskimmer.website.helpers import get_top_grossing_imdb_movie_ids
+from reviewskimmer.tests.sqlitedb import SqliteConnector
+from reviewskimmer.tests.test_dbconnect import make_movie
+from reviewskimmer.tests.test_poster import derivative
+
+
+class FakeConnector(object):
+
+    def get_top_grossing(self):
+        # the rows aren't in the order of their ranking
+        return DataFrame(dict(
+            rs_year=[2012]*5+[2011]*5,
+            rs_ranking=[3,1,5,2,4]*2,
+            rs_imdb_movie_id=[12003,12001,12005,12002,12004,11003,11001,11005,11002,11004]))
+
+
+class TestTopGrossing(unittest.TestCase):
+
+    @unittest.skipIf(not hasattr(DataFrame,'sort'), 'needs the pinned pandas')
+    def test_sorted_by_ranking(self):
+        movies=get_top_grossing_imdb_movie_ids(FakeConnector(), [2012,2011], 4)
+        self.assertEqual(movies.items(), [
+            (2012,[12001,12002,12003,12004]),
+            (2011,[11001,11002,11003,11004])])
+
+
+class ChartsConnector(SqliteConnector):
+    """ Movies 1-6, with 3, 1 and 5 in the top chart and 6, 2 and 3 in
+        the bottom one (so 3 is in both), counting the queries run. """
+
+    def __init__(self):
+        super(ChartsConnector,self).__init__()
+        self.nqueries=0
+        self.create_schema()
+        for i in range(1,7):
+            self.add_movie(make_movie(i, [], name='Movie #%d & more' % i))
+        self.create_poster_derivatives_table()
+        self.set_poster_derivatives(1, [derivative('small','jpeg','1s.jpg'), derivative('medium','jpeg','1m.jpg')])
+        self.set_poster_derivatives(6, [derivative('small','jpeg','6s.jpg'), derivative('small','webp','6s.webp')])
+        self.nqueries=0
+
+    def query_db(self, a, b=None):
+        self.nqueries+=1
+        return super(ChartsConnector,self).query_db(a, b)
+
+    def get_top_100_all_time(self):
+        return DataFrame(dict(rs_imdb_movie_id=[3,1,5]))
+
+    def get_bottom_100_all_time(self):
+        return DataFrame(dict(rs_imdb_movie_id=[6,2,3]))
+
+
+class TestPosterThumbnails(unittest.TestCase):
+
+    def setUp(self):
+        self.connector=ChartsConnector()
+
+    def get_thumbnail(self, imdb_movie_id, size='small'):
+        """ A movie's linked poster, from the movie's own name and posters. """
+        return '<a href="%s">%s</a>' % (helpers._get_search_url(self.connector.get_movie_names([imdb_movie_id])[imdb_movie_id]),
+            helpers.get_poster_html(imdb_movie_id, self.connector.get_poster_derivatives(imdb_movie_id), size))
+
+    def test_thumbnails(self):
+        thumbnails=helpers.get_poster_thumbnails([6,2,1], self.connector, size='small')
+        self.assertEqual(self.connector.nqueries, 2)
+        self.assertEqual(thumbnails, [self.get_thumbnail(i) for i in [6,2,1]])
+        self.assertTrue(thumbnails[0].startswith('<a href="/search.html?q=Movie%20%236%20%26%20more"><picture>'))
+        self.assertEqual(helpers.get_poster_thumbnail(1, self.connector, size='medium'), self.get_thumbnail(1, 'medium'))
+
+    def test_empty(self):
+        self.assertEqual(helpers.get_poster_thumbnails([], self.connector), [])
+        self.assertEqual(self.connector.nqueries, 0)
+
+    def test_missing(self):
+        self.assertRaises(Exception, helpers.get_poster_thumbnails, [1,7], self.connector)
+
+    def test_duplicates(self):
+        thumbnails=helpers.get_poster_thumbnails([1,2,1,1], self.connector)
+        self.assertEqual(thumbnails, [self.get_thumbnail(i, 'medium') for i in [1,2,1,1]])
+
+    def test_charts(self):
+        top,bottom=helpers.get_charts_thumbnails(self.connector)
+        self.assertEqual(self.connector.nqueries, 2)
+        self.assertEqual(top, [self.get_thumbnail(i) for i in [3,1,5]])
+        self.assertEqual(bottom, [self.get_thumbnail(i) for i in [6,2,3]])
+
+    @unittest.skipIf(not hasattr(psql,'frame_query'), 'needs the pinned pandas')
+    def test_charts_same_as_per_movie_lookups(self):
+        # how the charts page used to find each poster
+        def get_thumbnail(imdb_movie_id):
+            return '<a href="%s">%s</a>' % (helpers.get_search_url(imdb_movie_id, self.connector),
+                helpers.get_poster_html(imdb_movie_id, self.connector.get_poster_derivatives(imdb_movie_id), 'small'))
+        top,bottom=helpers.get_charts_thumbnails(self.connector)
+        self.assertEqual(top, [get_thumbnail(i) for i in [3,1,5]])
+        self.assertEqual(bottom, [get_thumbnail(i) for i in [6,2,3]])
+
+if __name__ == '__main__':
+    unittest.main()
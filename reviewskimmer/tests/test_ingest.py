@@ -0,0 +1,120 @@
+import datetime
+import unittest
+from os.path import join
+
+import pandas.io.sql as psql
+
+from reviewskimmer.utils.web import HTTPResponse
+from reviewskimmer.imdb.ingest import ingest_movies
+from reviewskimmer.tests.sqlitedb import SqliteConnector
+from reviewskimmer.tests.test_scrape import FIXTURES
+
+REVIEW="""<div>
+<a href="/user/ur%(reviewer_id)d/"><img class="avatar" src="http://i.media-imdb.com/images/SFe3b1.gif"></a>
+<h2>Review %(i)d</h2>
+<img width="102" height="12" src="http://i.media-imdb.com/images/showtimes/80.gif" alt="8/10"><br>
+<b>Author:</b>
+<a href="/user/ur%(reviewer_id)d/">reviewer %(i)d</a>
+<small>from London, England</small><br>
+<small>%(date)s</small>
+</div>
+<div></div><p>
+Review number %(i)d.
+</p>
+"""
+
+
+class GrowingIMDBSession(object):
+    """ A movie on IMDB with nreviews reviews (which can be changed),
+        ten to a review page, with new reviews added at the end. """
+
+    def __init__(self, nreviews):
+        self.nreviews=nreviews
+        self.urls=[]
+
+    @staticmethod
+    def get_date(i):
+        return datetime.datetime(2013,5,1)+datetime.timedelta(days=i)
+
+    def get_review_page(self, start):
+        reviews=''.join(REVIEW % dict(i=i, reviewer_id=1000+i, date=self.get_date(i).strftime('%d %B %Y'))
+                for i in range(start,min(start+10,self.nreviews)))
+        return '<html><body><div id="tn15content">%s</div></body></html>' % reviews
+
+    def get(self, url, headers=None, no_user_agent=False):
+        self.urls.append(url)
+        if '/reviews?start=' in url:
+            body=self.get_review_page(int(url.split('=')[1]))
+        else:
+            body=open(join(FIXTURES,'main.html')).read().replace('1,234 user','%d user' % self.nreviews)
+        return HTTPResponse(url, 200, dict(), body)
+
+
+class TestIncrementalIngest(unittest.TestCase):
+
+    def setUp(self):
+        self.connector=SqliteConnector()
+        self.connector.create_schema()
+        self.session=GrowingIMDBSession(15)
+        self.ingest(incremental=False)
+        self.assertEqual(self.connector.get_nreviews(1343092), 15)
+        self.session.urls=[]
+
+    def ingest(self, **kwargs):
+        ingest_movies([1343092], self.connector, base_url='http://imdb.test',
+                session=self.session, **kwargs)
+
+    def get_reviews(self):
+        return self.connector.query_db("""
+            SELECT rs_imdb_reviewer_id, rs_imdb_review_ranking FROM rs_reviews
+            WHERE rs_imdb_movie_id=1343092 ORDER BY rs_imdb_reviewer_id""")
+
+    def test_new_reviews(self):
+        self.session.nreviews=23
+        self.ingest(incremental=True)
+
+        # the main page is read to count the reviews, and again to scrape,
+        # and then only the review pages from the one holding review 15
+        self.assertEqual([url.split('/')[-1] for url in self.session.urls],
+                ['tt1343092', 'tt1343092', 'reviews?start=10', 'reviews?start=20'])
+
+        # reviews 10-14 were on the page read again, but aren't duplicated
+        self.assertEqual(self.get_reviews(), [(1000+i,i) for i in range(23)])
+        self.assertEqual(self.connector.get_nreviews(1343092), 23)
+        stats=self.connector.get_movie_stats(1343092)
+        self.assertEqual(stats['score_histogram'][8], 23)
+        self.assertEqual(stats['latest_review_date'], self.session.get_date(22).date())
+        self.assertEqual(self.connector.query_db("""
+            SELECT rs_nreviews_at_scrape FROM rs_movies""")[0][0], 23)
+
+    @unittest.skipIf(not hasattr(psql,'frame_query'), 'needs the pinned pandas')
+    def test_no_new_reviews(self):
+        self.ingest(incremental=True)
+        self.assertEqual([url.split('/')[-1] for url in self.session.urls], ['tt1343092'])
+        self.assertEqual(self.get_reviews(), [(1000+i,i) for i in range(15)])
+
+    def test_new_page(self):
+        # the new reviews start on a page of their own
+        self.session.nreviews=20
+        self.ingest(incremental=True)
+        self.session.nreviews=25
+        self.session.urls=[]
+        self.ingest(incremental=True)
+        self.assertEqual([url.split('/')[-1] for url in self.session.urls],
+                ['tt1343092', 'tt1343092', 'reviews?start=20'])
+        self.assertEqual(self.get_reviews(), [(1000+i,i) for i in range(25)])
+
+
+    @unittest.skipIf(not hasattr(psql,'frame_query'), 'needs the pinned pandas')
+    def test_refresh_budget(self):
+        self.session.nreviews=23
+        # the movie was just scraped, so it isn't checked
+        ingest_movies([1343092,1343093], self.connector, base_url='http://imdb.test',
+                session=self.session, incremental=True, refresh_budget=10)
+        self.assertEqual([url.split('/')[-1] for url in self.session.urls],
+                ['tt1343093', 'reviews?start=0', 'reviews?start=10', 'reviews?start=20'])
+        self.assertEqual(self.connector.get_nreviews(1343092), 15)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+import os
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from reviewskimmer.imdb.ingest import import_archive
+from reviewskimmer.utils.io import ArchiveWriter, iter_archive, iter_archive_movies, TruncatedMovie
+from reviewskimmer.tests.sqlitedb import SqliteConnector
+from reviewskimmer.tests.test_dbconnect import make_review, make_movie
+
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.dir=tempfile.mkdtemp()
+        self.filename=os.path.join(self.dir,'movies.jsonl.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_truncated(self, archive, movie, nreviews):
+        """ Tee a movie but only read nreviews of its reviews, like
+            an add_movie which failed part way through. """
+        reviews=archive.tee_movie(movie)['reviews']
+        for i in range(nreviews):
+            next(reviews)
+
+    def test_round_trip(self):
+        reviews=[make_review(1,i,8,i) for i in range(1,4)]
+        with ArchiveWriter(self.filename) as archive:
+            self.assertEqual(archive.write_movie(make_movie(1,iter(reviews))), 3)
+            self.assertEqual(archive.write_movie(make_movie(2,[])), 0)
+
+        self.assertEqual([r['type'] for r in iter_archive(self.filename)],
+                ['movie','review','review','review','end','movie','end'])
+
+        movies=iter_archive_movies(self.filename)
+        movie=next(movies)
+        self.assertEqual(movie['imdb_movie_id'], 1)
+        self.assertEqual(movie['release_date'], datetime(2013,5,10))
+        self.assertEqual(list(movie['reviews']), reviews)
+
+        movie=next(movies)
+        self.assertEqual(movie['imdb_movie_id'], 2)
+        self.assertEqual(list(movie['reviews']), [])
+        self.assertRaises(StopIteration, next, movies)
+
+    def test_unread_reviews_are_skipped(self):
+        with ArchiveWriter(self.filename) as archive:
+            archive.write_movie(make_movie(1,[make_review(1,i,8,i) for i in range(1,4)]))
+            archive.write_movie(make_movie(2,[make_review(2,1,8,1)]))
+        self.assertEqual([m['imdb_movie_id'] for m in iter_archive_movies(self.filename)], [1,2])
+
+    def test_truncated_movie(self):
+        with ArchiveWriter(self.filename) as archive:
+            self.write_truncated(archive, make_movie(1,[make_review(1,i,8,i) for i in range(1,4)]), 2)
+            archive.write_movie(make_movie(2,[make_review(2,1,8,1)]))
+            self.write_truncated(archive, make_movie(3,[make_review(3,1,8,1)]), 1)
+
+        movies=iter_archive_movies(self.filename)
+        movie=next(movies)
+        reviews=movie['reviews']
+        self.assertEqual(len([next(reviews), next(reviews)]), 2)
+        self.assertRaises(TruncatedMovie, next, reviews)
+
+        movie=next(movies)
+        self.assertEqual(movie['imdb_movie_id'], 2)
+        self.assertEqual(len(list(movie['reviews'])), 1)
+
+        movie=next(movies)
+        self.assertEqual(movie['imdb_movie_id'], 3)
+        self.assertRaises(TruncatedMovie, list, movie['reviews'])
+        self.assertRaises(StopIteration, next, movies)
+
+    def test_import_archive_skips_truncated_movies(self):
+        with ArchiveWriter(self.filename) as archive:
+            self.write_truncated(archive, make_movie(1,[make_review(1,i,8,i) for i in range(1,6)]), 3)
+            archive.write_movie(make_movie(2,[make_review(2,i,8,i) for i in range(1,4)]))
+
+        connector=SqliteConnector(review_batch_size=2)
+        connector.create_schema()
+        self.assertEqual(import_archive(self.filename, connector), 1)
+        self.assertFalse(connector.in_database(1))
+        self.assertEqual(connector.query_db("""
+            SELECT COUNT(*) FROM rs_reviews WHERE rs_imdb_movie_id=1""")[0][0], 0)
+        self.assertEqual(connector.get_nreviews(2), 3)
+
+
+    def crash(self, archive):
+        """ Stop writing like a killed process would: whatever was
+            compressed so far is on disk, but the gzip member isn't finished. """
+        archive.member.flush()
+        archive.file.close()
+
+    def get_movies(self):
+        """ The id and number of reviews (None when truncated) of each movie. """
+        movies=[]
+        for movie in iter_archive_movies(self.filename):
+            try:
+                movies.append((movie['imdb_movie_id'],len(list(movie['reviews']))))
+            except TruncatedMovie:
+                movies.append((movie['imdb_movie_id'],None))
+        return movies
+
+    def test_crash_mid_movie(self):
+        archive=ArchiveWriter(self.filename)
+        archive.write_movie(make_movie(1,[make_review(1,i,8,i) for i in range(1,4)]))
+        self.write_truncated(archive, make_movie(2,[make_review(2,i,8,i) for i in range(1,4)]), 2)
+        self.crash(archive)
+
+        self.assertEqual([r['type'] for r in iter_archive(self.filename)],
+                ['movie','review','review','review','end','movie','review','review'])
+        self.assertEqual(self.get_movies(), [(1,3),(2,None)])
+        connector=SqliteConnector()
+        connector.create_schema()
+        self.assertEqual(import_archive(self.filename, connector), 1)
+
+        # resuming drops the unfinished movie before writing it again
+        with ArchiveWriter(self.filename) as archive:
+            archive.write_movie(make_movie(2,[make_review(2,i,8,i) for i in range(1,4)]))
+            archive.write_movie(make_movie(3,[make_review(3,1,8,1)]))
+        self.assertEqual(self.get_movies(), [(1,3),(2,3),(3,1)])
+        self.assertEqual(import_archive(self.filename, connector), 2)
+        self.assertEqual(connector.get_nreviews(2), 3)
+
+    def test_crash_anywhere(self):
+        with ArchiveWriter(self.filename) as archive:
+            archive.write_movie(make_movie(1,[make_review(1,i,8,i) for i in range(1,4)]))
+        start=os.path.getsize(self.filename)
+        with ArchiveWriter(self.filename) as archive:
+            archive.write_movie(make_movie(2,[make_review(2,i,8,i) for i in range(1,4)]))
+        data=open(self.filename,'rb').read()
+
+        kept=0
+        for end in range(start,len(data)):
+            open(self.filename,'wb').write(data[:end])
+            self.assertEqual([r['imdb_movie_id'] for r in iter_archive(self.filename) if r['type'] == 'movie'][:1], [1])
+            with ArchiveWriter(self.filename) as archive:
+                archive.write_movie(make_movie(3,[make_review(3,1,8,1)]))
+            # movie 2 is kept only when just its gzip trailer was lost
+            movies=self.get_movies()
+            kept+=(movies == [(1,3),(2,3),(3,1)])
+            self.assertIn(movies, [[(1,3),(3,1)], [(1,3),(2,3),(3,1)]])
+        self.assertTrue(0 < kept <= 8)
+
+    def test_no_append_after_truncated_movies(self):
+        # an archive written as a single gzip member, which was cut short
+        f=gzip.open(self.filename,'wb')
+        for record in [dict(type='movie',imdb_movie_id=1), dict(type='end',nreviews=0),
+                dict(type='movie',imdb_movie_id=2)]:
+            f.write(json.dumps(record)+'\n')
+        f.flush()
+        data=open(self.filename,'rb').read()
+        f.close()
+        open(self.filename,'wb').write(data)
+
+        self.assertEqual(self.get_movies(), [(1,0),(2,None)])
+        self.assertRaises(IOError, ArchiveWriter, self.filename)
+        self.assertEqual(open(self.filename,'rb').read(), data)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+import sqlite3
+import unittest
+
+from reviewskimmer.database import migrations
+from reviewskimmer.database.migrations import migrate, stamp_schema_version, get_schema_version
+from reviewskimmer.tests.sqlitedb import SqliteConnector
+
+
+def create_baseline_schema(connector):
+    """ The schema (and data) of a database made before the migrations existed. """
+    connector.db.query("""
+        CREATE TABLE rs_movies (
+        rs_imdb_movie_id INT NOT NULL PRIMARY KEY,
+        rs_movie_name TEXT NOT NULL,
+        rs_budget TEXT,
+        rs_gross TEXT,
+        rs_imdb_movie_url TEXT NOT NULL,
+        rs_imdb_poster_url TEXT,
+        rs_imdb_poster_thumbnail_url TEXT,
+        rs_db_insert_time DATETIME NOT NULL,
+        rs_release_date DATE,
+        rs_imdb_description TEXT
+        );
+    """);
+    connector.db.query("""
+        CREATE TABLE rs_reviews (
+        rs_imdb_movie_id INT NOT NULL,
+        rs_imdb_reviewer_id INT NOT NULL,
+        rs_reviewer TEXT,
+        rs_review_movie_score INT,
+        rs_review_date DATE NOT NULL,
+        rs_num_likes INT,
+        rs_num_dislikes INT,
+        rs_review_spoilers BOOL NOT NULL,
+        rs_imdb_review_ranking INT,
+        rs_review_place TEXT,
+        rs_imdb_review_url TEXT NOT NULL,
+        rs_review_text TEXT
+        );
+    """)
+    connector.db.query("""
+        CREATE TABLE rs_quotes_cache (
+        rs_imdb_movie_id INT NOT NULL PRIMARY KEY,
+        rs_data LONGBLOB NOT NULL
+        );
+    """)
+    # as written by pandas' write_frame
+    connector.db.query("""
+        CREATE TABLE rs_most_informative_features (
+        rs_feature_name VARCHAR (63),
+        rs_informative_ranking BIGINT,
+        rs_classification VARCHAR (63),
+        rs_classification_bool TINYINT,
+        rs_odds_ratio VARCHAR (63)
+        );
+    """)
+
+    for imdb_movie_id,budget,gross in [(1,'1000000','2.5e6'), (2,'$5,000',None), (3,None,'N/A')]:
+        connector.modify_db("""
+            INSERT INTO rs_movies VALUES (%s,%s,%s,%s,%s,NULL,NULL,%s,%s,NULL)""",
+            (imdb_movie_id, 'movie %s' % imdb_movie_id, budget, gross,
+            'http://www.imdb.com/title/tt%07d/' % imdb_movie_id,
+            '2013-05-0%s 12:00:00' % imdb_movie_id, '2013-01-01'))
+    for imdb_movie_id,nreviews in [(1,3),(2,1)]:
+        for i in range(nreviews):
+            connector.modify_db("""
+                INSERT INTO rs_reviews VALUES (%s,%s,NULL,8,'2013-05-01',0,0,0,%s,NULL,'url','review')""",
+                (imdb_movie_id, i, i))
+    connector.modify_db("""INSERT INTO rs_quotes_cache VALUES (1,'pickled quotes')""")
+
+    # odds ratios were formatted with '%8.1f'
+    for i,odds_ratio in enumerate(['    12.5','INF','     inf','    -inf','     nan','Infinity','1e+01']):
+        connector.modify_db("""
+            INSERT INTO rs_most_informative_features VALUES (%s,%s,'pos',1,%s)""",
+            ('word%s' % i, i, odds_ratio))
+
+
+def dump(connector):
+    """ Every table's columns and rows. """
+    tables=[t for t, in connector.query_db("""
+        SELECT name FROM sqlite_master WHERE type='table' AND name!='rs_schema_version' ORDER BY name""")]
+    return dict((t,(get_columns(connector,t),
+        connector.query_db("""SELECT * FROM %s ORDER BY 1,2""" % t))) for t in tables)
+
+def get_columns(connector, table):
+    return [column for column, in connector.query_db("""SELECT name FROM pragma_table_info(%s)""", (table,))]
+
+
+class TestMigrations(unittest.TestCase):
+
+    def setUp(self):
+        self.connector=SqliteConnector()
+        create_baseline_schema(self.connector)
+
+    def test_unmigrated_odds_ratios_can_not_be_numbers(self):
+        self.assertRaises(sqlite3.OperationalError, self.connector.db.query, """
+            ALTER TABLE rs_most_informative_features MODIFY rs_odds_ratio DOUBLE""")
+
+    def test_migrate(self):
+        self.assertEqual(get_schema_version(self.connector), 0)
+        self.assertEqual(migrate(self.connector), range(1,10))
+        self.assertEqual(get_schema_version(self.connector), migrations.LATEST_VERSION)
+        c=self.connector
+
+        # the same tables, columns and indexes as a new database
+        new=SqliteConnector()
+        new.create_schema()
+        new.create_quotes_cache()
+        for table in ['rs_movies','rs_reviews','rs_movie_stats']:
+            self.assertEqual(get_columns(c,table), get_columns(new,table))
+        self.assertTrue(migrations._index_exists(c, 'rs_reviews', 'rs_imdb_movie_id'))
+        self.assertTrue(migrations._index_exists(c, 'rs_movies', 'rs_movie_name'))
+        self.assertFalse(migrations._index_exists(c, 'rs_movies', 'rs_imdb_movie_id'))
+
+        self.assertEqual(c.query_db("""
+            SELECT rs_imdb_movie_id, rs_budget, rs_gross, rs_nreviews_at_scrape FROM rs_movies ORDER BY 1"""),
+            [(1,1e6,2.5e6,3), (2,None,None,1), (3,None,None,None)])
+        self.assertEqual(c.query_db("""SELECT rs_last_scraped FROM rs_movies WHERE rs_imdb_movie_id=1""")[0][0],
+                c.query_db("""SELECT rs_db_insert_time FROM rs_movies WHERE rs_imdb_movie_id=1""")[0][0])
+        self.assertEqual(c.get_nreviews(1), 3)
+
+        # every odds ratio which isn't a finite number is NULL
+        self.assertEqual(c.query_db("""
+            SELECT rs_odds_ratio FROM rs_most_informative_features ORDER BY rs_informative_ranking"""),
+            [(12.5,), (None,), (None,), (None,), (None,), (None,), (10.,)])
+
+        self.assertEqual(c.query_db("""SELECT COUNT(*) FROM rs_quotes_cache""")[0][0], 0)
+        self.assertEqual(get_columns(c,'rs_quotes_cache'), get_columns(new,'rs_quotes_cache'))
+        self.assertIsNone(c.get_model_version())
+
+    def test_migrate_in_steps(self):
+        self.assertEqual(migrate(self.connector, target=4), [1,2,3,4])
+        self.assertEqual(get_schema_version(self.connector), 4)
+        self.assertEqual(migrate(self.connector), [5,6,7,8,9])
+
+    def test_migrate_again(self):
+        migrate(self.connector)
+        before=dump(self.connector)
+        self.assertEqual(migrate(self.connector), [])
+        stamp_schema_version(self.connector)
+        self.assertEqual(self.connector.query_db("""
+            SELECT rs_version FROM rs_schema_version ORDER BY 1"""), [(v,) for v in range(1,10)])
+
+        # each migration checks whether it is needed, so even
+        # running them again changes nothing
+        for version,description,migration in migrations.MIGRATIONS:
+            migration(self.connector)
+        self.assertEqual(dump(self.connector), before)
+
+    def test_new_database(self):
+        connector=SqliteConnector()
+        connector.create_schema()
+        self.assertEqual(get_schema_version(connector), migrations.LATEST_VERSION)
+        self.assertEqual(migrate(connector), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from reviewskimmer.imdb import scrape
+from reviewskimmer.imdb.pipeline import ingest_movies_pipelined, IngestCheckpoint, StageStats
+
+
+class FakeConnector(object):
+
+    def __init__(self, in_database=(), fail_writes=()):
+        self.movies=dict((i,None) for i in in_database)
+        self.fail_writes=set(fail_writes)
+        self.threads=set()
+
+    def in_database(self, imdb_movie_id):
+        return imdb_movie_id in self.movies
+
+    def add_movie(self, movie, force=False):
+        self.threads.add(threading.current_thread().name)
+        if movie['imdb_movie_id'] in self.fail_writes:
+            raise IOError('the write failed')
+        self.movies[movie['imdb_movie_id']]=movie
+        return len(movie['reviews'])
+
+
+class TestIngestMoviesPipelined(unittest.TestCase):
+
+    def setUp(self):
+        self.directory=tempfile.mkdtemp()
+        self.checkpoint=os.path.join(self.directory,'checkpoint.txt')
+
+        self.scraped=[]
+        self.fail_scrapes=set()
+        self.scrape_movie=scrape.scrape_movie
+        def scrape_movie(imdb_movie_id, stream):
+            self.scraped.append((imdb_movie_id,stream))
+            if imdb_movie_id in self.fail_scrapes:
+                raise IOError('the scrape failed')
+            # movie i has i reviews
+            return dict(imdb_movie_id=imdb_movie_id, movie_name='movie %s' % imdb_movie_id,
+                    reviews=[dict(review=j) for j in range(imdb_movie_id)])
+        scrape.scrape_movie=scrape_movie
+
+    def tearDown(self):
+        scrape.scrape_movie=self.scrape_movie
+        shutil.rmtree(self.directory)
+
+    def ingest(self, imdb_movie_ids, connector, **kwargs):
+        return ingest_movies_pipelined(imdb_movie_ids, connector, nworkers=3, queue_size=2,
+                checkpoint=self.checkpoint, **kwargs)
+
+    def test_ingest(self):
+        connector=FakeConnector()
+        stats=self.ingest(range(1,11), connector, stream=True)
+        self.assertEqual(sorted(connector.movies.keys()), range(1,11))
+        self.assertEqual(connector.threads, set([threading.current_thread().name]))
+        # the scraper threads read whole movies, even when asked to stream
+        self.assertEqual(set(stream for i,stream in self.scraped), set([False]))
+
+        for name in ['scrape','write']:
+            self.assertEqual(stats[name].nmovies, 10)
+            self.assertEqual(stats[name].nreviews, 55)
+            self.assertEqual(stats[name].nerrors, 0)
+        self.assertEqual(sorted(IngestCheckpoint(self.checkpoint).completed), range(1,11))
+
+    def test_failures_are_retried_on_resume(self):
+        self.fail_scrapes=set([2,5])
+        connector=FakeConnector(in_database=[1], fail_writes=[3])
+        stats=self.ingest(range(1,7), connector)
+
+        self.assertEqual(sorted(i for i,stream in self.scraped), [2,3,4,5,6])
+        self.assertEqual(sorted(connector.movies.keys()), [1,4,6])
+        self.assertEqual((stats['scrape'].nmovies, stats['scrape'].nerrors, stats['scrape'].nreviews), (3,2,13))
+        self.assertEqual((stats['write'].nmovies, stats['write'].nerrors, stats['write'].nreviews), (2,1,10))
+        # movies which were already in the database are checkpointed too
+        self.assertEqual(sorted(IngestCheckpoint(self.checkpoint).completed), [1,4,6])
+
+        # only the failed movies are scraped again
+        self.scraped=[]
+        self.fail_scrapes=set()
+        connector.fail_writes=set()
+        stats=self.ingest(range(1,7), connector)
+        self.assertEqual(sorted(i for i,stream in self.scraped), [2,3,5])
+        self.assertEqual(sorted(connector.movies.keys()), range(1,7))
+        self.assertEqual(stats['write'].nmovies, 3)
+        self.assertEqual(sorted(IngestCheckpoint(self.checkpoint).completed), range(1,7))
+
+        self.scraped=[]
+        stats=self.ingest(range(1,7), connector)
+        self.assertEqual(self.scraped, [])
+        self.assertEqual(stats['write'].nmovies, 0)
+
+    def test_force(self):
+        connector=FakeConnector(in_database=[1,2])
+        ingest_movies_pipelined([1,2], connector, force=True)
+        self.assertEqual(sorted(i for i,stream in self.scraped), [1,2])
+
+
+class TestIngestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.directory=tempfile.mkdtemp()
+        self.filename=os.path.join(self.directory,'checkpoint.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_resume(self):
+        checkpoint=IngestCheckpoint(self.filename)
+        self.assertFalse(checkpoint.is_done(1))
+        checkpoint.mark_done(1)
+        checkpoint.mark_done(3)
+        self.assertTrue(checkpoint.is_done(1))
+
+        checkpoint=IngestCheckpoint(self.filename)
+        self.assertTrue(checkpoint.is_done(1))
+        self.assertFalse(checkpoint.is_done(2))
+        self.assertTrue(checkpoint.is_done(3))
+
+
+class TestStageStats(unittest.TestCase):
+
+    def test_report(self):
+        stats=StageStats('write')
+        stats.add(1.5, 100)
+        stats.add(0.5, 20)
+        stats.add(1., error=True)
+        self.assertEqual((stats.nmovies, stats.nreviews, stats.nerrors, stats.busy), (2, 120, 1, 3.))
+        self.assertEqual(stats.report(4.),
+                'write: 2 movies (1 errors), 120 reviews, 0.50 movies/s, 30.0 reviews/s, 3.0s busy')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import threading
+import time
+import unittest
+
+from reviewskimmer.database import pool
+from reviewskimmer.database.pool import ConnectionPool, PoolTimeout
+
+
+class FakeConnection(object):
+
+    def __init__(self, number):
+        self.number=number
+        self.closed=False
+        self.npings=0
+        self.nrollbacks=0
+        self.ping_fails=False
+
+    def ping(self):
+        self.npings+=1
+        if self.ping_fails:
+            raise IOError('MySQL server has gone away')
+
+    def rollback(self):
+        self.nrollbacks+=1
+
+    def close(self):
+        self.closed=True
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now=1000.
+
+    def time(self):
+        return self.now
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.connections=[]
+
+    def connect(self):
+        conn=FakeConnection(len(self.connections))
+        self.connections.append(conn)
+        return conn
+
+    def use_clock(self):
+        """ Replace the pool's clock with one which only moves when told to. """
+        self.clock=FakeClock()
+        pool.time=self.clock
+        self.addCleanup(setattr, pool, 'time', time)
+
+    def test_reuse(self):
+        p=ConnectionPool(self.connect)
+        conn=p.get()
+        p.put(conn)
+        self.assertEqual(conn.nrollbacks, 1)
+        self.assertIs(p.get(), conn)
+        self.assertEqual(len(self.connections), 1)
+
+    def test_max_size(self):
+        p=ConnectionPool(self.connect, max_size=2, timeout=0.05)
+        a,b=p.get(),p.get()
+        self.assertRaises(PoolTimeout, p.get)
+        self.assertEqual(p.get_stats()['timeouts'], 1)
+        self.assertEqual(len(self.connections), 2)
+
+        # a connection given back by another thread is handed to the waiting one
+        p.timeout=5.
+        timer=threading.Timer(0.05, p.put, (a,))
+        timer.start()
+        self.assertIs(p.get(), a)
+        timer.join()
+        self.assertEqual(len(self.connections), 2)
+        self.assertGreater(p.get_stats()['max_wait'], 0.)
+
+    def test_failed_connect_frees_its_slot(self):
+        def connect():
+            raise IOError('Can not connect')
+        p=ConnectionPool(connect, max_size=1, timeout=0.05)
+        self.assertRaises(IOError, p.get)
+        self.assertEqual(p.size, 0)
+        p.connect=self.connect
+        self.assertIs(p.get(), self.connections[0])
+
+    def test_max_lifetime(self):
+        self.use_clock()
+        p=ConnectionPool(self.connect, max_lifetime=3600, ping_interval=10**6)
+        conn=p.get()
+        p.put(conn)
+        self.clock.now+=3000
+        self.assertIs(p.get(), conn)
+
+        # too old to go back into the pool
+        self.clock.now+=601
+        p.put(conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(p.size, 0)
+
+        # or to be handed out again
+        conn=p.get()
+        p.put(conn)
+        self.clock.now+=3601
+        self.assertIsNot(p.get(), conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(p.get_stats()['closed'], 2)
+        self.assertEqual(len(self.connections), 3)
+
+    def test_ping(self):
+        self.use_clock()
+        p=ConnectionPool(self.connect, ping_interval=30)
+        conn=p.get()
+        p.put(conn)
+
+        # recently used connections aren't pinged
+        self.clock.now+=20
+        self.assertIs(p.get(), conn)
+        self.assertEqual(conn.npings, 0)
+        p.put(conn)
+
+        self.clock.now+=31
+        self.assertIs(p.get(), conn)
+        self.assertEqual(conn.npings, 1)
+        p.put(conn)
+
+        # a connection the server dropped is replaced
+        self.clock.now+=31
+        conn.ping_fails=True
+        new=p.get()
+        self.assertIsNot(new, conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(p.get_stats()['ping_failures'], 1)
+
+    def test_discard(self):
+        p=ConnectionPool(self.connect)
+        try:
+            with p.connection() as conn:
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertTrue(conn.closed)
+        self.assertEqual(conn.nrollbacks, 0)
+        self.assertEqual(p.size, 0)
+
+        with p.connection() as conn:
+            pass
+        self.assertFalse(conn.closed)
+        self.assertEqual(p.size, 1)
+
+    def test_stats(self):
+        p=ConnectionPool(self.connect, max_size=3)
+        a,b=p.get(),p.get()
+        p.put(a)
+        stats=p.get_stats()
+        self.assertEqual((stats['size'],stats['in_use'],stats['idle'],stats['max_size']), (2,1,1,3))
+        self.assertEqual((stats['checkouts'],stats['created'],stats['closed'],stats['timeouts']), (2,2,0,0))
+        self.assertEqual(stats['mean_wait'], stats['total_wait']/2)
+
+        p.put(b, discard=True)
+        p.close()
+        stats=p.get_stats()
+        self.assertEqual((stats['size'],stats['in_use'],stats['idle'],stats['closed']), (0,0,0,2))
+        self.assertTrue(a.closed and b.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
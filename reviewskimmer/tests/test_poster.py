@@ -0,0 +1,217 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import pandas
+
+from reviewskimmer.database.dbconnect import IMDBDatabaseConnector
+from reviewskimmer.imdb.poster import S3_URL, list_bucket_keys, save_poster, sync_movie_posters
+from reviewskimmer.utils.web import HTTPResponse
+from reviewskimmer.website.helpers import get_poster_html
+from reviewskimmer.tests import sqlitedb
+
+
+def derivative(size, format, s3_key):
+    return dict(size=size, format=format, s3_key=s3_key, width=100, height=150)
+
+
+class TestPosterDerivatives(unittest.TestCase):
+
+    def setUp(self):
+        self.connector=IMDBDatabaseConnector(sqlitedb.Connection())
+        self.connector.create_poster_derivatives_table()
+
+    def test_set_poster_derivatives(self):
+        self.connector.set_poster_derivatives(1, [
+            derivative('small','jpeg','a.jpg'),
+            derivative('small','webp','a.webp'),
+            derivative('medium','jpeg','b.jpg')])
+        self.connector.set_poster_derivatives(2, [derivative('small','jpeg','c.jpg')])
+        self.assertEqual(self.connector.get_poster_derivatives(1), {
+            ('small','jpeg'):'a.jpg', ('small','webp'):'a.webp', ('medium','jpeg'):'b.jpg'})
+
+        # the new derivatives replace all the old ones
+        self.connector.set_poster_derivatives(1, [derivative('small','jpeg','d.jpg')])
+        self.assertEqual(self.connector.get_poster_derivatives(1), {('small','jpeg'):'d.jpg'})
+        self.assertEqual(self.connector.get_poster_derivatives(2), {('small','jpeg'):'c.jpg'})
+        self.assertEqual(self.connector.get_imdb_movie_ids_with_poster_derivatives(), set([1,2]))
+
+    def test_set_poster_derivatives_is_atomic(self):
+        self.connector.set_poster_derivatives(1, [derivative('small','jpeg','a.jpg')])
+        # the duplicate fails the insert after the old ones are deleted
+        self.assertRaises(Exception, self.connector.set_poster_derivatives, 1, [
+            derivative('small','jpeg','b.jpg'),
+            derivative('medium','jpeg','c.jpg'),
+            derivative('medium','jpeg','c.jpg')])
+        self.assertEqual(self.connector.get_poster_derivatives(1), {('small','jpeg'):'a.jpg'})
+
+
+class TestPosterHtml(unittest.TestCase):
+
+    def test_no_derivatives(self):
+        self.assertEqual(get_poster_html(12, dict()),
+                '<img class="img-polaroid" src="%s/poster_thumbnail_12.jpg">' % S3_URL)
+
+    def test_derivatives(self):
+        derivatives={('medium','jpeg'):'m.jpg', ('medium','webp'):'m.webp',
+                ('retina','jpeg'):'r.jpg', ('small','jpeg'):'s.jpg'}
+        self.assertEqual(get_poster_html(12, derivatives, 'medium'),
+                '<picture><source type="image/webp" srcset="%(s3)s/m.webp 1x, %(s3)s/m.webp 2x">'
+                '<img class="img-polaroid" src="%(s3)s/m.jpg" srcset="%(s3)s/m.jpg 1x, %(s3)s/r.jpg 2x"></picture>' % dict(s3=S3_URL))
+        # small has no webp, and uses medium on high density screens
+        self.assertEqual(get_poster_html(12, derivatives, 'small'),
+                '<picture><img class="img-polaroid" src="%(s3)s/s.jpg" srcset="%(s3)s/s.jpg 1x, %(s3)s/m.jpg 2x"></picture>' % dict(s3=S3_URL))
+        # without a jpeg of the size, the original thumbnail is used
+        self.assertEqual(get_poster_html(12, {('small','webp'):'s.webp'}, 'small'),
+                '<img class="img-polaroid" src="%s/poster_thumbnail_12.jpg">' % S3_URL)
+
+
+class FakeKey(object):
+
+    def __init__(self, bucket, name):
+        self.bucket=bucket
+        self.name=name
+
+    def set_contents_from_filename(self, filename, policy=None):
+        self.bucket.put(self.name, open(filename,'rb').read(), policy)
+
+    def set_contents_from_string(self, body, policy=None, headers=None):
+        self.bucket.put(self.name, body, policy)
+
+
+class FakeBucket(object):
+    """ The parts of a boto bucket the posters use, listing its
+        keys page_size at a time like S3 does. """
+
+    def __init__(self, page_size=1000):
+        self.page_size=page_size
+        self.objects=dict()
+        self.npages=0
+        self.lock=threading.Lock()
+
+    def put(self, name, body, policy):
+        with self.lock:
+            self.objects[name]=(body,policy)
+
+    def new_key(self, name):
+        return FakeKey(self, name)
+
+    def list(self):
+        names=sorted(self.objects.keys())
+        for start in range(0,len(names),self.page_size):
+            self.npages+=1
+            for name in names[start:start+self.page_size]:
+                yield FakeKey(self, name)
+
+
+class FakeS3(object):
+    """ A local stand-in for S3, which counts the connections made to it. """
+
+    def __init__(self, **buckets):
+        self.buckets=buckets
+        self.nconnections=0
+
+    def connect(self):
+        self.nconnections+=1
+        return self
+
+    def get_bucket(self, name):
+        return self.buckets[name]
+
+
+class PosterSession(object):
+
+    def __init__(self, fail=()):
+        self.fail=set(fail)
+        self.urls=[]
+
+    def get(self, url):
+        self.urls.append(url)
+        if url in self.fail:
+            return HTTPResponse(url, 200, dict(), '')
+        return HTTPResponse(url, 200, dict(), 'poster %s' % url)
+
+
+class FakeMovies(object):
+
+    def __init__(self, urls):
+        self.urls=urls
+
+    def get_all_movies(self):
+        return pandas.DataFrame([dict(rs_imdb_movie_id=i, rs_imdb_poster_thumbnail_url=url)
+                for i,url in sorted(self.urls.items())])
+
+
+class TestSyncMoviePosters(unittest.TestCase):
+
+    def setUp(self):
+        self.dir=tempfile.mkdtemp()
+        self.bucket=FakeBucket()
+        self.s3=FakeS3(reviewskimmer=self.bucket)
+        self.connector=FakeMovies({1:'http://imdb.test/1.jpg', 2:'http://imdb.test/2.jpg',
+            3:None, 4:'http://imdb.test/4.jpg'})
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def sync(self, session):
+        return sync_movie_posters(self.connector, self.dir, s3_connect=self.s3.connect,
+                nworkers=2, session=session)
+
+    def test_list_bucket_keys(self):
+        bucket=FakeBucket(page_size=3)
+        for i in range(10):
+            bucket.put('key%d' % i, 'body', None)
+        self.assertEqual(list_bucket_keys(bucket), set('key%d' % i for i in range(10)))
+        self.assertEqual(bucket.npages, 4)
+
+    def test_sync(self):
+        self.bucket.put('poster_thumbnail_2.jpg', 'poster', 'public-read')
+        session=PosterSession()
+        self.assertEqual(sorted(self.sync(session)), [1,4])
+        self.assertEqual(sorted(session.urls), ['http://imdb.test/1.jpg','http://imdb.test/4.jpg'])
+        self.assertEqual(self.bucket.objects['poster_thumbnail_1.jpg'],
+                ('poster http://imdb.test/1.jpg','public-read'))
+        self.assertEqual(sorted(os.listdir(self.dir)), ['poster_thumbnail_1.jpg','poster_thumbnail_4.jpg'])
+
+        # everything is in S3 now
+        session=PosterSession()
+        self.assertEqual(self.sync(session), [])
+        self.assertEqual(session.urls, [])
+
+    def test_downloaded_posters_are_not_downloaded_again(self):
+        save_poster(os.path.join(self.dir,'poster_thumbnail_1.jpg'), 'local poster')
+        session=PosterSession()
+        self.assertEqual(sorted(self.sync(session)), [1,2,4])
+        self.assertNotIn('http://imdb.test/1.jpg', session.urls)
+        self.assertEqual(self.bucket.objects['poster_thumbnail_1.jpg'][0], 'local poster')
+
+    def test_failed_download(self):
+        session=PosterSession(fail=['http://imdb.test/2.jpg'])
+        self.assertEqual(sorted(self.sync(session)), [1,4])
+        self.assertNotIn('poster_thumbnail_2.jpg', self.bucket.objects)
+        # the failed download leaves nothing behind to be uploaded later
+        self.assertEqual(sorted(os.listdir(self.dir)), ['poster_thumbnail_1.jpg','poster_thumbnail_4.jpg'])
+
+        session=PosterSession()
+        self.assertEqual(self.sync(session), [2])
+        self.assertEqual(session.urls, ['http://imdb.test/2.jpg'])
+        self.assertEqual(self.bucket.objects['poster_thumbnail_2.jpg'][0], 'poster http://imdb.test/2.jpg')
+
+    def test_interrupted_save(self):
+        write=os.write
+        def write_half(fd, data):
+            write(fd, data[:len(data)//2])
+            raise IOError('No space left on device')
+        os.write=write_half
+        try:
+            self.assertRaises(IOError, save_poster, os.path.join(self.dir,'poster_thumbnail_1.jpg'), 'poster')
+        finally:
+            os.write=write
+        self.assertEqual(os.listdir(self.dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from reviewskimmer.database.dbconnect import IMDBDatabaseConnector
+from reviewskimmer.database.snapshot import SnapshotConnector
+from reviewskimmer.tests.sqlitedb import SqliteConnector
+from reviewskimmer.tests.test_dbconnect import make_review, make_movie
+
+
+class TestEncodeQuotes(unittest.TestCase):
+
+    def test_round_trip(self):
+        quotes=dict(nreviews=3, words=[('gatsby',float('inf')), ('sport',-float('inf')), ('old',2.5)],
+                odds=dict(a=float('nan'), b=[1, None, 'text']))
+        decoded=IMDBDatabaseConnector.decode_quotes(IMDBDatabaseConnector.encode_quotes(quotes))
+        self.assertEqual(decoded, dict(nreviews=3, words=[['gatsby',None], ['sport',None], ['old',2.5]],
+                odds=dict(a=None, b=[1, None, 'text'])))
+
+
+def set_model_version(connector, version):
+    connector.modify_db("""
+        REPLACE INTO rs_model_version
+        VALUES (1,%s,%s)""", (version, '2013-05-24 00:00:00'))
+
+
+class TestCachedQuotes(unittest.TestCase):
+
+    def setUp(self):
+        self.connector=SqliteConnector()
+        self.connector.create_schema()
+        self.connector.add_movie(make_movie(1,[make_review(1,i,8,i) for i in range(1,4)]))
+        self.connector.create_quotes_cache()
+
+    def test_not_cached(self):
+        self.assertFalse(self.connector.are_quotes_cached(1))
+        self.assertIsNone(self.connector.get_cached_quotes(1))
+
+    def test_cached(self):
+        self.connector.set_cached_quotes(1, dict(nreviews=3))
+        self.assertTrue(self.connector.are_quotes_cached(1))
+        self.assertEqual(self.connector.get_cached_quotes(1), dict(nreviews=3))
+
+    def test_stale_after_new_reviews(self):
+        self.connector.set_cached_quotes(1, dict(nreviews=3))
+        self.connector.append_reviews(1, [make_review(1,4,3,4)])
+        self.assertFalse(self.connector.are_quotes_cached(1))
+        self.assertIsNone(self.connector.get_cached_quotes(1))
+
+        # quotes found before the review was added are still stale
+        self.connector.set_cached_quotes(1, dict(nreviews=3), nreviews=3)
+        self.assertIsNone(self.connector.get_cached_quotes(1))
+        self.connector.set_cached_quotes(1, dict(nreviews=4))
+        self.assertEqual(self.connector.get_cached_quotes(1), dict(nreviews=4))
+
+    def test_stale_after_new_model(self):
+        self.connector.set_cached_quotes(1, dict(version=None))
+        set_model_version(self.connector, 'v1')
+        self.assertIsNone(self.connector.get_cached_quotes(1))
+        self.connector.set_cached_quotes(1, dict(version='v1'))
+        self.assertEqual(self.connector.get_cached_quotes(1), dict(version='v1'))
+        set_model_version(self.connector, 'v2')
+        self.assertIsNone(self.connector.get_cached_quotes(1))
+
+
+class TestSnapshotQuotes(unittest.TestCase):
+
+    def setUp(self):
+        self.dir=tempfile.mkdtemp()
+        self.filename=os.path.join(self.dir,'snapshot.sqlite')
+
+        # the database has moved on since the snapshot: movie 1 has a
+        # fourth review, and new quotes for it
+        self.fallback=SqliteConnector()
+        self.fallback.create_schema()
+        self.fallback.add_movie(make_movie(1,[make_review(1,i,8,i) for i in range(1,5)]))
+        self.fallback.add_movie(make_movie(2,[make_review(2,i,8,i) for i in range(1,3)]))
+        self.fallback.create_quotes_cache()
+        set_model_version(self.fallback, 'v1')
+        self.fallback.set_cached_quotes(1, 'database quotes')
+        self.fallback.set_cached_quotes(2, 'database quotes')
+
+        snapshot=sqlite3.connect(self.filename)
+        snapshot.text_factory=str
+        snapshot.execute("""CREATE TABLE rs_movie_stats (rs_imdb_movie_id INTEGER PRIMARY KEY, rs_nreviews INTEGER)""")
+        snapshot.execute("""CREATE TABLE rs_quotes_cache (rs_imdb_movie_id INTEGER PRIMARY KEY,
+            rs_nreviews INTEGER, rs_model_version TEXT, rs_data BLOB)""")
+        snapshot.execute("""CREATE TABLE rs_model_version (rs_id INTEGER PRIMARY KEY, rs_version TEXT, rs_updated TEXT)""")
+        snapshot.executemany("""INSERT INTO rs_movie_stats VALUES (?,?)""", [(1,3), (2,2)])
+        snapshot.execute("""INSERT INTO rs_model_version VALUES (1,'v1','2013-05-24 00:00:00')""")
+        snapshot.executemany("""INSERT INTO rs_quotes_cache VALUES (?,?,?,?)""", [
+            (1, 3, 'v1', sqlite3.Binary(IMDBDatabaseConnector.encode_quotes('snapshot quotes'))),
+            # stamped with the database's count, which the snapshot doesn't have
+            (2, 4, 'v1', sqlite3.Binary(IMDBDatabaseConnector.encode_quotes('snapshot quotes'))),
+            ])
+        snapshot.commit()
+        snapshot.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_snapshot_quotes(self):
+        connector=SnapshotConnector(self.filename, get_fallback=lambda: self.fallback)
+        self.assertEqual(connector.get_cached_quotes(1), 'snapshot quotes')
+        self.assertTrue(connector.are_quotes_cached(1))
+
+    def test_stale_snapshot_quotes_fall_back(self):
+        connector=SnapshotConnector(self.filename, get_fallback=lambda: self.fallback)
+        self.assertEqual(connector.get_cached_quotes(2), 'database quotes')
+        self.assertIsNone(connector.get_cached_quotes(3))
+        self.assertFalse(connector.are_quotes_cached(3))
+
+    def test_no_fallback(self):
+        connector=SnapshotConnector(self.filename)
+        self.assertEqual(connector.get_cached_quotes(1), 'snapshot quotes')
+        self.assertIsNone(connector.get_cached_quotes(2))
+        self.assertFalse(connector.are_quotes_cached(2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import time
+import unittest
+
+from reviewskimmer.utils.ratelimit import TokenBucket, RateLimiter, get_default_rate_limiter
+from reviewskimmer.utils.web import HTTPSession
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_burst(self):
+        bucket=TokenBucket(rate=20, burst=3, min_rate=1, max_rate=20)
+        start=time.time()
+        for i in range(3):
+            bucket.acquire()
+        self.assertLess(time.time()-start, 0.04)
+
+        # the bucket is empty, so the next two wait 1/rate each
+        bucket.acquire()
+        bucket.acquire()
+        self.assertGreaterEqual(time.time()-start, 0.09)
+
+    def test_adapt(self):
+        bucket=TokenBucket(rate=4, burst=8, min_rate=1, max_rate=4, increase=0.5)
+        bucket.throttled(0)
+        self.assertEqual(bucket.rate, 2)
+        self.assertLessEqual(bucket.tokens, 0)
+        bucket.throttled(0)
+        bucket.throttled(0)
+        self.assertEqual(bucket.rate, 1)
+
+        bucket.succeeded()
+        self.assertEqual(bucket.rate, 1.5)
+        for i in range(10):
+            bucket.succeeded()
+        self.assertEqual(bucket.rate, 4)
+
+    def test_pause(self):
+        bucket=TokenBucket(rate=100, burst=10, min_rate=1, max_rate=100)
+        bucket.throttled(0.05)
+        start=time.time()
+        bucket.acquire()
+        self.assertGreaterEqual(time.time()-start, 0.04)
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_buckets_per_host(self):
+        limiter=RateLimiter(rate=4, burst=8)
+        self.assertIs(limiter.get_bucket('www.imdb.com'), limiter.get_bucket('www.imdb.com'))
+        self.assertIsNot(limiter.get_bucket('www.imdb.com'), limiter.get_bucket('ia.media-imdb.com'))
+
+        limiter.throttled('www.imdb.com', 0)
+        self.assertEqual(limiter.get_bucket('www.imdb.com').rate, 2)
+        self.assertEqual(limiter.get_bucket('ia.media-imdb.com').rate, 4)
+
+    def test_get_delay(self):
+        limiter=RateLimiter(backoff=1., max_backoff=10.)
+        for attempt,delay in [(0,1.),(1,2.),(2,4.),(5,10.)]:
+            d=limiter.get_delay(attempt)
+            self.assertTrue(0.5*delay <= d <= 1.5*delay)
+        self.assertEqual(limiter.get_delay(0, '3'), 3.)
+        self.assertEqual(limiter.get_delay(0, '120'), 10.)
+        d=limiter.get_delay(0, 'Fri, 24 May 2013 00:00:00 GMT')
+        self.assertTrue(0.5 <= d <= 1.5)
+
+    def test_sessions_share_the_default_limiter(self):
+        self.assertIs(HTTPSession().rate_limiter, get_default_rate_limiter())
+        self.assertIs(HTTPSession(cache=object()).rate_limiter, get_default_rate_limiter())
+        self.assertIsNone(HTTPSession(rate_limiter=False).rate_limiter)
+        limiter=RateLimiter()
+        self.assertIs(HTTPSession(rate_limiter=limiter).rate_limiter, limiter)
+
+
+if __name__ == '__main__':
+    unittest.main()
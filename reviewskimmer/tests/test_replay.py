@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import shutil
+import tempfile
+import unittest
+import urllib2
+
+from reviewskimmer.utils.web import HTTPResponse
+from reviewskimmer.utils.replay import PageRecorder, RecordingSession, ReplayServer
+
+PAGES={
+        'http://www.imdb.com/title/tt1343092':'<html><title>The Great Gatsby (2013) - IMDb</title></html>',
+        'http://www.imdb.com/title/tt1343092/reviews?start=0':'<html>reviews</html>',
+        }
+
+
+class TestPageRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.directory=tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save_load(self):
+        recorder=PageRecorder(self.directory)
+        url='http://www.imdb.com/title/tt1343092'
+        self.assertIsNone(recorder.load(url))
+        recorder.save(url, HTTPResponse(url, 200, {'content-type':'text/html; charset=utf-8'}, 'body'))
+
+        meta,body=PageRecorder(self.directory).load(url)
+        self.assertEqual(body, 'body')
+        self.assertEqual(meta, dict(url=url, status=200, content_type='text/html; charset=utf-8'))
+        self.assertEqual(recorder.urls(), [url])
+
+    def test_unicode_url(self):
+        recorder=PageRecorder(self.directory)
+        url=u'http://www.imdb.com/find?q=Am\xe9lie'
+        recorder.save(url, HTTPResponse(url, 200, dict(), 'body'))
+        self.assertEqual(recorder.load(url)[1], 'body')
+        self.assertEqual(recorder.load(url.encode('utf8'))[1], 'body')
+        self.assertEqual(recorder.urls(), [url])
+
+
+class TestRecordAndReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.site_directory=tempfile.mkdtemp()
+        self.directory=tempfile.mkdtemp()
+
+        # stands in for imdb.com while recording
+        recorder=PageRecorder(self.site_directory)
+        for url,body in PAGES.items():
+            recorder.save(url, HTTPResponse(url, 200, {'content-type':'text/html'}, body))
+        self.site=ReplayServer(self.site_directory)
+
+    def tearDown(self):
+        self.site.shutdown()
+        shutil.rmtree(self.site_directory)
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        session=RecordingSession(self.directory, proxy=self.site.address, rate_limiter=False)
+        for url,body in PAGES.items():
+            self.assertEqual(session.get(url).body, body)
+        session.close()
+        self.assertEqual(sorted(PageRecorder(self.directory).urls()), sorted(PAGES.keys()))
+
+        server=ReplayServer(self.directory)
+        try:
+            session=server.get_session()
+            self.assertIsNone(session.rate_limiter)
+            for url,body in PAGES.items():
+                response=session.get(url)
+                self.assertEqual(response.status, 200)
+                self.assertEqual(response.body, body)
+                self.assertEqual(response.headers['content-encoding'], 'gzip')
+
+            with self.assertRaises(urllib2.HTTPError) as cm:
+                session.get('http://www.imdb.com/title/tt0000001')
+            self.assertEqual(cm.exception.code, 404)
+            session.close()
+
+            self.assertEqual(server.nrequests, 3)
+            self.assertEqual(server.nmisses, 1)
+        finally:
+            server.shutdown()
+
+    def test_uncompressed(self):
+        session=self.site.get_session(compress=False)
+        url='http://www.imdb.com/title/tt1343092'
+        response=session.get(url)
+        self.assertEqual(response.body, PAGES[url])
+        self.assertNotIn('content-encoding', response.headers)
+        session.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
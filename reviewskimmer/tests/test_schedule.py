@@ -0,0 +1,72 @@
+import unittest
+from datetime import datetime, timedelta
+
+from pandas import DataFrame
+
+from reviewskimmer.imdb import schedule
+
+NOW=datetime(2013,6,1)
+
+
+class FakeConnector(object):
+    def __init__(self, movies):
+        self.movies=movies
+
+    def get_scrape_status(self):
+        return DataFrame(self.movies, columns=['rs_imdb_movie_id', 'rs_release_date',
+            'rs_last_scraped', 'rs_nreviews_at_scrape'])
+
+
+def movie(imdb_movie_id, days_since_release, days_since_scrape, nreviews):
+    return (imdb_movie_id, NOW-timedelta(days=days_since_release),
+            NOW-timedelta(days=days_since_scrape), nreviews)
+
+
+class TestSchedule(unittest.TestCase):
+
+    def test_priorities(self):
+        connector=FakeConnector([
+            movie(1, 1000, 10, 100),
+            movie(2, 100, 10, 1000),
+            movie(3, 1000, 0.5, 1000),
+            movie(4, 2000, 400, 10),
+            ])
+        priorities=schedule.get_refresh_priorities(connector, now=NOW)
+        # movie 3 was just scraped, and movie 4 is overdue
+        self.assertEqual([p['imdb_movie_id'] for p in priorities], [4, 2, 1])
+        self.assertTrue(priorities[0]['overdue'])
+        self.assertAlmostEqual(priorities[1]['expected_new_reviews'], 1000*10/130.)
+        self.assertEqual(priorities[1]['cost'], 1+8)
+
+    def test_budget(self):
+        connector=FakeConnector([
+            movie(1, 100, 10, 1000), # costs 9
+            movie(2, 100, 5, 1000),  # costs 5
+            movie(3, 100, 2, 1000),  # costs 3
+            ])
+        self.assertEqual(schedule.choose_movies_to_refresh(connector, 10, now=NOW), [1])
+        self.assertEqual(schedule.choose_movies_to_refresh(connector, 12, now=NOW), [1, 3])
+        self.assertEqual(schedule.choose_movies_to_refresh(connector, 100, now=NOW), [1, 2, 3])
+
+    def test_only_some_movies(self):
+        connector=FakeConnector([
+            movie(1, 100, 10, 1000), # costs 9
+            movie(2, 100, 5, 1000),  # costs 5
+            movie(3, 100, 2, 1000),  # costs 3
+            ])
+        self.assertEqual(schedule.choose_movies_to_refresh(connector, 100, now=NOW, imdb_movie_ids=[2,3,4]), [2, 3])
+        self.assertEqual(schedule.choose_movies_to_refresh(connector, 6, now=NOW, imdb_movie_ids=[2,3]), [2])
+
+    def test_over_budget_overdue(self):
+        connector=FakeConnector([
+            movie(1, 400, 400, 10000), # overdue, costs 932
+            movie(2, 400, 380, 10000), # overdue, costs 885
+            movie(3, 100, 10, 1000),   # costs 9
+            ])
+        # the most urgent overdue movie is refreshed even though it
+        # costs more than the budget, so it can't be skipped forever
+        self.assertEqual(schedule.choose_movies_to_refresh(connector, 20, now=NOW), [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
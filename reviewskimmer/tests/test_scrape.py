@@ -0,0 +1,231 @@
+import time
+import shutil
+import datetime
+import tempfile
+import threading
+import unittest
+from os.path import join, dirname
+
+try:
+    import lxml
+except ImportError:
+    lxml=None
+
+from reviewskimmer.utils import web
+from reviewskimmer.utils.web import HTTPResponse, HTTPSession
+from reviewskimmer.utils.replay import PageRecorder, ReplayServer
+from reviewskimmer.imdb.scrape import IMDBScraper
+from reviewskimmer.tests.baseline_scrape import BaselineReviewParser
+
+FIXTURES=join(dirname(__file__),'fixtures')
+
+
+class FixtureSession(object):
+    """ Serves the saved main page and review page for every url. """
+    def get(self, url, headers=None, no_user_agent=False):
+        name='reviews.html' if '/reviews' in url else 'main.html'
+        return HTTPResponse(url, 200, dict(), open(join(FIXTURES,name)).read())
+
+
+REVIEW_URL='http://imdb.test/title/tt1343092/reviews?start=0'
+
+EXPECTED_REVIEWS=[
+        dict(review_title='A glittering, hollow spectacle',
+            date=datetime.datetime(2013,5,10),
+            review_score=8,
+            reviewer='gatsby_fan',
+            review_place='New York, United States',
+            imdb_review_text="Luhrmann's film is loud and lavish. and the soundtrack is a. surprise.",
+            spoilers=False,
+            num_likes=142,
+            num_dislikes=59,
+            imdb_movie_id=1343092,
+            imdb_reviewer_id=1234567,
+            imdb_review_ranking=None,
+            imdb_review_url=REVIEW_URL),
+        dict(review_title='Style over substance',
+            date=datetime.datetime(2013,5,12),
+            review_score=None,
+            reviewer='daisy',
+            review_place=None,
+            imdb_review_text='The green light at the end of the dock is shown far too often!',
+            spoilers=True,
+            num_likes=12,
+            num_dislikes=18,
+            imdb_movie_id=1343092,
+            imdb_reviewer_id=7654321,
+            imdb_review_ranking=None,
+            imdb_review_url=REVIEW_URL),
+        dict(review_title='Faithful to the novel',
+            date=datetime.datetime(2013,5,15),
+            review_score=10,
+            reviewer='nick_carraway',
+            review_place='London, England',
+            imdb_review_text='Better than the 1974 version.',
+            spoilers=False,
+            num_likes=None,
+            num_dislikes=None,
+            imdb_movie_id=1343092,
+            imdb_reviewer_id=2222222,
+            imdb_review_ranking=None,
+            imdb_review_url=REVIEW_URL),
+        ]
+
+
+class TestParsing(unittest.TestCase):
+    """ Every parser, with and without fast_parsing,
+        must scrape the same fields from the saved pages. """
+
+    def setUp(self):
+        self.html_parser=web.HTML_PARSER
+
+    def tearDown(self):
+        web.HTML_PARSER=self.html_parser
+
+    def get_scraper(self, parser, fast_parsing):
+        web.HTML_PARSER=parser
+        return IMDBScraper(1343092, base_url='http://imdb.test',
+                session=FixtureSession(), fast_parsing=fast_parsing)
+
+    def get_reviews(self, parser, fast_parsing):
+        return self.get_scraper(parser, fast_parsing)._get_reviews_from_page(REVIEW_URL)
+
+    def get_main_page(self, parser, fast_parsing):
+        s=self.get_scraper(parser, fast_parsing)
+        s.scrape_main_page()
+        return s.get_results(reviews=[])
+
+    def get_baseline_reviews(self):
+        html=FixtureSession().get(REVIEW_URL).body
+        return BaselineReviewParser(1343092).get_reviews_from_page(REVIEW_URL, html)
+
+    def test_same_as_baseline(self):
+        baseline=self.get_baseline_reviews()
+        self.assertEqual(len(baseline), 3)
+        parsers=['html.parser'] if lxml is None else ['html.parser','lxml']
+        for parser in parsers:
+            for fast_parsing in [False, True]:
+                reviews=self.get_scraper(parser, fast_parsing).get_reviews_from_page(REVIEW_URL)
+                self.assertEqual(reviews, baseline, '%s fast_parsing=%s' % (parser, fast_parsing))
+
+    def test_reviews(self):
+        self.assertEqual(self.get_reviews('html.parser', False), EXPECTED_REVIEWS)
+        self.assertEqual(self.get_reviews('html.parser', True), EXPECTED_REVIEWS)
+
+    @unittest.skipIf(lxml is None, 'lxml is not installed')
+    def test_reviews_lxml(self):
+        self.assertEqual(self.get_reviews('lxml', False), EXPECTED_REVIEWS)
+        self.assertEqual(self.get_reviews('lxml', True), EXPECTED_REVIEWS)
+
+    def test_main_page(self):
+        results=self.get_main_page('html.parser', False)
+        self.assertEqual(results['movie_name'], 'The Great Gatsby')
+        self.assertEqual(results['nreviews'], 1234)
+        self.assertEqual(results['release_date'], datetime.datetime(2013,5,10))
+        self.assertEqual(results['budget'], 105000000.)
+        self.assertEqual(results['gross'], 144812796.)
+        self.assertEqual(results['imdb_description'],
+                'A writer and wall street trader, Nick, finds himself drawn to '
+                'the past and lifestyle of his millionaire neighbor, Jay Gatsby.')
+        self.assertEqual(results['imdb_poster_url'],
+                'http://ia.media-imdb.com/images/M/MV5BMTkxNTk1ODcxNl5BMl5BanBnXkFtZTcwMDI1OTMzOQ@@.jpg')
+
+        self.assertEqual(self.get_main_page('html.parser', True), results)
+        if lxml is not None:
+            self.assertEqual(self.get_main_page('lxml', False), results)
+            self.assertEqual(self.get_main_page('lxml', True), results)
+
+
+class TestReplayServer(unittest.TestCase):
+    """ Scrape recorded pages from a local server, through HTTPSession. """
+
+    def setUp(self):
+        self.directory=tempfile.mkdtemp()
+        recorder=PageRecorder(self.directory)
+        pages=[('http://www.imdb.com/title/tt1343092','main.html'),
+                ('http://www.imdb.com/title/tt1343092/reviews?start=0','reviews.html'),
+                ('http://www.imdb.com/title/tt1343092/reviews?start=10','reviews.html')]
+        for url,name in pages:
+            body=open(join(FIXTURES,name)).read()
+            recorder.save(url, HTTPResponse(url, 200, {'content-type':'text/html'}, body))
+        self.server=ReplayServer(self.directory)
+
+    def tearDown(self):
+        self.server.shutdown()
+        shutil.rmtree(self.directory)
+
+    def test_scrape_movie(self):
+        session=HTTPSession(rate_limiter=False)
+        s=IMDBScraper(1343092, base_url=self.server.url, session=session,
+                nreview_limit=20, nworkers=2)
+        s.scrape_movie()
+        results=s.get_results()
+
+        self.assertEqual(results['movie_name'], 'The Great Gatsby')
+        self.assertEqual(results['imdb_movie_url'], self.server.url+'/title/tt1343092')
+        self.assertEqual([r['imdb_review_ranking'] for r in results['reviews']], range(6))
+        for i,review in enumerate(results['reviews']):
+            expected=dict(EXPECTED_REVIEWS[i%3],
+                    imdb_review_url=self.server.url+'/title/tt1343092/reviews?start=%d' % (10*(i//3)),
+                    imdb_review_ranking=i)
+            self.assertEqual(review, expected)
+
+        self.assertEqual(self.server.nrequests, 3)
+        self.assertEqual(self.server.nmisses, 0)
+
+
+class SlowScraper(IMDBScraper):
+    """ Review pages hold one review each, and the first page
+        of every nworkers is slow to download. """
+
+    def __init__(self, nreviews, **kwargs):
+        super(SlowScraper,self).__init__(1343092, **kwargs)
+        self.main_page_url='http://imdb.test/title/tt1343092'
+        self.nreviews=nreviews
+        self.scraped=[]
+        self.lock=threading.Lock()
+
+    def _get_reviews_from_page(self, url):
+        start=int(url.split('=')[1])
+        if start % (10*self.nworkers) == 0:
+            time.sleep(0.05)
+        with self.lock:
+            self.scraped.append(start)
+        return [dict(start=start)]
+
+
+class TestIterReviews(unittest.TestCase):
+
+    def get_ranking(self, s):
+        return [(r['start'],r['imdb_review_ranking']) for r in s.iter_reviews()]
+
+    def test_order(self):
+        expected=[(20+10*i,20+i) for i in range(8)]
+        self.assertEqual(self.get_ranking(SlowScraper(100, start=20)), expected)
+        self.assertEqual(self.get_ranking(SlowScraper(100, start=20, nworkers=4)), expected)
+
+    def test_no_barrier(self):
+        # each slow page delays only its own reviews, not all the pages after it
+        s=SlowScraper(400, nworkers=4)
+        start=time.time()
+        self.assertEqual(len(list(s.iter_reviews())), 40)
+        self.assertLess(time.time()-start, 0.05*10*0.75)
+
+    def test_stop_early(self):
+        s=SlowScraper(1000, nworkers=2)
+        reviews=s.iter_reviews()
+        self.assertEqual(reviews.next()['start'], 0)
+        reviews.close()
+        # the pool reads at most 2*nworkers pages ahead
+        self.assertLessEqual(len(s.scraped), 5)
+
+    def test_error(self):
+        s=SlowScraper(100, nworkers=3)
+        def fail(url):
+            raise IOError(url)
+        s._get_reviews_from_page=fail
+        self.assertRaises(IOError, list, s.iter_reviews())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import date, datetime
+
+import pandas.io.sql as psql
+
+from reviewskimmer.database.snapshot import export_snapshot, SnapshotConnector
+from reviewskimmer.tests.sqlitedb import SqliteConnector
+from reviewskimmer.tests.test_dbconnect import make_review, make_movie
+from reviewskimmer.tests.test_poster import derivative
+
+
+class FakeFallback(object):
+
+    def __init__(self):
+        self.calls=[]
+
+    def get_reviews(self, imdb_movie_id, columns=None):
+        self.calls.append(('get_reviews',imdb_movie_id,columns))
+        return 'reviews'
+
+    def add_movie(self, movie, force=False):
+        self.calls.append(('add_movie',movie['imdb_movie_id']))
+        return 0
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.dir=tempfile.mkdtemp()
+        self.filename=os.path.join(self.dir,'snapshot.sqlite')
+
+        self.database=SqliteConnector()
+        self.database.create_schema()
+        self.database.add_movie(make_movie(1,[make_review(1,i,8,i) for i in range(1,4)]))
+        self.database.add_movie(make_movie(2,[make_review(2,1,3,1)], name='Iron Man 3'))
+        self.database.create_poster_derivatives_table()
+        self.database.set_poster_derivatives(1, [derivative('small','jpeg','a.jpg'), derivative('small','webp','a.webp')])
+        # as written by pandas' write_frame
+        self.database.db.query("""
+            CREATE TABLE rs_top_grossing (
+            rs_year BIGINT, rs_ranking BIGINT,
+            rs_imdb_movie_id BIGINT, rs_movie_name VARCHAR (63))
+        """)
+        self.database.modify_db("""INSERT INTO rs_top_grossing VALUES (2013,1,2,'Iron Man 3')""")
+        self.database.modify_db("""INSERT INTO rs_top_grossing VALUES (2013,2,1,'The Great Gatsby')""")
+
+        self.nrows=export_snapshot(self.database, self.filename)
+        self.fallback=FakeFallback()
+        self.connector=SnapshotConnector(self.filename, get_fallback=lambda: self.fallback)
+
+    def tearDown(self):
+        self.connector.close()
+        shutil.rmtree(self.dir)
+
+    def test_export(self):
+        self.assertEqual(self.nrows, dict(rs_movies=2, rs_movie_stats=2,
+            rs_poster_derivatives=2, rs_top_grossing=2))
+        self.assertFalse(os.path.exists(self.filename+'.tmp'))
+        # no reviews
+        self.assertFalse(self.connector.table_exists('rs_reviews'))
+
+        self.assertEqual(self.connector.get_movie_names([1,2,3]), {1:'The Great Gatsby', 2:'Iron Man 3'})
+        self.assertEqual(self.connector.get_nreviews(1), 3)
+        self.assertEqual(self.connector.get_poster_derivatives(1),
+                {('small','jpeg'):'a.jpg', ('small','webp'):'a.webp'})
+        self.assertEqual(self.connector.get_poster_derivatives_for_movies([1,2]),
+                {1:{('small','jpeg'):'a.jpg', ('small','webp'):'a.webp'}, 2:dict()})
+
+    def test_column_types(self):
+        # dates come back as dates, and numbers as numbers
+        release_date,insert_time,budget=self.connector.query_db("""
+            SELECT rs_release_date, rs_db_insert_time, rs_budget FROM rs_movies
+            WHERE rs_imdb_movie_id=1""")[0]
+        self.assertEqual(release_date, date(2013,5,10))
+        self.assertTrue(isinstance(insert_time, datetime))
+        self.assertEqual(budget, 105e6)
+        self.assertEqual(self.connector.query_db("""
+            SELECT rs_year, rs_ranking, rs_imdb_movie_id FROM rs_top_grossing ORDER BY rs_ranking"""),
+            [(2013,1,2), (2013,2,1)])
+
+    @unittest.skipIf(not hasattr(psql,'frame_query'), 'needs the pinned pandas')
+    def test_frames(self):
+        movie=self.connector.get_movie(1)
+        self.assertEqual(movie['rs_movie_name'], 'The Great Gatsby')
+        self.assertEqual(movie['rs_gross'], 144e6)
+        self.assertEqual(self.connector.get_top_grossing()['rs_imdb_movie_id'].tolist(), [2,1])
+
+    def test_fallback_methods(self):
+        self.assertEqual(self.connector.get_reviews(1, columns=['rs_review_text']), 'reviews')
+        self.connector.add_movie(make_movie(3,[]))
+        self.assertEqual(self.fallback.calls, [('get_reviews',1,['rs_review_text']), ('add_movie',3)])
+
+        connector=SnapshotConnector(self.filename)
+        self.assertRaises(Exception, connector.get_reviews, 1)
+        connector.close()
+
+    def test_read_only(self):
+        self.assertRaises(Exception, self.connector.modify_db, """DELETE FROM rs_movies""")
+        # even writes which don't go through modify_db are refused
+        self.assertRaises(sqlite3.OperationalError, self.connector.rebuild_movie_stats)
+        self.assertRaises(sqlite3.OperationalError, self.connector.db.execute, """DELETE FROM rs_movies""")
+        self.assertEqual(self.connector.get_movie_names([1,2]), {1:'The Great Gatsby', 2:'Iron Man 3'})
+        self.assertEqual(self.connector.get_nreviews(1), 3)
+        self.assertEqual(self.fallback.calls, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import zlib
+import gzip
+import threading
+import unittest
+import BaseHTTPServer
+import SocketServer
+from cStringIO import StringIO
+
+from reviewskimmer.utils.web import HTTPSession
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Keep-alive server which gzips its pages when asked to. /drop
+        closes the connection after answering, without saying so. """
+    protocol_version='HTTP/1.1'
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.connections.add(self.client_address)
+            self.server.encodings.append(self.headers.get('accept-encoding'))
+
+        body='page %s' % self.path
+        self.send_response(200)
+        self.send_header('Content-Type','text/html')
+        if 'gzip' in self.headers.get('accept-encoding',''):
+            buf=StringIO()
+            f=gzip.GzipFile(fileobj=buf, mode='wb')
+            f.write(body)
+            f.close()
+            body=buf.getvalue()
+            self.send_header('Content-Encoding','gzip')
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+        if self.path == '/drop':
+            self.close_connection=1
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads=True
+
+
+class TestHTTPSession(unittest.TestCase):
+
+    def setUp(self):
+        self.server=_Server(('127.0.0.1',0), _Handler)
+        self.server.lock=threading.Lock()
+        self.server.connections=set()
+        self.server.encodings=[]
+        self.thread=threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon=True
+        self.thread.start()
+        self.url='http://%s:%d' % self.server.server_address
+        self.session=HTTPSession(rate_limiter=False)
+
+    def tearDown(self):
+        self.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_keep_alive(self):
+        for i in range(3):
+            self.assertEqual(self.session.get(self.url+'/%d' % i).body, 'page /%d' % i)
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_gzip(self):
+        response=self.session.get(self.url+'/a')
+        self.assertEqual(response.body, 'page /a')
+        self.assertEqual(response.headers['content-encoding'], 'gzip')
+
+        session=HTTPSession(rate_limiter=False, compress=False)
+        response=session.get(self.url+'/a')
+        session.close()
+        self.assertEqual(response.body, 'page /a')
+        self.assertNotIn('content-encoding', response.headers)
+        self.assertEqual(self.server.encodings, ['gzip, deflate', 'identity'])
+
+    def test_dropped_connection(self):
+        self.assertEqual(self.session.get(self.url+'/drop').body, 'page /drop')
+        self.assertEqual(self.session.get(self.url+'/a').body, 'page /a')
+        self.assertEqual(self.session.get(self.url+'/b').body, 'page /b')
+        self.assertEqual(len(self.server.connections), 2)
+
+    def test_connection_per_thread(self):
+        self.session.get(self.url+'/a')
+        thread=threading.Thread(target=self.session.get, args=(self.url+'/b',))
+        thread.start()
+        thread.join()
+        self.session.get(self.url+'/c')
+        self.assertEqual(len(self.server.connections), 2)
+
+    def test_decompress(self):
+        body='page '*10
+        self.assertEqual(HTTPSession.decompress(zlib.compress(body), 'deflate'), body)
+        # raw deflate, without the zlib header
+        compressor=zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        raw=compressor.compress(body)+compressor.flush()
+        self.assertEqual(HTTPSession.decompress(raw, 'deflate'), body)
+        self.assertEqual(HTTPSession.decompress(body, ''), body)
+
+
+if __name__ == '__main__':
+    unittest.main()
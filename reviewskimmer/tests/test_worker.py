@@ -0,0 +1,53 @@
+import unittest
+
+from reviewskimmer.database.dbconnect import LeaseLost
+from reviewskimmer.imdb import scrape, worker
+
+
+class FakeQueueConnector(object):
+
+    def __init__(self, imdb_movie_ids, lose_lease=()):
+        self.pending=list(imdb_movie_ids)
+        self.lose_lease=set(lose_lease)
+        self.added=[]
+        self.failed=[]
+
+    def claim_ingest_job(self, lease_owner, lease_seconds, max_attempts):
+        if not self.pending:
+            return None
+        return self.pending.pop(0)
+
+    def add_movie(self, movie, force=False, lease_owner=None):
+        assert force and lease_owner is not None
+        if movie['imdb_movie_id'] in self.lose_lease:
+            raise LeaseLost()
+        self.added.append(movie['imdb_movie_id'])
+        return 0
+
+    def fail_ingest_job(self, imdb_movie_id, lease_owner, error, max_attempts):
+        self.failed.append(imdb_movie_id)
+
+
+class TestWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.scrape_movie=scrape.scrape_movie
+        def scrape_movie(imdb_movie_id, stream):
+            if imdb_movie_id == 3:
+                raise IOError('the scrape failed')
+            return dict(imdb_movie_id=imdb_movie_id, movie_name='movie %s' % imdb_movie_id, reviews=[])
+        scrape.scrape_movie=scrape_movie
+
+    def tearDown(self):
+        scrape.scrape_movie=self.scrape_movie
+
+    def test_run_ingest_worker(self):
+        connector=FakeQueueConnector([1,2,3,4], lose_lease=[2])
+        self.assertEqual(worker.run_ingest_worker(connector), 4)
+        self.assertEqual(connector.added, [1,4])
+        # a lost lease isn't a failure, since another worker has the job
+        self.assertEqual(connector.failed, [3])
+
+
+if __name__ == '__main__':
+    unittest.main()
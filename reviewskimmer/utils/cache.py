@@ -0,0 +1,255 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+try:
+    from collections import OrderedDict
+except:
+    from ordereddict import OrderedDict
+from os.path import expandvars, join, exists
+
+
+def _sha1(string):
+    if isinstance(string, unicode):
+        string=string.encode('utf8')
+    return hashlib.sha1(string).hexdigest()
+
+
+class CacheEntry(object):
+    """ A cached document and the metadata it was stored with. """
+    def __init__(self, key, body, stored, etag=None, last_modified=None):
+        self.key=key
+        self.body=body
+        self.stored=stored
+        self.etag=etag
+        self.last_modified=last_modified
+
+    def age(self):
+        return time.time()-self.stored
+
+
+class DiskCache(object):
+    """ A persistent, content-addressed cache of documents on disk.
+
+        Each document is stored once under the sha1 of its contents
+        (in the objects/ directory), and each key (typically a url)
+        is an index file in keys/ pointing to that object along with
+        the ETag/Last-Modified headers needed to revalidate it.
+
+        Entries older than ttl seconds are stale (ttl=None means entries
+        never go stale). When the total size of the stored documents grows
+        past max_size bytes, the least recently used keys are evicted.
+        The size is read from disk once and then counted as documents
+        are stored, so documents stored by other processes are only
+        counted the next time the cache is evicted.
+    """
+
+    def __init__(self, directory, ttl=24*60*60, max_size=1024**3):
+        self.directory=expandvars(directory)
+        self.ttl=ttl
+        self.max_size=max_size
+        self._size=None
+        self._lock=threading.Lock()
+
+        for subdir in ['keys','objects']:
+            path=join(self.directory,subdir)
+            if not exists(path):
+                try:
+                    os.makedirs(path)
+                except OSError:
+                    # another process created it first
+                    pass
+
+    def _key_filename(self, key):
+        return join(self.directory,'keys',_sha1(key)+'.json')
+
+    def _object_filename(self, digest):
+        return join(self.directory,'objects',digest)
+
+    def _write_atomic(self, filename, data):
+        """ Write through a temporary file so readers in other
+            threads/processes never see a partial file. """
+        fd,temp=tempfile.mkstemp(dir=os.path.dirname(filename))
+        try:
+            os.write(fd,data)
+        finally:
+            os.close(fd)
+        os.rename(temp,filename)
+
+    def get(self, key):
+        """ Return the CacheEntry for key, or None. Reading an
+            entry marks it as recently used. """
+        key_filename=self._key_filename(key)
+        try:
+            with open(key_filename) as f:
+                index=json.load(f)
+            with open(self._object_filename(index['digest']),'rb') as f:
+                body=f.read()
+            os.utime(key_filename,None)
+        except (IOError, OSError, ValueError):
+            return None
+        return CacheEntry(key, body, index['stored'],
+                etag=index.get('etag'), last_modified=index.get('last_modified'))
+
+    def is_fresh(self, entry):
+        return self.ttl is None or entry.age() < self.ttl
+
+    def put(self, key, body, etag=None, last_modified=None):
+        digest=_sha1(body)
+        object_filename=self._object_filename(digest)
+        added=0
+        if not exists(object_filename):
+            self._write_atomic(object_filename,body)
+            added=len(body)
+
+        index=dict(key=key, digest=digest, size=len(body), stored=time.time(),
+                etag=etag, last_modified=last_modified)
+        self._write_atomic(self._key_filename(key),json.dumps(index))
+
+        if self.max_size is not None:
+            with self._lock:
+                if self._size is None:
+                    self._size=self.size()
+                else:
+                    self._size+=added
+                over=self._size > self.max_size
+            if over:
+                self.evict()
+
+    def touch(self, key):
+        """ Mark an entry as freshly validated. """
+        entry=self.get(key)
+        if entry is not None:
+            self.put(key, entry.body, etag=entry.etag, last_modified=entry.last_modified)
+
+    def delete(self, key):
+        try:
+            os.remove(self._key_filename(key))
+        except OSError:
+            pass
+
+    def _read_index(self):
+        keys_dir=join(self.directory,'keys')
+        index=[]
+        for filename in os.listdir(keys_dir):
+            filename=join(keys_dir,filename)
+            try:
+                with open(filename) as f:
+                    i=json.load(f)
+                i['filename']=filename
+                i['used']=os.stat(filename).st_mtime
+            except (IOError, OSError, ValueError):
+                continue
+            index.append(i)
+        return index
+
+    def size(self):
+        """ Total bytes of the stored documents. """
+        objects_dir=join(self.directory,'objects')
+        return sum(os.stat(join(objects_dir,i)).st_size for i in os.listdir(objects_dir))
+
+    def evict(self):
+        """ Remove the least recently used keys (and any documents
+            no longer referenced) until the cache fits in max_size. """
+        objects_dir=join(self.directory,'objects')
+        object_sizes=dict()
+        for digest in os.listdir(objects_dir):
+            try:
+                object_sizes[digest]=os.stat(join(objects_dir,digest)).st_size
+            except OSError:
+                continue
+
+        total=sum(object_sizes.values())
+        if total <= self.max_size:
+            with self._lock:
+                self._size=total
+            return
+
+        index=sorted(self._read_index(), key=lambda x: x['used'])
+
+        references=dict()
+        for i in index:
+            references[i['digest']]=references.get(i['digest'],0)+1
+
+        # documents which no key points to
+        for digest in object_sizes.keys():
+            if digest not in references:
+                try:
+                    os.remove(self._object_filename(digest))
+                except OSError:
+                    pass
+                total-=object_sizes.pop(digest)
+
+        for i in index:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(i['filename'])
+            except OSError:
+                continue
+            references[i['digest']]-=1
+            if references[i['digest']] == 0 and i['digest'] in object_sizes:
+                try:
+                    os.remove(self._object_filename(i['digest']))
+                except OSError:
+                    pass
+                total-=object_sizes.pop(i['digest'])
+
+        with self._lock:
+            self._size=total
+
+
+class LRUCache(object):
+    """ A thread-safe, in-memory cache of at most max_size
+        values, evicting the least recently used. Values older
+        than ttl seconds are dropped (ttl=None means never). """
+
+    def __init__(self, max_size=10000, ttl=5*60):
+        self.max_size=max_size
+        self.ttl=ttl
+        self._data=OrderedDict()
+        self._lock=threading.Lock()
+        self.hits=0
+        self.misses=0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value,stored=self._data.pop(key)
+            except KeyError:
+                self.misses+=1
+                return default
+            if self.ttl is not None and time.time()-stored > self.ttl:
+                self.misses+=1
+                return default
+            # move to the most recently used end
+            self._data[key]=(value,stored)
+            self.hits+=1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data.pop(key,None)
+            self._data[key]=(value,time.time())
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, predicate):
+        """ Remove every key for which predicate(key) is True. """
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(size=len(self._data), max_size=self.max_size,
+                    hits=self.hits, misses=self.misses)
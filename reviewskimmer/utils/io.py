@@ -1,4 +1,9 @@
-from os.path import expandvars, splitext
+from os.path import expandvars, splitext, exists
+import gzip
+import zlib
+import json
+import datetime
+from cStringIO import StringIO
 import yaml
 
 def loaddict(filename):
@@ -23,3 +28,229 @@ def savedict(results, filename, yaml_kwargs=dict()):
     else:
         raise Exception("Unrecognized extension %s" % extension)
 
+
+def _encode_json(o):
+    if isinstance(o, datetime.datetime):
+        return {'$datetime':o.strftime('%Y-%m-%dT%H:%M:%S')}
+    if isinstance(o, datetime.date):
+        return {'$date':o.strftime('%Y-%m-%d')}
+    raise TypeError("%r is not JSON serializable" % o)
+
+def _decode_json(d):
+    if len(d) == 1:
+        if '$datetime' in d:
+            return datetime.datetime.strptime(d['$datetime'],'%Y-%m-%dT%H:%M:%S')
+        if '$date' in d:
+            return datetime.datetime.strptime(d['$date'],'%Y-%m-%d').date()
+    return d
+
+
+def _read_gzip_members(f, chunk_size=64*1024):
+    """ Decompress the concatenated gzip members in the file f,
+        yielding (data,end) where end is None until the last piece
+        of each member, which comes with the offset just past it.
+        Reading stops quietly at a truncated (or corrupt) member,
+        like the one left at the end of a file by a crash. """
+    offset=f.tell()
+    chunk=f.read(chunk_size)
+    while chunk:
+        d=zlib.decompressobj(16+zlib.MAX_WBITS)
+        while True:
+            try:
+                data=d.decompress(chunk)
+            except zlib.error:
+                return
+            if d.unused_data:
+                offset+=len(chunk)-len(d.unused_data)
+                yield data,offset
+                chunk=d.unused_data
+                break
+            offset+=len(chunk)
+            chunk=f.read(chunk_size)
+            if not chunk:
+                # a finished member leaves one more byte unused
+                try:
+                    d.decompress('\0')
+                except zlib.error:
+                    return
+                yield data,(offset if d.unused_data else None)
+                return
+            yield data,None
+
+
+class TruncatedMovie(Exception):
+    """ Raised when reading the reviews of an archived movie whose
+        reviews were not all written (for example, because the
+        database write it was teed from failed part way through). """
+    pass
+
+
+class ArchiveWriter(object):
+    """ Write movies scraped by reviewskimmer.imdb.scrape.scrape_movie
+        into a gzipped file of JSON records, one per line: first
+        a 'movie' record, followed by one 'review' record for each
+        of the movie's reviews and finally an 'end' record with
+        the number of reviews. Reviews are written as they are read,
+        so a streamed movie is never held in memory.
+
+        Each movie is a gzip member of its own, which is finished
+        once the movie is, so a crash only loses the movie being
+        written. When appending, that unfinished movie is cut off
+        the end of the file first.
+
+        For example:
+
+            with ArchiveWriter('movies.jsonl.gz') as archive:
+                archive.write_movie(scrape_movie(imdb_movie_id=1905041, stream=True))
+    """
+
+    def __init__(self, filename, mode='ab'):
+        self.filename=expandvars(filename)
+        self.member=None
+        if mode == 'ab' and exists(self.filename):
+            self.file=open(self.filename,'r+b')
+            self._truncate_unfinished()
+        else:
+            self.file=open(self.filename,'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _truncate_unfinished(self):
+        """ Cut off a truncated gzip member at the end of the file.
+            When the crash only lost the gzip trailer of a finished
+            movie, the movie is written again as a complete member.
+            A truncated member holding several finished movies (as an
+            archive written as a single member can) is left alone. """
+        complete,nends,is_end,partial=0,0,False,''
+        for data,end in _read_gzip_members(self.file):
+            lines=(partial+data).split('\n')
+            partial=lines.pop()
+            for line in lines:
+                # json escapes the quotes of strings, so only a record matches
+                is_end='"type": "end"' in line
+                nends+=is_end
+            if end is not None:
+                complete,nends,is_end,partial=end,0,False,''
+        if nends > 1 or (nends and not is_end):
+            raise IOError('%s ends with a truncated gzip member holding finished movies, not appending to it' % self.filename)
+
+        self.file.seek(complete)
+        tail=self.file.read() if nends else ''
+        self.file.seek(complete)
+        self.file.truncate()
+        if nends:
+            data=''.join(data for data,end in _read_gzip_members(StringIO(tail)))
+            self.member=gzip.GzipFile(fileobj=self.file, mode='wb')
+            self.member.write(data[:data.rindex('\n')+1])
+            self._end_member()
+
+    def _end_member(self):
+        if self.member is not None:
+            self.member.close()
+            self.member=None
+            self.file.flush()
+
+    def close(self):
+        self._end_member()
+        self.file.close()
+
+    def _write(self, record):
+        if self.member is None:
+            self.member=gzip.GzipFile(fileobj=self.file, mode='wb')
+        self.member.write(json.dumps(record, default=_encode_json))
+        self.member.write('\n')
+
+    def tee_movie(self, movie):
+        """ Write the movie record now, and return a copy of the movie
+            whose reviews get written to the archive as they are read
+            (for example, by IMDBDatabaseConnector.add_movie). """
+        # a movie whose reviews weren't all read is left without an end record
+        self._end_member()
+        record=dict((k,v) for k,v in movie.items() if k != 'reviews')
+        record['type']='movie'
+        self._write(record)
+
+        def reviews(reviews):
+            nreviews=0
+            for review in reviews:
+                r=dict(review)
+                r['type']='review'
+                self._write(r)
+                nreviews+=1
+                yield review
+            # only a movie whose reviews were all read gets an end record
+            self._write(dict(type='end',nreviews=nreviews))
+            self._end_member()
+
+        movie=dict(movie)
+        movie['reviews']=reviews(movie['reviews'])
+        return movie
+
+    def write_movie(self, movie):
+        """ Write a movie and its reviews. Returns the number of reviews. """
+        return sum(1 for review in self.tee_movie(movie)['reviews'])
+
+
+def iter_archive(filename):
+    """ Stream the records of an archive written by ArchiveWriter.
+        A movie cut short by a crash at the end of the archive is
+        read as far as it was written. """
+    with open(expandvars(filename),'rb') as f:
+        partial=''
+        for data,end in _read_gzip_members(f):
+            lines=(partial+data).split('\n')
+            partial=lines.pop()
+            for line in lines:
+                yield json.loads(line, object_hook=_decode_json)
+
+def iter_archive_movies(filename):
+    """ Stream the movies of an archive written by ArchiveWriter.
+        Each movie's 'reviews' is a generator which reads the reviews
+        from the file as it is consumed. It must be read (or
+        abandoned) before moving on to the next movie.
+
+        Since the reviews are streamed, a movie with missing reviews
+        can only be detected after they have been read: the generator
+        then raises TruncatedMovie. """
+    records=iter_archive(filename)
+    state=dict(next_movie=None)
+
+    def reviews(movie):
+        nreviews=0
+        for record in records:
+            kind=record.pop('type')
+            if kind == 'end':
+                if record['nreviews'] != nreviews:
+                    raise TruncatedMovie('Movie %s has %s reviews, expected %s' % (
+                        movie['imdb_movie_id'],nreviews,record['nreviews']))
+                return
+            if kind == 'movie':
+                state['next_movie']=record
+                break
+            nreviews+=1
+            yield record
+        raise TruncatedMovie('Movie %s has no end record after %s reviews' % (
+            movie['imdb_movie_id'],nreviews))
+
+    while True:
+        movie=state['next_movie']
+        state['next_movie']=None
+        if movie is None:
+            movie=next(records,None)
+            if movie is None:
+                return
+            assert movie.pop('type') == 'movie'
+
+        movie['reviews']=reviews(movie)
+        yield movie
+
+        # skip any reviews which weren't read
+        try:
+            for review in movie['reviews']:
+                pass
+        except TruncatedMovie:
+            pass
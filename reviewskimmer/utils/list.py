@@ -1,6 +1,43 @@
 import itertools
+import tempfile
+import cPickle
 def flatten_dict(d):
     """ Flatten a dictionary of lists into one lont list of items.
     """
     return list(itertools.chain(*zip(*d.items())[1]))
 
+
+def iter_batches(iterable, batch_size):
+    """ Split an iterable (for example, a generator) into
+        lists of at most batch_size items.
+    """
+    iterator=iter(iterable)
+    while True:
+        batch=list(itertools.islice(iterator,batch_size))
+        if len(batch)==0:
+            return
+        yield batch
+
+def spool(iterable):
+    """ Read all of an iterable (for example, reviews streamed from
+        the scraper) into a temporary file, and return a generator
+        which reads the items back. Only one item is ever in memory. """
+    f=tempfile.TemporaryFile()
+    try:
+        for item in iterable:
+            cPickle.dump(item, f, cPickle.HIGHEST_PROTOCOL)
+    except:
+        f.close()
+        raise
+    f.seek(0)
+
+    def read():
+        try:
+            while True:
+                try:
+                    yield cPickle.load(f)
+                except EOFError:
+                    return
+        finally:
+            f.close()
+    return read()
@@ -0,0 +1,115 @@
+import time
+import random
+import threading
+
+
+class TokenBucket(object):
+    """ Allow rate requests per second, with bursts of up to burst requests.
+
+        The rate adapts to the server: it is halved (down to min_rate)
+        whenever the server says it is overloaded, and creeps back up
+        (to max_rate) with every successful request.
+    """
+
+    def __init__(self, rate, burst, min_rate, max_rate, increase=0.05):
+        self.rate=float(rate)
+        self.burst=burst
+        self.min_rate=min_rate
+        self.max_rate=max_rate
+        self.increase=increase
+
+        self.tokens=float(burst)
+        self.last=time.time()
+        self.paused_until=0.
+        self._lock=threading.Lock()
+
+    def _refill(self, now):
+        self.tokens=min(self.burst, self.tokens+(now-self.last)*self.rate)
+        self.last=now
+
+    def acquire(self):
+        """ Block until a request may be sent. Tokens can go negative,
+            which reserves them for the waiting threads in order. """
+        with self._lock:
+            now=time.time()
+            self._refill(now)
+            self.tokens-=1
+            wait=max(self.paused_until-now, -self.tokens/self.rate, 0)
+        if wait > 0:
+            time.sleep(wait)
+
+    def succeeded(self):
+        with self._lock:
+            self.rate=min(self.max_rate, self.rate+self.increase)
+
+    def throttled(self, delay):
+        """ Slow down, and send nothing for delay seconds. """
+        with self._lock:
+            self.rate=max(self.min_rate, self.rate/2.)
+            self.paused_until=max(self.paused_until, time.time()+delay)
+            self.tokens=min(self.tokens, 0)
+
+
+class RateLimiter(object):
+    """ A token bucket per host, shared by every thread (and HTTPSession)
+        which uses this limiter.
+
+        backoff is the delay (in seconds) before the first retry of a
+        request which failed. It doubles with each retry (up to max_backoff),
+        unless the server says how long to wait with a Retry-After header.
+    """
+
+    def __init__(self, rate=4, burst=8, min_rate=0.25, backoff=1., max_backoff=60.):
+        self.rate=rate
+        self.burst=burst
+        self.min_rate=min_rate
+        self.backoff=backoff
+        self.max_backoff=max_backoff
+
+        self._buckets=dict()
+        self._lock=threading.Lock()
+
+    def get_bucket(self, host):
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host]=TokenBucket(self.rate, self.burst,
+                        min_rate=self.min_rate, max_rate=self.rate)
+            return self._buckets[host]
+
+    def wait(self, host):
+        self.get_bucket(host).acquire()
+
+    def succeeded(self, host):
+        self.get_bucket(host).succeeded()
+
+    def get_delay(self, attempt, retry_after=None):
+        """ How long to wait before retry number attempt (starting at 0). """
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                # an HTTP date, which isn't worth parsing
+                pass
+        delay=min(self.backoff*2**attempt, self.max_backoff)
+        # jitter so that threads don't all retry at once
+        return delay*random.uniform(0.5,1.5)
+
+    def throttled(self, host, attempt, retry_after=None):
+        """ Called when a request to host failed (for the attempt'th
+            time) because of the server. Returns how long to wait
+            before retrying. """
+        delay=self.get_delay(attempt, retry_after)
+        self.get_bucket(host).throttled(delay)
+        return delay
+
+
+_default_rate_limiter=None
+_default_rate_limiter_lock=threading.Lock()
+
+def get_default_rate_limiter():
+    """ The rate limiter shared by all the scraping code. """
+    global _default_rate_limiter
+    with _default_rate_limiter_lock:
+        if _default_rate_limiter is None:
+            _default_rate_limiter=RateLimiter()
+        return _default_rate_limiter
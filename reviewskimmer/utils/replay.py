@@ -0,0 +1,169 @@
+""" Record web pages downloaded while scraping, and
+    serve them back later from a local server.
+
+    For example, to record the pages of a movie:
+
+        session=RecordingSession('$REVIEWSKIMMER_FIXTURES_DIR')
+        scrape_movie(imdb_movie_id=1905041, session=session)
+
+    and then to scrape it again without going to imdb.com:
+
+        server=ReplayServer('$REVIEWSKIMMER_FIXTURES_DIR')
+        scrape_movie(imdb_movie_id=1905041, session=server.get_session())
+"""
+import os
+import json
+import gzip
+import hashlib
+import threading
+import BaseHTTPServer
+import SocketServer
+from cStringIO import StringIO
+from os.path import expandvars, join, exists
+
+from .web import HTTPSession
+
+
+def _fixture_name(url):
+    if isinstance(url, unicode):
+        url=url.encode('utf8')
+    return hashlib.sha1(url).hexdigest()
+
+
+class PageRecorder(object):
+    """ Save pages to a fixture directory. Each page is stored
+        as <sha1 of url>.html, along with a .json file holding
+        the url, status and content type. """
+
+    def __init__(self, directory):
+        self.directory=expandvars(directory)
+        if not exists(self.directory):
+            os.makedirs(self.directory)
+
+    def save(self, url, response):
+        name=_fixture_name(url)
+        open(join(self.directory,name+'.html'),'wb').write(response.body)
+        meta=dict(url=url, status=response.status,
+                content_type=response.headers.get('content-type','text/html'))
+        open(join(self.directory,name+'.json'),'w').write(json.dumps(meta))
+
+    def load(self, url):
+        """ Return the (meta, body) of a recorded page, or None. """
+        name=_fixture_name(url)
+        try:
+            meta=json.load(open(join(self.directory,name+'.json')))
+            body=open(join(self.directory,name+'.html'),'rb').read()
+        except IOError:
+            return None
+        return meta,body
+
+    def urls(self):
+        return [json.load(open(join(self.directory,i)))['url']
+                for i in os.listdir(self.directory) if i.endswith('.json')]
+
+
+class RecordingSession(HTTPSession):
+    """ An HTTPSession which saves every page it downloads. """
+
+    def __init__(self, directory, **kwargs):
+        super(RecordingSession,self).__init__(**kwargs)
+        self.recorder=PageRecorder(directory)
+
+    def get(self, url, headers=None, no_user_agent=False):
+        response=super(RecordingSession,self).get(url, headers=headers, no_user_agent=no_user_agent)
+        self.recorder.save(url, response)
+        return response
+
+
+class _ReplayHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version='HTTP/1.1'
+
+    def do_GET(self):
+        # Requests come in proxy form, with the full url as the path,
+        # or (from a scraper whose base_url is the server) as just the path
+        url=self.path
+        if url.startswith('/'):
+            url=self.server.site_url+url
+        found=self.server.recorder.load(url)
+        with self.server.lock:
+            self.server.nrequests+=1
+            if found is None: self.server.nmisses+=1
+
+        if found is None:
+            body='No recorded page for %s' % self.path
+            self.send_response(404)
+            self.send_header('Content-Type','text/plain')
+        else:
+            meta,body=found
+            self.send_response(meta['status'])
+            self.send_header('Content-Type',meta['content_type'])
+            if 'gzip' in self.headers.get('accept-encoding',''):
+                buf=StringIO()
+                f=gzip.GzipFile(fileobj=buf, mode='wb')
+                f.write(body)
+                f.close()
+                body=buf.getvalue()
+                self.send_header('Content-Encoding','gzip')
+
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class _ThreadedHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads=True
+
+
+class ReplayServer(object):
+    """ A local stand-in for imdb.com which serves recorded pages.
+
+        It runs in a background thread as an HTTP proxy, so
+        sessions from get_session() request the original urls
+        and get back the recorded pages (or a 404).
+
+        It can also be used as the base_url of an IMDBScraper. Those
+        requests are for paths on the server itself (see url), which
+        are served the pages recorded from site_url. """
+
+    def __init__(self, directory, port=0, verbose=False, site_url='http://www.imdb.com'):
+        self.server=_ThreadedHTTPServer(('127.0.0.1',port), _ReplayHandler)
+        self.server.recorder=PageRecorder(directory)
+        self.server.site_url=site_url
+        self.server.verbose=verbose
+        self.server.lock=threading.Lock()
+        self.server.nrequests=0
+        self.server.nmisses=0
+
+        self.thread=threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon=True
+        self.thread.start()
+
+    @property
+    def address(self):
+        return '%s:%d' % self.server.server_address
+
+    @property
+    def url(self):
+        return 'http://'+self.address
+
+    @property
+    def nrequests(self):
+        return self.server.nrequests
+
+    @property
+    def nmisses(self):
+        return self.server.nmisses
+
+    def get_session(self, **kwargs):
+        """ The recorded pages are served locally, so
+            the session isn't rate limited by default. """
+        kwargs.setdefault('rate_limiter', False)
+        return HTTPSession(proxy=self.address, **kwargs)
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -1,43 +1,285 @@
 import re
+import time
+import socket
+import threading
+import zlib
+import httplib
+from cStringIO import StringIO
 
 import urlparse
 from bs4 import BeautifulSoup
 import urllib2
 
 from . strings import clean_unicode
+from . ratelimit import get_default_rate_limiter
 
+try:
+    import lxml
+    HTML_PARSER='lxml'
+except ImportError:
+    HTML_PARSER='html.parser'
+
+# taken from http://www.whatsmyuseragent.com/
+USER_AGENT='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_8_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/27.0.1453.110 Safari/537.36'
 
 
 def url_join(path, *args):     
     return '/'.join([path.rstrip('/')] + list(args)) 
 
-def get_soup(url, no_user_agent=False):
-    """ Code inspired by:
-            http://www.markbartlett.org/web-engineering/web-engineering-1/page-scraping-with-urllib2-beautifulsoup
+
+class HTTPResponse(object):
+    """ The (decompressed) result of an HTTP request. """
+    def __init__(self, url, status, headers, body):
+        self.url=url
+        self.status=status
+        self.headers=headers
+        self.body=body
+
+
+class HTTPSession(object):
+    """ Download web pages over persistent connections.
+
+        One keep-alive connection is kept open per host (and per thread,
+        since httplib connections can not be shared between threads),
+        and gzip/deflate compressed responses are requested and decoded.
+        A single session can be shared by all the scraping code.
+
+        cache is an optional reviewskimmer.utils.cache.DiskCache.
+        Fresh pages are read straight from it, and stale pages
+        are revalidated with If-None-Match/If-Modified-Since.
+
+        proxy is an optional 'host:port' of an HTTP proxy which all
+        requests are sent through (for example, a
+        reviewskimmer.utils.replay.ReplayServer).
+
+        rate_limiter is the reviewskimmer.utils.ratelimit.RateLimiter which
+        throttles the requests sent to each host. By default, it is the
+        limiter shared by all the scraping code, so every session together
+        stays under IMDB's limit. rate_limiter=False turns throttling off
+        (for example, for a local server). Requests which fail
+        with a network error, a 429 or a 5xx are retried up to
+        max_retries times (GETs are safe to retry), backing off
+        (and slowing down the rate limiter) each time.
     """
 
-    if no_user_agent:
-        temp = urllib2.Request(url)
-    else:
-        # taken from http://www.whatsmyuseragent.com/
-        user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_8_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/27.0.1453.110 Safari/537.36'
+    MAX_REDIRECTS=5
+
+    # Server is overloaded or having a temporary problem
+    RETRY_STATUSES=(429,500,502,503,504)
+
+    def __init__(self, timeout=30, user_agent=USER_AGENT, compress=True, cache=None, proxy=None,
+            rate_limiter=None, max_retries=3):
+        self.timeout=timeout
+        self.user_agent=user_agent
+        self.compress=compress
+        self.cache=cache
+        self.proxy=proxy
+        if rate_limiter is None:
+            rate_limiter=get_default_rate_limiter()
+        elif rate_limiter is False:
+            rate_limiter=None
+        self.rate_limiter=rate_limiter
+        self.max_retries=max_retries
+        self._local=threading.local()
+
+    def _connections(self):
+        if not hasattr(self._local,'connections'):
+            self._local.connections=dict()
+        return self._local.connections
+
+    def _get_connection(self, scheme, host):
+        connections=self._connections()
+        key=(scheme,host)
+        if key not in connections:
+            if scheme == 'https':
+                connections[key]=httplib.HTTPSConnection(host, timeout=self.timeout)
+            else:
+                connections[key]=httplib.HTTPConnection(host, timeout=self.timeout)
+        return connections[key]
+
+    def _drop_connection(self, scheme, host):
+        connection=self._connections().pop((scheme,host),None)
+        if connection is not None:
+            connection.close()
+
+    def close(self):
+        """ Close all connections opened by the current thread. """
+        for scheme,host in self._connections().keys():
+            self._drop_connection(scheme,host)
+
+    def get_headers(self, no_user_agent=False):
+        headers={'Connection':'keep-alive'}
+        if self.user_agent is not None and not no_user_agent:
+            headers['User-Agent']=self.user_agent
+        if self.compress:
+            headers['Accept-Encoding']='gzip, deflate'
+        return headers
+
+    def _request(self, url, headers):
+        """ Send one GET request, retrying once if a kept-alive
+            connection was closed by the server. """
+        parsed=urlparse.urlsplit(url)
+        if self.proxy is not None:
+            # proxies are sent the full url
+            scheme,host,path='http',self.proxy,url
+        else:
+            scheme,host=parsed.scheme,parsed.netloc
+            path=parsed.path or '/'
+            if parsed.query: path+='?'+parsed.query
+
+        for attempt in range(2):
+            connection=self._get_connection(scheme, host)
+            try:
+                connection.request('GET', path, headers=headers)
+                response=connection.getresponse()
+                body=response.read()
+            except (httplib.HTTPException, socket.error):
+                self._drop_connection(scheme, host)
+                if attempt == 1: raise
+                continue
+
+            if response.getheader('connection','').lower() == 'close':
+                self._drop_connection(scheme, host)
+
+            return response, body
+
+    def _request_with_retries(self, url, headers):
+        host=urlparse.urlsplit(url).netloc
+        attempt=0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.wait(host)
+
+            retry_after=None
+            try:
+                response,body=self._request(url, headers)
+            except (httplib.HTTPException, socket.error), ex:
+                if attempt >= self.max_retries: raise
+                print 'Error reading %s (%s), retrying' % (url, ex)
+            else:
+                if response.status not in self.RETRY_STATUSES or attempt >= self.max_retries:
+                    if self.rate_limiter is not None and response.status not in self.RETRY_STATUSES:
+                        self.rate_limiter.succeeded(host)
+                    return response, body
+                print 'Error %s reading %s, retrying' % (response.status, url)
+                retry_after=response.getheader('retry-after')
+
+            if self.rate_limiter is not None:
+                delay=self.rate_limiter.throttled(host, attempt, retry_after)
+            else:
+                delay=2**attempt
+            time.sleep(delay)
+            attempt+=1
+
+    @staticmethod
+    def decompress(body, encoding):
+        if encoding == 'gzip':
+            return zlib.decompress(body, 16+zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            try:
+                return zlib.decompress(body)
+            except zlib.error:
+                # some servers send raw deflate data without the zlib header
+                return zlib.decompress(body, -zlib.MAX_WBITS)
+        return body
+
+    def get(self, url, headers=None, no_user_agent=False):
+        """ GET a url, following redirects. Raises a urllib2.HTTPError
+            for error responses. """
 
+        if self.cache is None:
+            return self._get(url, headers, no_user_agent)
 
-        headers = { 'User-Agent' : user_agent }
+        entry=self.cache.get(url)
+        if entry is not None and self.cache.is_fresh(entry):
+            return HTTPResponse(url, 200, dict(), entry.body)
 
-        temp = urllib2.Request(url, '', headers)
+        _headers=dict() if headers is None else dict(headers)
+        if entry is not None:
+            if entry.etag is not None:
+                _headers['If-None-Match']=entry.etag
+            if entry.last_modified is not None:
+                _headers['If-Modified-Since']=entry.last_modified
+
+        response=self._get(url, _headers, no_user_agent)
+
+        if response.status == 304 and entry is not None:
+            self.cache.touch(url)
+            return HTTPResponse(url, 200, response.headers, entry.body)
+
+        self.cache.put(url, response.body,
+                etag=response.headers.get('etag'),
+                last_modified=response.headers.get('last-modified'))
+        return response
+
+    def _get(self, url, headers, no_user_agent):
+
+        _headers=self.get_headers(no_user_agent)
+        if headers is not None: _headers.update(headers)
+
+        for i in range(self.MAX_REDIRECTS+1):
+            response,body=self._request_with_retries(url, _headers)
+            body=self.decompress(body, response.getheader('content-encoding','').lower())
+
+            location=response.getheader('location')
+            if response.status in (301,302,303,307) and location is not None:
+                url=urlparse.urljoin(url,location)
+                continue
+
+            response_headers=dict(response.getheaders())
+            if response.status >= 400:
+                raise urllib2.HTTPError(url, response.status, response.reason,
+                        response_headers, StringIO(body))
+
+            return HTTPResponse(url, response.status, response_headers, body)
+
+        raise urllib2.HTTPError(url, response.status, 'Too many redirects',
+                dict(response.getheaders()), StringIO(body))
+
+
+_default_session=None
+
+def get_default_session():
+    """ The session shared by all calls to get_soup
+        which do not specify their own. """
+    global _default_session
+    if _default_session is None:
+        _default_session=HTTPSession()
+    return _default_session
+
+def set_default_session(session):
+    global _default_session
+    _default_session=session
+
+
+def get_soup(url, no_user_agent=False, session=None, parse_only=None):
+    """ Code inspired by:
+            http://www.markbartlett.org/web-engineering/web-engineering-1/page-scraping-with-urllib2-beautifulsoup
+
+        parse_only is an optional bs4.SoupStrainer. When given, only
+        the matching parts of the page are built into the soup,
+        which is much faster than parsing the whole page.
+
+        The page is always parsed with HTML_PARSER (lxml, when it is
+        installed), which is the parser BeautifulSoup picks by default.
+    """
+
+    if session is None:
+        session = get_default_session()
 
     try:
-        temp = urllib2.urlopen(temp)
+        response = session.get(url, no_user_agent=no_user_agent)
     except urllib2.HTTPError, error:
         contents = error.read()
         print contents
         raise error
 
-    soup = BeautifulSoup(temp)
+    soup = BeautifulSoup(response.body, HTML_PARSER, parse_only=parse_only)
 
     return soup
 
+_whitespace=re.compile('\s+')
+
 def get_html_text(review_text):
     """ This function takes in a (part of an)
         HTML document, extracts the text out of it
@@ -46,21 +288,20 @@ def get_html_text(review_text):
         Clean the review up by pulling out all the text,
         adding missing periods, and 
     """
-    text=review_text.findAll(text=True)
+    text=[]
+    for i in review_text.findAll(text=True):
+        # remove garbage (new lines, etc ...) from beginning and end of text
+        i=i.strip()
+        if i == '': continue
 
-    # remove garbage (new lines, etc ...) from beginning and end of text
-    text=[i.strip() for i in text if i.strip() != '']
+        # convert new lines and multiple spaces to single spaces
+        i=_whitespace.sub(' ',i)
 
-    # add in missing exclamations
-    text=[i if i[-1] in ['.','!','?'] else i+'.' for i in text]
+        # add in missing exclamations
+        if i[-1] not in ['.','!','?']: i+='.'
 
-    # join all the text with spaces
-    text=' '.join(text)
-
-    # remove new lines
-    text=text.replace('\n', ' ')
+        text.append(i)
 
-    # convert multiple spaces to single spaces
-    text=re.sub('\s+',' ',text)
-    return clean_unicode(text)
+    # join all the text with spaces
+    return clean_unicode(' '.join(text))
 
@@ -6,33 +6,72 @@ import traceback
 import sys
 from os.path import expandvars
 import urllib
-from reviewskimmer.imdb.poster import scrape_movie_poster_thumbnail,injest_movie_poster_into_s3
+from reviewskimmer.imdb.poster import scrape_movie_poster_thumbnail,injest_movie_poster_into_s3,S3_URL,POSTER_FORMATS
 from reviewskimmer.imdb import scrape
 from reviewskimmer.utils.strings import strip_unicode
 
 def get_search_url(imdb_movie_id,connector):
     movie_name=connector.get_movie_name(imdb_movie_id)
+    return _get_search_url(movie_name)
+
+def _get_search_url(movie_name):
     url='/search.html?q='+urllib.quote(movie_name)
     return url
 
-def get_poster_thumbnail(imdb_movie_id,connector):
-    path='https://s3-us-west-2.amazonaws.com/reviewskimmer/poster_thumbnail_%d.jpg' % imdb_movie_id
-    url=get_search_url(imdb_movie_id,connector)
-    return '<a href="%s"><img class="img-polaroid" src="%s"></a>' % (url,path)
+# The poster size to show on high density screens
+RETINA_POSTER_SIZES=dict(small='medium', medium='retina', retina='retina')
+
+def get_poster_html(imdb_movie_id,derivatives,size='medium'):
+    """ The <img> for a movie's poster of a given size (see
+        reviewskimmer.imdb.poster.POSTER_SIZES). derivatives comes from
+        connector.get_poster_derivatives. Movies without derivatives
+        get the original thumbnail. """
+    if (size,'jpeg') not in derivatives:
+        path='%s/poster_thumbnail_%d.jpg' % (S3_URL,imdb_movie_id)
+        return '<img class="img-polaroid" src="%s">' % path
+
+    def srcset(format):
+        return '%s/%s 1x, %s/%s 2x' % (S3_URL,derivatives[size,format],
+                S3_URL,derivatives.get((RETINA_POSTER_SIZES[size],format),derivatives[size,format]))
+
+    sources=''.join('<source type="%s" srcset="%s">' % (content_type,srcset(format))
+            for format,content_type in POSTER_FORMATS.items()
+            if format != 'jpeg' and (size,format) in derivatives)
+
+    return '<picture>%s<img class="img-polaroid" src="%s/%s" srcset="%s"></picture>' % \
+            (sources,S3_URL,derivatives[size,'jpeg'],srcset('jpeg'))
+
+def get_poster_thumbnail(imdb_movie_id,connector,size='medium'):
+    return get_poster_thumbnails([imdb_movie_id],connector,size)[0]
+
+def get_poster_thumbnails(imdb_movie_ids,connector,size='medium'):
+    """ The linked posters of many movies, reading the movies'
+        names and posters with one query each. """
+    names=connector.get_movie_names(imdb_movie_ids)
+    derivatives=connector.get_poster_derivatives_for_movies(imdb_movie_ids)
+    thumbnails=[]
+    for imdb_movie_id in imdb_movie_ids:
+        if imdb_movie_id not in names:
+            raise Exception("Movie %d is not in the database" % imdb_movie_id)
+        url=_get_search_url(names[imdb_movie_id])
+        thumbnails.append('<a href="%s">%s</a>' % (url,get_poster_html(imdb_movie_id,derivatives[imdb_movie_id],size)))
+    return thumbnails
 
 def get_top_grossing_imdb_movie_ids(connector, years, movies_per_year):
     top_grossing=connector.get_top_grossing()
     movies=OrderedDict()
     for year in years:
         temp=top_grossing[top_grossing['rs_year']==year]
-        temp.sort('rs_ranking')
+        temp=temp.sort('rs_ranking')
         movies[year]=temp['rs_imdb_movie_id'][:4].tolist()
     return movies
 
-def get_top_grossing_thumbnails(connector, years, movies_per_year):
+def get_top_grossing_thumbnails(connector, years, movies_per_year, size='medium'):
     movies=get_top_grossing_imdb_movie_ids(connector, years, movies_per_year)
+    imdb_movie_ids=[i for year in movies.keys() for i in movies[year]]
+    thumbnails=dict(zip(imdb_movie_ids,get_poster_thumbnails(imdb_movie_ids,connector,size)))
     for year in movies.keys():
-        movies[year]=[get_poster_thumbnail(i,connector) for i in movies[year]]
+        movies[year]=[thumbnails[i] for i in movies[year]]
     return movies
 
 def format_quotes(top_quotes):
@@ -99,3 +138,11 @@ def get_bottom_for_website(connector):
     bottom=connector.get_bottom_100_all_time()['rs_imdb_movie_id']
     bottom=bottom.tolist()[:10]
     return bottom
+
+def get_charts_thumbnails(connector, size='small'):
+    """ The linked posters of the top and of the bottom movies
+        on the charts page, read together with one query each. """
+    top=get_top_for_website(connector)
+    bottom=get_bottom_for_website(connector)
+    thumbnails=get_poster_thumbnails(top+bottom,connector,size)
+    return thumbnails[:len(top)],thumbnails[len(top):]
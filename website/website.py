@@ -18,24 +18,70 @@ app = Flask(__name__)
 application = app # This is needed by elastic beanstalk
 
 from reviewskimmer.database.dbconnect import IMDBDatabaseConnector
+from reviewskimmer.database.pool import ConnectionPool
+from reviewskimmer.database.snapshot import SnapshotConnector
+from reviewskimmer.database.caching import CachingConnector
+from reviewskimmer.utils.cache import LRUCache
 import MySQLdb
 
-@app.before_request
-def before_request():
-    flask.g.db=MySQLdb.Connection(host=os.environ['RDS_HOSTNAME'],
+def _connect():
+    return MySQLdb.Connection(host=os.environ['RDS_HOSTNAME'],
             user=os.environ['RDS_USERNAME'],
             port=int(os.environ['RDS_PORT']),
             passwd=os.environ['RDS_PASSWORD'],
             db=os.environ['RDS_DB_NAME'])
-    flask.g.connector=IMDBDatabaseConnector(flask.g.db)
+
+pool=ConnectionPool(_connect,
+        max_size=int(os.environ.get('RS_DB_POOL_SIZE',10)),
+        max_lifetime=int(os.environ.get('RS_DB_POOL_MAX_LIFETIME',3600)))
+
+# When set, pages are read from a local snapshot (see
+# reviewskimmer.database.snapshot), and MySQL is only used
+# for what isn't in it.
+snapshot=os.environ.get('REVIEWSKIMMER_SNAPSHOT')
+
+# movies, names, posters and quotes read by recent requests
+connector_cache=LRUCache(
+        max_size=int(os.environ.get('RS_CONNECTOR_CACHE_SIZE',10000)),
+        ttl=int(os.environ.get('RS_CONNECTOR_CACHE_TTL',5*60)))
+
+def _get_mysql_connector():
+    flask.g.db=pool.get()
+    return IMDBDatabaseConnector(flask.g.db)
+
+@app.before_request
+def before_request():
+    flask.g.db=None
+    flask.g.snapshot=None
+    if snapshot:
+        flask.g.snapshot=SnapshotConnector(expandvars(snapshot), get_fallback=_get_mysql_connector)
+        connector=flask.g.snapshot
+    else:
+        # only connect if something isn't cached
+        connector=_get_mysql_connector
+    flask.g.connector=CachingConnector(connector, connector_cache)
 
 @app.teardown_request
 def teardown_request(exception):
+    if getattr(flask.g,'snapshot',None) is not None:
+        flask.g.snapshot.close()
+    db=getattr(flask.g,'db',None)
+    if db is not None:
+        pool.put(db, discard=exception is not None)
     flask.g.db = None
+    flask.g.snapshot = None
     flask.g.connector = None
 
 app.debug=True
 
+@app.context_processor
+def poster_thumbnail():
+    """ Lets templates ask for a poster of the right size, 
+        e.g. {{ poster_thumbnail(imdb_movie_id, 'small')|safe }} """
+    def _poster_thumbnail(imdb_movie_id, size='medium'):
+        return helpers.get_poster_thumbnail(imdb_movie_id,flask.g.connector,size)
+    return dict(poster_thumbnail=_poster_thumbnail)
+
 def _get_top_grossing(connector,thumbnails=False):
     kwargs=dict(years=range(2013,2005,-1), movies_per_year=4)
     if thumbnails:
@@ -84,12 +130,7 @@ def search():
 
 @app.route('/charts.html')
 def charts():
-    top=helpers.get_top_for_website(flask.g.connector)
-    bottom=helpers.get_bottom_for_website(flask.g.connector)
-
-    top=[helpers.get_poster_thumbnail(i,flask.g.connector) for i in top]
-    bottom=[helpers.get_poster_thumbnail(i,flask.g.connector) for i in bottom]
-
+    top,bottom=helpers.get_charts_thumbnails(flask.g.connector,size='small')
     return render_template('charts.html', top=top, bottom=bottom)
 
 
@@ -131,6 +172,11 @@ def secret():
             message=helpers.try_load_poster(imdb_movie_id,connector=flask.g.connector)
         except Exception, ex:
             message='<div class="alert alert-error">Unable to injest movie! %s</div>' % ex
+    elif user_request == 'poolstats':
+        stats=pool.get_stats()
+        stats.update(('cache_'+k,v) for k,v in connector_cache.get_stats().items())
+        message='<div class="alert alert-info">%s</div>' % ', '.join(
+                '%s=%s' % (k,round(v,4) if isinstance(v,float) else v) for k,v in sorted(stats.items()))
     elif user_request is None:
         message=None
     else: